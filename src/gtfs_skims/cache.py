@@ -0,0 +1,141 @@
+"""Content-addressed cache of pre-processed GTFS tables."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional
+
+from gtfs_skims import __version__
+from gtfs_skims.utils import Config, GTFSData
+
+# config settings that affect the pre-processed GTFS tables
+CACHE_KEY_SETTINGS = ["calendar_date", "start_s", "end_s", "epsg_centroids", "bounding_box"]
+# storage format of the cached tables (memory-mapped when loaded)
+CACHE_FORMAT = "arrow"
+
+
+def hash_file(path: str, chunk_size: int = 2**20) -> str:
+    """Get the SHA-256 hash of a file's contents.
+
+    Args:
+        path (str): Path to the file.
+        chunk_size (int, optional): Bytes to read at a time. Defaults to 2**20.
+
+    Returns:
+        str: Hex digest.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_cache_key(config: Config) -> str:
+    """Get the cache key of a preprocessing run.
+        The key combines the hash of the GTFS file, the preprocessing settings and the library version.
+
+    Args:
+        config (Config): Config object.
+
+    Returns:
+        str: Cache key.
+    """
+    key = {
+        "gtfs": hash_file(config.path_gtfs),
+        "version": __version__,
+        **{x: getattr(config, x) for x in CACHE_KEY_SETTINGS},
+    }
+    key = json.dumps(key, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_cached(path_cache: str, key: str) -> Optional[GTFSData]:
+    """Load pre-processed GTFS tables from the cache.
+
+    Args:
+        path_cache (str): Cache directory.
+        key (str): Cache key.
+
+    Returns:
+        Optional[GTFSData]: GTFS data object, or None if the key is not cached.
+    """
+    path = os.path.join(path_cache, key)
+    if not os.path.exists(path):
+        return None
+
+    data = GTFSData.from_parquet(path, fmt=CACHE_FORMAT)
+    os.utime(path)  # mark as recently used
+    return data
+
+
+def save_cached(path_cache: str, key: str, data: GTFSData) -> None:
+    """Save pre-processed GTFS tables to the cache.
+
+    Args:
+        path_cache (str): Cache directory.
+        key (str): Cache key.
+        data (GTFSData): GTFS data object.
+    """
+    path = os.path.join(path_cache, key)
+    path_tmp = f"{path}.{os.getpid()}.tmp"
+    data.save(path_tmp, fmt=CACHE_FORMAT)
+    if os.path.exists(path):
+        shutil.rmtree(path_tmp)
+    else:
+        os.replace(path_tmp, path)
+
+
+def get_size(path: str) -> int:
+    """Get the total size of the files in a directory.
+
+    Args:
+        path (str): Directory.
+
+    Returns:
+        int: Size (bytes).
+    """
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def evict(
+    path_cache: str, max_size_mb: Optional[float] = None, max_age_days: Optional[float] = None
+) -> list[str]:
+    """Remove cache entries beyond a maximum age, and then the least recently used entries
+        until the cache fits within a maximum size.
+
+    Args:
+        path_cache (str): Cache directory.
+        max_size_mb (Optional[float], optional): Maximum cache size (MB). Defaults to None.
+        max_age_days (Optional[float], optional): Maximum age of a cache entry since it was last used (days).
+            Defaults to None.
+
+    Returns:
+        list[str]: The evicted keys.
+    """
+    entries = [
+        entry
+        for entry in os.scandir(path_cache)
+        if entry.is_dir() and not entry.name.endswith(".tmp")
+    ]
+    entries = sorted(entries, key=lambda x: x.stat().st_mtime, reverse=True)  # most recent first
+
+    evicted = []
+    if max_age_days is not None:
+        min_mtime = time.time() - max_age_days * 86400
+        evicted += [x for x in entries if x.stat().st_mtime < min_mtime]
+    if max_size_mb is not None:
+        size = 0
+        for entry in [x for x in entries if x not in evicted]:
+            size += get_size(entry.path)
+            if size > max_size_mb * 1e6:
+                evicted.append(entry)
+
+    for entry in evicted:
+        shutil.rmtree(entry.path)
+
+    return [x.name for x in evicted]
@@ -20,10 +20,40 @@ def cli(args=None):
 @cli.command()
 @click.argument("config_path")
 @click.option("--output_directory_override", default=None, help="override output directory")
-def run(config_path: str, output_directory_override: Optional[str] = None):
+@click.option(
+    "--graph_workers",
+    default=None,
+    type=click.IntRange(min=1),
+    help="override the number of shortest distances workers",
+)
+@click.option(
+    "--graph_chunksize",
+    default=None,
+    type=click.IntRange(min=1),
+    help="override the number of origins per shortest distances task",
+)
+@click.option(
+    "--graph_start_method",
+    default=None,
+    type=click.Choice(["fork", "spawn", "forkserver"]),
+    help="override the start method of the shortest distances workers",
+)
+def run(
+    config_path: str,
+    output_directory_override: Optional[str] = None,
+    graph_workers: Optional[int] = None,
+    graph_chunksize: Optional[int] = None,
+    graph_start_method: Optional[str] = None,
+):
     config = Config.from_yaml(config_path)
     if output_directory_override is not None:
         config.path_outputs = output_directory_override
+    if graph_workers is not None:
+        config.graph_workers = graph_workers
+    if graph_chunksize is not None:
+        config.graph_chunksize = graph_chunksize
+    if graph_start_method is not None:
+        config.graph_start_method = graph_start_method
     steps = config.steps
 
     gtfs_data = None
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
+import multiprocessing
 import os
-from functools import cached_property
-from typing import Optional
+import tempfile
+from typing import Iterator, Optional
 
 import numpy as np
 import pandas as pd
 from scipy.spatial import KDTree
 
-from gtfs_skims.utils import Config, ConnectorsData, GTFSData, get_logger
-from gtfs_skims.variables import DATA_TYPE
+from gtfs_skims.utils import Config, ConnectorsData, GTFSData, get_logger, narrow
+from gtfs_skims.variables import DATA_TYPE, NODE_TYPE, TIME_TYPES
 
+# approximate memory use of each candidate transfer connector while filtering (bytes)
+CANDIDATE_BYTES = 128
 
-def query_pairs(coords: np.ndarray, radius: float) -> np.array:
+
+def query_pairs(
+    coords: np.ndarray, radius: float, is_origin: Optional[np.ndarray] = None
+) -> np.array:
     """Get origin-destination pairs between points, within a radius.
         The connections are forward-looking in z: ie the destination point
             has always greater z coordinate than the origin point.
@@ -20,10 +26,20 @@ def query_pairs(coords: np.ndarray, radius: float) -> np.array:
     Args:
         coords (np.ndarray): Point coordinates (x, y, z)
         radius (float): Maximum distance between points
+        is_origin (Optional[np.ndarray], optional): If provided, only search connections
+            starting from these points (boolean mask). Defaults to None.
 
     Returns:
         np.array: Feasible connections between points.
     """
+    if is_origin is not None:
+        origins = np.flatnonzero(is_origin)
+        pairs = KDTree(coords[origins]).sparse_distance_matrix(
+            KDTree(coords), max_distance=radius, p=2, output_type="ndarray"
+        )
+        ods = np.column_stack([origins[pairs["i"]], pairs["j"]])
+        return ods[coords[ods[:, 1], 2] > coords[ods[:, 0], 2]]
+
     ids = coords[:, 2].argsort()
 
     dtree = KDTree(coords[ids])
@@ -32,47 +48,187 @@ def query_pairs(coords: np.ndarray, radius: float) -> np.array:
     return ids[connectors]
 
 
+def expand_ranges(starts: np.ndarray, lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Expand a set of integer ranges to their members.
+
+    Args:
+        starts (np.ndarray): Start of each range.
+        lengths (np.ndarray): Length of each range.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The range index and the value of each member.
+    """
+    idx = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(len(idx)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return idx, starts[idx] + offsets
+
+
+def query_pairs_stops(
+    coords: np.ndarray, stop_ids: np.ndarray, radius: float, is_origin: Optional[np.ndarray] = None
+) -> np.array:
+    """Get origin-destination pairs between points, within a radius.
+        The connections are forward-looking in z: ie the destination point
+            has always greater z coordinate than the origin point.
+        The candidate pairs are searched in two levels: first, the stops within the radius
+            of each other are found (on the xy axis), and then the points of each stop pair
+            are joined within the time (z) window, using a sorted search.
+        The result includes all (forward-looking) pairs within the radius on xy and z separately,
+            ie it is a superset of the `query_pairs` pairs with dz > dxy.
+
+    Args:
+        coords (np.ndarray): Point coordinates (x, y, z)
+        stop_ids (np.ndarray): The stop of each point. Points of the same stop must have the same xy coordinates.
+        radius (float): Maximum distance between points
+        is_origin (Optional[np.ndarray], optional): If provided, only search connections
+            starting from these points (boolean mask). Defaults to None.
+
+    Returns:
+        np.array: Feasible connections between points.
+    """
+    codes, uniques = pd.factorize(stop_ids)
+    stop_coords = np.zeros((len(uniques), 2), dtype=coords.dtype)
+    stop_coords[codes] = coords[:, :2]
+
+    # walkable stop pairs (in both directions, including the stop itself)
+    stop_pairs = KDTree(stop_coords).query_pairs(r=radius, output_type="ndarray", p=2)
+    stop_pairs = np.concatenate(
+        [stop_pairs, stop_pairs[:, ::-1], np.repeat(np.arange(len(uniques)), 2).reshape(-1, 2)]
+    )
+    stop_walk = ((stop_coords[stop_pairs[:, 0]] - stop_coords[stop_pairs[:, 1]]) ** 2).sum(1) ** 0.5
+
+    # sort points by stop and z, and give them a (sorted) stop-z search key
+    z = coords[:, 2] - coords[:, 2].min()
+    ids = np.lexsort((z, codes))
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.cumsum(counts) - counts
+    span = z.max() + radius + 2  # keeps the keys of each stop in a separate interval
+    keys = codes[ids] * span + z[ids]
+
+    # origin points of each stop pair
+    pair, pos_o = expand_ranges(starts[stop_pairs[:, 0]], counts[stop_pairs[:, 0]])
+    if is_origin is not None:
+        is_selected = is_origin[ids[pos_o]]
+        pair, pos_o = pair[is_selected], pos_o[is_selected]
+
+    # destination points of the pair: walk < dz <= radius (with a tolerance of 1 unit)
+    key_o = stop_pairs[pair, 1] * span + z[ids[pos_o]]
+    lo = np.searchsorted(keys, key_o + stop_walk[pair] - 1, side="right")
+    hi = np.searchsorted(keys, key_o + radius + 1, side="right")
+
+    idx, pos_d = expand_ranges(lo, hi - lo)
+    ods = np.column_stack([ids[pos_o[idx]], ids[pos_d]])
+
+    return ods
+
+
+def group_argmin(groups: np.ndarray, values: np.ndarray, tiebreak: np.ndarray) -> np.ndarray:
+    """Get the position of the minimum value of each group.
+
+    Args:
+        groups (np.ndarray): Group (integer key) of each element.
+        values (np.ndarray): Values to minimise.
+        tiebreak (np.ndarray): If multiple elements of a group share the minimum value,
+            the one with the minimum tiebreak (integer) value is selected.
+            It must be unique within each group.
+
+    Returns:
+        np.ndarray: Sorted positions of the selected elements, one per group.
+    """
+    if len(groups) == 0:
+        return np.array([], dtype=int)
+
+    # sort by group, and find the group boundaries
+    idx_sorted = np.argsort(groups)
+    groups_sorted = groups[idx_sorted]
+    is_start = np.ones(len(groups_sorted), dtype=bool)
+    np.not_equal(groups_sorted[1:], groups_sorted[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    sizes = np.diff(np.append(starts, len(groups_sorted)))
+
+    # group minimum, then minimum tiebreak among the elements with the minimum value
+    values_sorted = values[idx_sorted]
+    is_min = values_sorted == np.repeat(np.minimum.reduceat(values_sorted, starts), sizes)
+    tiebreak_sorted = np.where(is_min, tiebreak[idx_sorted], np.iinfo(tiebreak.dtype).max)
+    is_min &= tiebreak_sorted == np.repeat(np.minimum.reduceat(tiebreak_sorted, starts), sizes)
+
+    return np.sort(idx_sorted[is_min])
+
+
 class TransferConnectors:
-    def __init__(self, coords: np.ndarray, max_transfer_distance: float) -> None:
+    def __init__(
+        self,
+        coords: np.ndarray,
+        max_transfer_distance: float,
+        stop_ids: Optional[np.ndarray] = None,
+        is_origin: Optional[np.ndarray] = None,
+    ) -> None:
         """Manages transfer connectors.
 
         Args:
             coords (np.ndarray): Point coordinates (x, y, z)
             max_transfer_distance (float): Maximum distance between points
+            stop_ids (Optional[np.ndarray], optional): The stop of each point.
+                If provided, candidate connectors are searched at stop level (see `query_pairs_stops`),
+                otherwise with a 3D KDTree over all points. Defaults to None.
+            is_origin (Optional[np.ndarray], optional): If provided, only search connectors
+                starting from these points (boolean mask). Defaults to None.
         """
         self.coords = coords
-        radius = max_transfer_distance * (2**0.5)
-        self.ods = query_pairs(coords, radius=radius)
+        if stop_ids is None:
+            radius = max_transfer_distance * (2**0.5)
+            self.ods = query_pairs(coords, radius=radius, is_origin=is_origin)
+        else:
+            self.ods = query_pairs_stops(
+                coords, stop_ids, radius=max_transfer_distance, is_origin=is_origin
+            )
+
+    @property
+    def ods(self) -> np.array:
+        """Origin-destination point indices.
 
-    @cached_property
+        Returns:
+            np.array: origin index, destination index
+        """
+        self._materialize()
+        return self._ods
+
+    @ods.setter
+    def ods(self, ods: np.ndarray) -> None:
+        self._ods = narrow(ods, [NODE_TYPE], "point ids")
+        self._mask = None  # pending (not yet applied) filters
+        self._columns = {}  # connector attributes, aligned with self._ods
+
+    @property
     def ocoords(self) -> np.array:
         """Origin coordinates.
 
         Returns:
             np.array: x, y, z
         """
-        return self.coords[self.ods[:, 0]]
+        self._materialize()
+        return self._column("ocoords")
 
-    @cached_property
+    @property
     def dcoords(self) -> np.array:
         """Destination coordinates.
 
         Returns:
             np.array: x, y, z
         """
-        return self.coords[self.ods[:, 1]]
+        self._materialize()
+        return self._column("dcoords")
 
-    @cached_property
+    @property
     def walk(self) -> np.array:
         """Walk distance (euclidean).
 
         Returns:
             np.array: Distance from origin to destination point (on the xy axis).
         """
-        walk = ((self.dcoords[:, :2] - self.ocoords[:, :2]) ** 2).sum(1) ** 0.5
-        return walk
+        self._materialize()
+        return self._column("walk")
 
-    @cached_property
+    @property
     def wait(self) -> np.array:
         """Wait distance. It is calculated as the difference between timestamps (dz)
             and the distance required to walk to the destination.
@@ -80,29 +236,98 @@ class TransferConnectors:
         Returns:
             np.array: Wait distance.
         """
-        wait = self.dcoords[:, 2] - self.ocoords[:, 2] - self.walk
-        return wait
+        self._materialize()
+        return self._column("wait")
+
+    @property
+    def _coords_origins(self) -> np.array:
+        return self.coords
+
+    @property
+    def _coords_destinations(self) -> np.array:
+        return self.coords
+
+    def _column(self, name: str) -> np.array:
+        """Get a connector attribute, without applying any pending filters.
+            The walk and wait distances are calculated together, one axis at a time,
+            without storing the origin and destination coordinates.
+
+        Args:
+            name (str): Attribute name (ocoords, dcoords, walk or wait).
+
+        Returns:
+            np.array: The attribute values, aligned with the unfiltered origin-destination pairs.
+        """
+        if name not in self._columns:
+            coords_o = self._coords_origins
+            coords_d = self._coords_destinations
+            if name == "ocoords":
+                self._columns[name] = coords_o[self._ods[:, 0]]
+            elif name == "dcoords":
+                self._columns[name] = coords_d[self._ods[:, 1]]
+            else:
+                idx_o = self._ods[:, 0]
+                idx_d = self._ods[:, 1]
+
+                walk = None
+                for axis in range(2):
+                    delta = np.subtract(coords_d[idx_d, axis], coords_o[idx_o, axis], dtype=float)
+                    delta *= delta
+                    walk = delta if walk is None else walk + delta
+                walk = walk**0.5
+                self._columns["walk"] = walk
+
+                if coords_o.shape[1] > 2:
+                    wait = np.subtract(coords_d[idx_d, 2], coords_o[idx_o, 2], dtype=float)
+                    self._columns["wait"] = wait - walk
+        return self._columns[name]
+
+    def _materialize(self) -> None:
+        """Apply the pending filters to the origin-destination data (in one pass)."""
+        if self._mask is None:
+            return
+        mask = self._mask
+        self._mask = None
+        self._ods = self._ods[mask]
+        for name, values in self._columns.items():
+            self._columns[name] = values[mask]
 
     def filter(self, cond: np.ndarray[bool]) -> None:
         """Filter (in-place) Connnectors' origin-destination data based on a set of conditions.
+            The filter is lazy: the conditions are combined in a single mask,
+            which is only applied when the connectors data are accessed.
 
         Args:
             cond np.array[bool]: The boolean condition filter to use.
         """
-        ods = self.ods
-        ocoords = self.ocoords
-        dcoords = self.dcoords
-        walk = self.walk
-        wait = self.wait
-
-        self.ods = ods[cond]
-        self.ocoords = ocoords[cond]
-        self.dcoords = dcoords[cond]
-        self.walk = walk[cond]
-        self.wait = wait[cond]
+        if self._mask is None:
+            self._mask = np.array(cond, dtype=bool)
+        else:
+            self._mask &= cond
 
         return self
 
+    def _active(self) -> np.ndarray:
+        """Get the positions of the connectors kept by the filters so far.
+
+        Returns:
+            np.ndarray: Positions in the unfiltered origin-destination data.
+        """
+        if self._mask is None:
+            return np.arange(len(self._ods))
+        return np.flatnonzero(self._mask)
+
+    def _filter_active(self, idx: np.ndarray, cond: np.ndarray[bool]) -> None:
+        """Filter based on a condition calculated for the connectors kept by the filters so far.
+
+        Args:
+            idx (np.ndarray): Positions of the kept connectors (see `_active`).
+            cond (np.ndarray[bool]): The boolean condition filter, for each kept connector.
+        """
+        if self._mask is None:
+            self._mask = np.zeros(len(self._ods), dtype=bool)
+        self._mask[idx] = cond
+
     def filter_feasible_transfer(self, maxdist: float) -> None:
         """Remove any connections with insufficient transfer time.
 
@@ -110,7 +335,10 @@ class TransferConnectors:
         Args:
             maxdist (float): Maximum transfer distance (walk+wait)
         """
-        is_feasible = (self.wait > 0) & ((self.walk + self.wait) <= maxdist)
+        walk = self._column("walk")
+        wait = self._column("wait")
+        is_feasible = wait > 0
+        is_feasible &= (walk + wait) <= maxdist
         self.filter(is_feasible)
 
     def filter_max_walk(self, max_walk: float) -> None:
@@ -119,7 +347,7 @@ class TransferConnectors:
         Args:
             max_walk (float): Max walk distance
         """
-        cond = self.walk <= max_walk
+        cond = self._column("walk") <= max_walk
         self.filter(cond)
 
     def filter_max_wait(self, max_wait: float) -> None:
@@ -128,7 +356,7 @@ class TransferConnectors:
         Args:
             max_wait (float): Maximum stop (leg) wait time.
         """
-        self.filter(self.wait <= max_wait)
+        self.filter(self._column("wait") <= max_wait)
 
     def filter_same_route(self, routes: np.ndarray) -> None:
         """Remove connections between services of the same route.
@@ -136,7 +364,8 @@ class TransferConnectors:
         Args:
             routes (np.array): Route IDs array. Its indexing matches the self.coords table.
         """
-        self.filter(routes[self.ods[:, 0]] != routes[self.ods[:, 1]])
+        idx = self._active()
+        self._filter_active(idx, routes[self._ods[idx, 0]] != routes[self._ods[idx, 1]])
 
     def filter_nearest_service(self, services: np.ndarray) -> None:
         """If a service can be accessed from a origin through multiple stops,
@@ -145,22 +374,26 @@ class TransferConnectors:
         Args:
             services (np.array): Service IDs array. Its indexing must match the self.coords table.
         """
-        services_d = services[self.ods[:, 1]]  # destination service
-
-        # sort by trasfer distance
-        transfer = self.wait + self.walk
-        idx_sorted = transfer.argsort()
+        idx = self._active()
+        ods = self._ods[idx]
+        services_d = services[ods[:, 1]]  # destination service
+        transfer = self._column("wait")[idx] + self._column("walk")[idx]
 
-        # create origin-service combinations
-        order_o = int(np.floor(np.log10(services.max())) + 1)
-        comb = (self.ods[:, 0] + 1) * 10**order_o + services_d
+        # origin-service groups (integer keys, if the combinations fit in int64)
+        n_services = int(services.max()) + 1
+        if len(self.coords) * n_services < np.iinfo(np.int64).max:
+            groups = ods[:, 0].astype(np.int64) * n_services + services_d
+        else:
+            groups = np.unique(
+                np.column_stack([ods[:, 0], services_d]), axis=0, return_inverse=True
+            )[1].ravel()
 
-        # get first instance of each origin-service combination
-        # (which corresponds to the most efficient transfer)
-        keep = idx_sorted[np.unique(comb[idx_sorted], return_index=True)[1]]
-        cond = np.isin(np.arange(len(comb)), keep)
+        # keep the most efficient transfer of each origin-service group
+        keep = group_argmin(groups, transfer, ods[:, 1])
+        cond = np.zeros(len(idx), dtype=bool)
+        cond[keep] = True
 
-        self.filter(cond)
+        self._filter_active(idx, cond)
 
 
 def query_pairs_od(
@@ -189,6 +422,53 @@ def query_pairs_od(
     return ods
 
 
+def query_pairs_od_stops(
+    coords_origins: np.ndarray, coords_destinations: np.ndarray, stop_ids: np.ndarray, radius: float
+) -> np.array:
+    """Get origin-destination pairs between origin points and stop times, within a radius.
+        The candidate pairs are searched in two levels: first, the stops within the radius
+            of each origin are found (on the xy axis), and then each origin-stop pair is expanded to
+            the stop's departures within the time (z) window, using a sorted search.
+        The result includes all (forward-looking) pairs within the radius on xy and z separately,
+            with the stop time departing after the origin time plus the walk distance.
+
+    Args:
+        coords_origins (np.array): Coordinates of origin points (x, y, z)
+        coords_destinations (np.array): Coordinates of destination stop times (x, y, z)
+        stop_ids (np.ndarray): The stop of each destination point.
+            Points of the same stop must have the same xy coordinates.
+        radius (float): Maximum distance between points
+
+    Returns:
+        np.array: Feasible connections between points.
+    """
+    codes, uniques = pd.factorize(stop_ids)
+    stop_coords = np.zeros((len(uniques), 2), dtype=coords_destinations.dtype)
+    stop_coords[codes] = coords_destinations[:, :2]
+
+    # walkable origin-stop pairs
+    pairs = KDTree(coords_origins[:, :2]).sparse_distance_matrix(
+        KDTree(stop_coords), max_distance=radius, p=2, output_type="ndarray"
+    )
+
+    # sort stop times by stop and z, and give them a (sorted) stop-z search key
+    zmin = min(coords_destinations[:, 2].min(), coords_origins[:, 2].min())
+    z = coords_destinations[:, 2] - zmin
+    ids = np.lexsort((z, codes))
+    span = z.max() + radius + 2  # keeps the keys of each stop in a separate interval
+    keys = codes[ids] * span + z[ids]
+
+    # destination points of the pair: walk < dz <= radius (with a tolerance of 1 unit)
+    key_o = pairs["j"] * span + coords_origins[pairs["i"], 2] - zmin
+    lo = np.searchsorted(keys, key_o + pairs["v"] - 1, side="right")
+    hi = np.searchsorted(keys, key_o + radius + 1, side="right")
+
+    idx, pos_d = expand_ranges(lo, hi - lo)
+    ods = np.column_stack([pairs["i"][idx], ids[pos_d]]).astype(DATA_TYPE)
+
+    return ods
+
+
 class AccessEgressConnectors(TransferConnectors):
     """Connections between zones/endpoints and stops"""
 
@@ -197,41 +477,61 @@ class AccessEgressConnectors(TransferConnectors):
         coords_origins: np.ndarray,
         coords_destinations: np.ndarray,
         max_transfer_distance: float,
+        stop_ids: Optional[np.ndarray] = None,
     ) -> None:
+        """Manages access/egress connectors.
+
+        Args:
+            coords_origins (np.ndarray): Origin point coordinates (x, y (, z))
+            coords_destinations (np.ndarray): Destination point coordinates (x, y (, z))
+            max_transfer_distance (float): Maximum distance between points
+            stop_ids (Optional[np.ndarray], optional): The stop of each destination point (x, y, z).
+                If provided, candidate connectors are searched at stop level (see `query_pairs_od_stops`),
+                otherwise with a KDTree over all destination points. Defaults to None.
+        """
         self.coords_origins = coords_origins
         self.coords_destinations = coords_destinations
 
+        if stop_ids is not None:
+            self.ods = query_pairs_od_stops(
+                coords_origins, coords_destinations, stop_ids, radius=max_transfer_distance
+            )
+            return
+
         radius = max_transfer_distance
         if coords_origins.shape[1] == 3:
             radius += max_transfer_distance * (2**0.5)
 
         self.ods = query_pairs_od(coords_origins, coords_destinations, radius=radius)
 
-    @cached_property
-    def ocoords(self) -> np.array:
-        """Origin coordinates.
-
-        Returns:
-            np.array: x, y (, z)
-        """
-        return self.coords_origins[self.ods[:, 0]]
-
-    @cached_property
-    def dcoords(self) -> np.array:
-        """Destination coordinates.
+    @property
+    def _coords_origins(self) -> np.array:
+        return self.coords_origins
 
-        Returns:
-            np.array: x, y (,z)
-        """
-        return self.coords_destinations[self.ods[:, 1]]
+    @property
+    def _coords_destinations(self) -> np.array:
+        return self.coords_destinations
 
 
-def get_transfer_connectors(data: GTFSData, config: Config) -> np.array:
-    """Get all transfer connectors (between stops).
+def get_transfer_array(
+    coords: np.ndarray,
+    routes: np.ndarray,
+    services: np.ndarray,
+    config: Config,
+    stop_ids: Optional[np.ndarray] = None,
+    is_origin: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Get the transfer connectors between a set of stop times.
 
     Args:
-        data (GTFSData): GTFS data object.
+        coords (np.ndarray): Stop time coordinates (x, y, departure time), with the crow's fly factor applied.
+        routes (np.ndarray): Route ID of each stop time.
+        services (np.ndarray): Service ID of each stop time.
         config (Config): Config object.
+        stop_ids (Optional[np.ndarray], optional): Stop ID of each stop time.
+            If provided, candidates are searched at stop level. Defaults to None.
+        is_origin (Optional[np.ndarray], optional): If provided, only keep connectors starting
+            from these stop times (boolean mask). Defaults to None.
 
     Returns:
         np.ndarray: [origin id, destination id, walk time, wait time]
@@ -241,9 +541,7 @@ def get_transfer_connectors(data: GTFSData, config: Config) -> np.array:
     max_wait_distance = config.max_wait * time_to_distance
 
     # get candidate connectors
-    coords = data.stop_times[["x", "y", "departure_s"]].values
-    coords[:, :2] = coords[:, :2] * config.crows_fly_factor  # crow's fly transformation
-    tc = TransferConnectors(coords, max_transfer_distance)
+    tc = TransferConnectors(coords, max_transfer_distance, stop_ids=stop_ids, is_origin=is_origin)
 
     # apply more narrow filters:
     # enough time to make transfer
@@ -258,11 +556,9 @@ def get_transfer_connectors(data: GTFSData, config: Config) -> np.array:
         tc.filter_max_wait(max_wait_distance)
 
     # not same route
-    routes = data.stop_times["trip_id"].map(data.trips.set_index("trip_id")["route_id"]).values
     tc.filter_same_route(routes)
 
     # most efficient transfer to service
-    services = data.stop_times["trip_id"].map(data.trips.set_index("trip_id")["service_id"]).values
     tc.filter_nearest_service(services)
 
     # construct array
@@ -282,6 +578,205 @@ def get_transfer_connectors(data: GTFSData, config: Config) -> np.array:
     return arr
 
 
+def estimate_pairs(coords: np.ndarray, radius: float, n_sample: int = 1000) -> float:
+    """Estimate the number of point pairs within a radius, from a sample of points.
+
+    Args:
+        coords (np.ndarray): Point coordinates.
+        radius (float): Maximum distance between points.
+        n_sample (int, optional): Number of sampled points. Defaults to 1000.
+
+    Returns:
+        float: Estimated number of pairs.
+    """
+    if len(coords) == 0:
+        return 0
+    rng = np.random.default_rng(0)
+    sample = coords[rng.choice(len(coords), min(n_sample, len(coords)), replace=False)]
+    neighbours = KDTree(coords).query_ball_point(sample, r=radius, return_length=True)
+    return (neighbours - 1).mean() * len(coords) / 2
+
+
+def get_tiles(
+    coords: np.ndarray, buffer: float, n_tiles: int
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Partition points into (x, y, z) tiles.
+        Each point belongs to the core of exactly one tile.
+        Each tile also includes a buffer of the points within `buffer` distance from its core
+        on the x and y axes, and up to `buffer` ahead on the z axis.
+
+    Args:
+        coords (np.ndarray): Point coordinates (x, y, z).
+        buffer (float): Buffer distance around the core of each tile.
+        n_tiles (int): Approximate number of tiles. The tile boundaries are set at the quantiles of each axis.
+
+    Yields:
+        Iterator[tuple[np.ndarray, np.ndarray]]: The indices of the tile's points (core and buffer),
+            and a boolean mask of its core points.
+    """
+    n_axis = int(np.ceil(n_tiles ** (1 / 3) - 1e-9))
+    quantiles = np.linspace(0, 1, n_axis + 1)[1:-1]
+    bins = np.column_stack(
+        [
+            np.searchsorted(np.quantile(coords[:, i], quantiles), coords[:, i], side="right")
+            for i in range(3)
+        ]
+    )
+    for tile in np.unique(bins, axis=0):
+        is_core = (bins == tile).all(1)
+        lower = coords[is_core].min(0) - np.array([buffer, buffer, 0])
+        upper = coords[is_core].max(0) + buffer
+        idx = np.flatnonzero(((coords >= lower) & (coords <= upper)).all(1))
+        yield idx, is_core[idx]
+
+
+def get_n_tiles(coords: np.ndarray, config: Config) -> int:
+    """Get the number of tiles needed to fit the candidate transfer connectors in the memory budget.
+
+    Args:
+        coords (np.ndarray): Stop time coordinates (x, y, departure time), with the crow's fly factor applied.
+        config (Config): Config object.
+
+    Returns:
+        int: Number of tiles. Equal to one if no memory budget (`connectors_memory_mb`) is set.
+    """
+    if config.connectors_memory_mb is None:
+        return 1
+    max_transfer_distance = config.max_transfer_time * config.walk_speed / 3.6
+    n_candidates = estimate_pairs(coords, max_transfer_distance * (2**0.5))
+    n_tiles = int(np.ceil(n_candidates * CANDIDATE_BYTES / (config.connectors_memory_mb * 1e6)))
+    return max(n_tiles, 1)
+
+
+def get_transfer_tile(
+    coords: np.ndarray,
+    routes: np.ndarray,
+    services: np.ndarray,
+    config: Config,
+    stop_ids: Optional[np.ndarray],
+    idx: np.ndarray,
+    is_core: np.ndarray,
+) -> np.ndarray:
+    """Get the transfer connectors starting from the core stop times of a tile.
+
+    Args:
+        coords (np.ndarray): Stop time coordinates (x, y, departure time), with the crow's fly factor applied.
+        routes (np.ndarray): Route ID of each stop time.
+        services (np.ndarray): Service ID of each stop time.
+        config (Config): Config object.
+        stop_ids (Optional[np.ndarray]): Stop ID of each stop time (for a stop-level search).
+        idx (np.ndarray): Indices of the tile's stop times (core and buffer), see `get_tiles`.
+        is_core (np.ndarray): Boolean mask of the tile's core stop times.
+
+    Returns:
+        np.ndarray: [origin id, destination id, walk time, wait time], using the original stop time indices.
+    """
+    arr = get_transfer_array(
+        coords[idx],
+        routes[idx],
+        services[idx],
+        config,
+        stop_ids=None if stop_ids is None else stop_ids[idx],
+        is_origin=is_core,
+    )
+    arr[:, :2] = idx[arr[:, :2]]  # back to the original point indices
+    return arr
+
+
+def get_transfer_array_tiled(
+    coords: np.ndarray,
+    routes: np.ndarray,
+    services: np.ndarray,
+    config: Config,
+    stop_ids: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Get the transfer connectors between a set of stop times, processing them in spatial-temporal tiles.
+        The number of tiles is set so that the candidate connectors of each tile fit within the
+        `connectors_memory_mb` memory budget. The connectors of each tile are streamed to a temporary file
+        in the outputs directory, so that peak memory is bounded by the budget (plus the final connectors array)
+        rather than by the total number of candidate connectors.
+
+    Args:
+        coords (np.ndarray): Stop time coordinates (x, y, departure time), with the crow's fly factor applied.
+        routes (np.ndarray): Route ID of each stop time.
+        services (np.ndarray): Service ID of each stop time.
+        config (Config): Config object.
+        stop_ids (Optional[np.ndarray], optional): Stop ID of each stop time.
+            If provided, candidates are searched at stop level. Defaults to None.
+
+    Returns:
+        np.ndarray: [origin id, destination id, walk time, wait time]
+    """
+    max_transfer_distance = config.max_transfer_time * config.walk_speed / 3.6
+
+    os.makedirs(config.path_outputs, exist_ok=True)
+    with tempfile.TemporaryFile(dir=config.path_outputs) as f:
+        for idx, is_core in get_tiles(
+            coords, max_transfer_distance + 1, get_n_tiles(coords, config)
+        ):
+            arr = get_transfer_tile(coords, routes, services, config, stop_ids, idx, is_core)
+            f.write(arr.tobytes())
+
+        f.seek(0)
+        arr = np.fromfile(f, dtype=DATA_TYPE).reshape(-1, 4)
+
+    return arr
+
+
+def get_transfer_inputs(
+    data: GTFSData, config: Config
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Get the stop time arrays used in the transfer connectors search.
+
+    Args:
+        data (GTFSData): GTFS data object.
+        config (Config): Config object.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+            Coordinates (x, y, departure time) with the crow's fly factor applied, route IDs, service IDs,
+            and stop IDs (only for the stop-level search engine).
+            The route and service IDs are given as integer codes.
+    """
+    coords = narrow(
+        data.stop_times[["x", "y", "departure_s"]].values,
+        [np.float32, np.float64],
+        "stop time coordinates",
+    )
+    coords[:, :2] = coords[:, :2] * config.crows_fly_factor  # crow's fly transformation
+    trips = data.trips.set_index("trip_id")
+    routes, _ = pd.factorize(
+        data.stop_times["trip_id"].map(trips["route_id"]), use_na_sentinel=False
+    )
+    services, _ = pd.factorize(
+        data.stop_times["trip_id"].map(trips["service_id"]), use_na_sentinel=False
+    )
+    routes = narrow(routes, [np.int16, np.int32, np.int64], "route ids")
+    services = narrow(services, [np.int16, np.int32, np.int64], "service ids")
+    stop_ids = data.stop_times["stop_id"].values if config.connectors_engine == "stops" else None
+
+    return coords, routes, services, stop_ids
+
+
+def get_transfer_connectors(data: GTFSData, config: Config) -> np.array:
+    """Get all transfer connectors (between stops).
+        If a memory budget is specified in the config (`connectors_memory_mb`),
+        the connectors are calculated in tiles (see `get_transfer_array_tiled`).
+
+    Args:
+        data (GTFSData): GTFS data object.
+        config (Config): Config object.
+
+    Returns:
+        np.ndarray: [origin id, destination id, walk time, wait time]
+    """
+    coords, routes, services, stop_ids = get_transfer_inputs(data, config)
+
+    if config.connectors_memory_mb is None:
+        return get_transfer_array(coords, routes, services, config, stop_ids=stop_ids)
+    return get_transfer_array_tiled(coords, routes, services, config, stop_ids=stop_ids)
+
+
 def get_access_connectors(data: GTFSData, config: Config, origins: pd.DataFrame) -> np.ndarray:
     """Get all access connectors (between origins and stops).
 
@@ -300,11 +795,19 @@ def get_access_connectors(data: GTFSData, config: Config, origins: pd.DataFrame)
     max_wait_distance = config.max_wait * time_to_distance
 
     # get candidate connectors
-    coords_stops = data.stop_times[["x", "y", "departure_s"]].values
+    coords_stops = narrow(
+        data.stop_times[["x", "y", "departure_s"]].values,
+        [np.float32, np.float64],
+        "stop time coordinates",
+    )
     coords_stops[:, :2] = coords_stops[:, :2] * config.crows_fly_factor  # crow's fly transformation
     coords_origins = (origins[["x", "y"]] * config.crows_fly_factor).assign(z=config.start_s).values
 
-    ac = AccessEgressConnectors(coords_origins, coords_stops, max_transfer_distance)
+    stop_ids = data.stop_times["stop_id"].values if config.connectors_engine == "stops" else None
+
+    ac = AccessEgressConnectors(
+        coords_origins, coords_stops, max_transfer_distance, stop_ids=stop_ids
+    )
 
     # more narrow filtering
     ac.filter_feasible_transfer(max_transfer_distance)
@@ -340,12 +843,21 @@ def get_egress_connectors(data: GTFSData, config: Config, destinations: pd.DataF
             Must include 'x' and 'y' columns, providing the cartesian coordinates of the trip ends.
 
     Returns:
-        np.ndarray: [origin id, destination id, walk time, wait time]
+        np.ndarray: [origin id, destination id, walk time, wait time].
+            With the stop-level engine (`connectors_engine: stops`), the origin id is the index
+            of the stop in the stops table (see `get_alight_connectors`).
     """
     time_to_distance = config.walk_speed / 3.6  # km/hr to meters
 
     # get candidate connectors
-    coords_stops = data.stop_times[["x", "y"]].values
+    if config.connectors_engine == "stops":
+        stops_served = np.unique(
+            pd.Index(data.stops["stop_id"]).get_indexer(data.stop_times["stop_id"])
+        )
+        coords_stops = data.stops[["x", "y"]].values[stops_served]
+    else:
+        coords_stops = data.stop_times[["x", "y"]].values
+    coords_stops = narrow(coords_stops, [np.float32, np.float64], "stop coordinates")
     coords_stops[:, :2] = coords_stops[:, :2] * config.crows_fly_factor  # crow's fly transformation
     coords_destinations = (destinations[["x", "y"]] * config.crows_fly_factor).values
 
@@ -363,10 +875,164 @@ def get_egress_connectors(data: GTFSData, config: Config, destinations: pd.DataF
         .round(1)
         .astype(DATA_TYPE)
     )
+    if config.connectors_engine == "stops":
+        arr[:, 0] = stops_served[arr[:, 0]]  # served stop -> stops table index
+
+    return arr
+
+
+def get_alight_connectors(data: GTFSData, connectors_egress: np.ndarray, offset: int) -> np.ndarray:
+    """Link stop-level egress connectors to the stop times, through an "alight" node per stop.
+        Each stop time is connected to the alight node of its stop (with zero walk and wait time),
+        and the alight node to the destinations within reach of the stop.
+        This avoids repeating the stop-destination connectors for every stop time of a stop.
+
+    Args:
+        data (GTFSData): GTFS data object.
+        connectors_egress (np.ndarray): Stop-level egress connectors,
+            [stop index, destination id, walk time, wait time] (see `get_egress_connectors`).
+        offset (int): Node ID of the alight node of the first stop.
+
+    Returns:
+        np.ndarray: [origin id, destination id, walk time, wait time]
+    """
+    stop_idx = pd.Index(data.stops["stop_id"]).get_indexer(data.stop_times["stop_id"])
+    stop_times_served = np.flatnonzero(np.isin(stop_idx, connectors_egress[:, 0]))
+
+    connectors_alight = np.zeros((len(stop_times_served), 4), dtype=DATA_TYPE)
+    connectors_alight[:, 0] = stop_times_served
+    connectors_alight[:, 1] = stop_idx[stop_times_served] + offset
+
+    connectors_egress = connectors_egress.copy()
+    connectors_egress[:, 0] += offset
+
+    return np.concatenate([connectors_alight, connectors_egress])
+
+
+_worker_inputs = {}
+
+
+def _init_connectors_worker(
+    data: GTFSData,
+    config: Config,
+    origins: pd.DataFrame,
+    destinations: pd.DataFrame,
+    transfer_inputs: tuple,
+) -> None:
+    """Store the inputs of the connectors search in a worker process."""
+    _worker_inputs.update(
+        data=data,
+        config=config,
+        origins=origins,
+        destinations=destinations,
+        transfer_inputs=transfer_inputs,
+    )
+
 
+def _get_connectors_task(task: tuple[str, np.ndarray, Optional[np.ndarray]]) -> np.ndarray:
+    """Get the connectors of a task (a tile of stop times, or a chunk of origins/destinations) in a worker process."""
+    kind, idx, is_core = task
+    config = _worker_inputs["config"]
+    if kind == "transfer":
+        coords, routes, services, stop_ids = _worker_inputs["transfer_inputs"]
+        return get_transfer_tile(coords, routes, services, config, stop_ids, idx, is_core)
+    elif kind == "access":
+        arr = get_access_connectors(
+            _worker_inputs["data"], config, _worker_inputs["origins"].iloc[idx]
+        )
+        arr[:, 0] = idx[arr[:, 0]]
+    else:
+        arr = get_egress_connectors(
+            _worker_inputs["data"], config, _worker_inputs["destinations"].iloc[idx]
+        )
+        arr[:, 1] = idx[arr[:, 1]]
     return arr
 
 
+def get_connectors_parallel(
+    data: GTFSData, config: Config, origins: pd.DataFrame, destinations: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the transfer, access and egress connectors, using a pool of `connectors_workers` processes.
+        The transfer connectors are split in space-time tiles (at least one per worker,
+        or more if needed to meet the `connectors_memory_mb` budget),
+        and the access/egress connectors in chunks of origins/destinations.
+        All tasks run on the same pool, and their results are merged in task order.
+
+    Args:
+        data (GTFSData): GTFS data object.
+        config (Config): Config object.
+        origins (pd.DataFrame): Origin coordinates dataframe.
+        destinations (pd.DataFrame): Destination coordinates dataframe.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Transfer, access and egress connectors.
+            Each is an array of [origin id, destination id, walk time, wait time].
+    """
+    transfer_inputs = get_transfer_inputs(data, config)
+    coords = transfer_inputs[0]
+    max_transfer_distance = config.max_transfer_time * config.walk_speed / 3.6
+    n_workers = config.connectors_workers
+
+    n_tiles = max(get_n_tiles(coords, config), n_workers)
+    tasks = [
+        ("transfer", idx, is_core)
+        for idx, is_core in get_tiles(coords, max_transfer_distance + 1, n_tiles)
+    ]
+    for kind, points in [("access", origins), ("egress", destinations)]:
+        tasks += [
+            (kind, chunk, None)
+            for chunk in np.array_split(np.arange(len(points)), n_workers)
+            if len(chunk) > 0
+        ]
+
+    with multiprocessing.Pool(
+        n_workers,
+        initializer=_init_connectors_worker,
+        initargs=(data, config, origins, destinations, transfer_inputs),
+    ) as pool_obj:
+        results = pool_obj.map(_get_connectors_task, tasks, chunksize=1)
+
+    connectors = []
+    for kind in ["transfer", "access", "egress"]:
+        arrs = [arr for task, arr in zip(tasks, results) if task[0] == kind]
+        connectors.append(np.concatenate(arrs) if arrs else np.empty((0, 4), dtype=DATA_TYPE))
+
+    return tuple(connectors)
+
+
+def sort_connectors(arr: np.ndarray) -> np.ndarray:
+    """Sort connectors by origin and destination index.
+
+    Args:
+        arr (np.ndarray): [origin id, destination id, walk time, wait time]
+
+    Returns:
+        np.ndarray: Sorted connectors.
+    """
+    return arr[np.lexsort((arr[:, 1], arr[:, 0]))]
+
+
+def get_connectors_frame(arr: np.ndarray) -> pd.DataFrame:
+    """Convert a connectors array to a dataframe, sorted by origin and destination node.
+        Node ids are stored as `NODE_TYPE` and walk/wait times with the most compact of `TIME_TYPES`.
+
+    Args:
+        arr (np.ndarray): [origin id, destination id, walk time, wait time]
+
+    Returns:
+        pd.DataFrame: ["onode", "dnode", "walk", "wait"]
+    """
+    arr = sort_connectors(arr)
+    return pd.DataFrame(
+        {
+            "onode": narrow(arr[:, 0], [NODE_TYPE], "origin node ids"),
+            "dnode": narrow(arr[:, 1], [NODE_TYPE], "destination node ids"),
+            "walk": narrow(arr[:, 2], TIME_TYPES, "walk times"),
+            "wait": narrow(arr[:, 3], TIME_TYPES, "wait times"),
+        }
+    )
+
+
 def main(config: Config, data: Optional[GTFSData] = None) -> ConnectorsData:
     """Get feasible connections (transfers, access, egress).
 
@@ -382,27 +1048,37 @@ def main(config: Config, data: Optional[GTFSData] = None) -> ConnectorsData:
     logger = get_logger(os.path.join(config.path_outputs, "log_connectors.log"))
 
     if data is None:
-        data = GTFSData.from_parquet(config.path_outputs)
+        data = GTFSData.from_parquet(config.path_outputs, fmt=config.intermediate_format)
     origins = pd.read_csv(config.path_origins, index_col=0)
     destinations = pd.read_csv(config.path_destinations, index_col=0)
 
     # get feasible connections
-    logger.info("Getting transfer connectors...")
-    connectors_transfer = get_transfer_connectors(data, config)
-    logger.info("Getting access connectors...")
-    connectors_access = get_access_connectors(data, config, origins)
-    logger.info("Getting egress connectors...")
-    connectors_egress = get_egress_connectors(data, config, destinations)
-
-    # convert to dataframe
-    colnames = ["onode", "dnode", "walk", "wait"]
-    connectors_transfer = pd.DataFrame(connectors_transfer, columns=colnames)
-    connectors_access = pd.DataFrame(connectors_access, columns=colnames)
-    connectors_egress = pd.DataFrame(connectors_egress, columns=colnames)
+    if config.connectors_workers > 1:
+        logger.info(f"Getting connectors with {config.connectors_workers} workers...")
+        connectors_transfer, connectors_access, connectors_egress = get_connectors_parallel(
+            data, config, origins, destinations
+        )
+    else:
+        logger.info("Getting transfer connectors...")
+        connectors_transfer = get_transfer_connectors(data, config)
+        logger.info("Getting access connectors...")
+        connectors_access = get_access_connectors(data, config, origins)
+        logger.info("Getting egress connectors...")
+        connectors_egress = get_egress_connectors(data, config, destinations)
 
     # offset IDs for endpoints
-    connectors_access["onode"] += len(data.stop_times)
-    connectors_egress["dnode"] += len(data.stop_times) + len(origins)
+    connectors_access[:, 0] += len(data.stop_times)
+    connectors_egress[:, 1] += len(data.stop_times) + len(origins)
+    if config.connectors_engine == "stops":
+        # alight nodes are numbered after the destinations
+        connectors_egress = get_alight_connectors(
+            data, connectors_egress, offset=len(data.stop_times) + len(origins) + len(destinations)
+        )
+
+    # convert to dataframe
+    connectors_transfer = get_connectors_frame(connectors_transfer)
+    connectors_access = get_connectors_frame(connectors_access)
+    connectors_egress = get_connectors_frame(connectors_egress)
 
     # save
     logger.info(f"Saving connectors to {config.path_outputs}...")
@@ -411,6 +1087,6 @@ def main(config: Config, data: Optional[GTFSData] = None) -> ConnectorsData:
         connectors_access=connectors_access,
         connectors_egress=connectors_egress,
     )
-    connectors.save(config.path_outputs)
+    connectors.save(config.path_outputs, fmt=config.intermediate_format)
 
     return connectors
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from gtfs_skims.dag import DAG, get_levels
+
+BATCH_SEARCH_WINDOW = 64  # initial number of stop times searched for the end of a scan batch
+
+
+def get_scan_order(stop_times: pd.DataFrame) -> np.ndarray:
+    """Get the connection scan order of the stop times.
+        The stop times are sorted by departure time, and then by `stop_sequence`
+        (if the column is included, otherwise by the order of the table),
+        so that consecutive stops of a trip with the same departure time are scanned in sequence.
+
+    Args:
+        stop_times (pd.DataFrame): The stoptimes GTFS table.
+
+    Returns:
+        np.ndarray: Stop time (positional) indices, in scan order.
+    """
+    departures = stop_times["departure_s"].to_numpy()
+    if "stop_sequence" in stop_times.columns:
+        return np.lexsort((stop_times["stop_sequence"].to_numpy(), departures))
+    return np.argsort(departures, kind="stable")
+
+
+def get_scan_batches(order: np.ndarray, ods: np.ndarray) -> np.ndarray:
+    """Split the scan order of the stop times in batches that can be scanned together.
+        Each batch runs up to (and excluding) the first stop time that is reached by
+        a connection (in-vehicle leg or transfer footpath) from within the batch.
+
+    Args:
+        order (np.ndarray): Stop time indices, in scan order (see `get_scan_order`).
+        ods (np.ndarray): Origin and destination stop time of each connection.
+
+    Raises:
+        ValueError: If a connection goes backwards in the scan order.
+
+    Returns:
+        np.ndarray: Batch of each stop time.
+    """
+    n = len(order)
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    if (position[ods[:, 0]] >= position[ods[:, 1]]).any():
+        raise ValueError("The connections should go forward in time (in scan order).")
+
+    # scan position of the last stop time connecting to the stop time at each scan position
+    last_origin = np.full(n, -1, dtype=np.int64)
+    np.maximum.at(last_origin, position[ods[:, 1]], position[ods[:, 0]])
+
+    is_start = np.zeros(n, dtype=np.int64)
+    start = 0
+    while start < n:
+        is_start[start] = 1
+        window = BATCH_SEARCH_WINDOW
+        while True:
+            hits = np.flatnonzero(last_origin[start + 1 : start + 1 + window] >= start)
+            if len(hits) > 0 or start + 1 + window >= n:
+                start = start + 1 + hits[0] if len(hits) > 0 else n
+                break
+            window *= 2
+
+    return (np.cumsum(is_start) - 1)[position]
+
+
+def get_connection_scan(
+    edges: dict[str, np.ndarray], stop_times: pd.DataFrame, n_nodes: int
+) -> DAG:
+    """Organise the graph edges for a (batched) connection scan.
+        The stop times (connections) are levelled by their scan batch, after the origins,
+        so that a topological sweep relaxes the access footpaths first,
+        then scans the in-vehicle legs and transfer footpaths in departure time order,
+        and finally relaxes the egress footpaths (through the alight nodes, if any).
+
+    Args:
+        edges (dict[str, np.ndarray]): Edge arrays, including 'gc' (see `graph.get_edge_arrays`).
+        stop_times (pd.DataFrame): The stoptimes GTFS table. Stop time node ids are their positional indices.
+        n_nodes (int): Number of nodes.
+
+    Returns:
+        DAG: The graph, levelled for the connection scan.
+    """
+    ods = edges["ods"]
+    n = len(stop_times)
+    is_connection = (ods[:, 0] < n) & (ods[:, 1] < n)
+    batches = get_scan_batches(get_scan_order(stop_times), ods[is_connection])
+
+    levels = np.zeros(n_nodes, dtype=np.int32)
+    levels[:n] = batches + 1
+
+    # egress footpaths (to the destinations, or the alight nodes and then the destinations)
+    is_egress_node = np.zeros(n_nodes, dtype=bool)
+    is_egress_node[ods[ods[:, 1] >= n, 1]] = True
+    egress_levels = get_levels(ods[(ods[:, 0] >= n) & (ods[:, 1] >= n)], n_nodes)
+    levels[is_egress_node] = batches.max(initial=-1) + 2 + egress_levels[is_egress_node]
+
+    return DAG.from_edges(ods, edges["gc"], n_nodes, levels=levels)
@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from gtfs_skims.connectors import expand_ranges
+
+# sizing of the blocks of origins swept together
+BLOCK_CACHE_BYTES = 2**23  # default size of a block's distance matrix, to fit in the CPU cache
+MIN_BLOCK_SIZE = 8  # min origins per block (a 64 byte cache line of distances per node)
+BOUND_CHECKS = 64  # max number of early stop checks per sweep
+
+
+def get_levels(ods: np.ndarray, n_nodes: int) -> np.ndarray:
+    """Get the topological level of each node of a directed acyclic graph.
+        Nodes without incoming edges are on level zero, and every other node is one level
+        after the last of its predecessors (layered topological sort).
+        So all edges go from a lower to a higher level, and nodes on the same level are not connected.
+
+    Args:
+        ods (np.ndarray): Origin and destination node of each edge.
+        n_nodes (int): Number of nodes.
+
+    Raises:
+        ValueError: If the graph has cycles.
+
+    Returns:
+        np.ndarray: Level of each node.
+    """
+    sources = ods[:, 0]
+    targets = ods[:, 1][np.argsort(sources, kind="stable")]
+    out_degree = np.bincount(sources, minlength=n_nodes)
+    offsets = np.cumsum(out_degree) - out_degree
+    in_degree = np.bincount(ods[:, 1], minlength=n_nodes)
+
+    levels = np.full(n_nodes, -1, dtype=np.int32)
+    frontier = np.flatnonzero(in_degree == 0)
+    level = 0
+    while len(frontier) > 0:
+        levels[frontier] = level
+        _, idx = expand_ranges(offsets[frontier], out_degree[frontier])
+        nodes, counts = np.unique(targets[idx], return_counts=True)
+        in_degree[nodes] -= counts
+        frontier = nodes[in_degree[nodes] == 0]
+        level += 1
+
+    if (levels < 0).any():
+        raise ValueError(
+            f"The graph is not acyclic: {(levels < 0).sum()} nodes are on (or after) a cycle."
+        )
+
+    return levels
+
+
+@dataclass
+class DAG:
+    """A directed acyclic graph (such as the time-expanded GTFS graph),
+        with its edges sorted by the topological level of their origin node, and then by destination node.
+
+    Attributes:
+        levels (np.ndarray): Topological level of each node (see `get_levels`).
+        sources (np.ndarray): Origin node of each edge.
+        targets (np.ndarray): Destination node of each edge.
+        weights (np.ndarray): Weight of each edge.
+        offsets (np.ndarray): Position of the first edge of each level (plus the number of edges).
+        groups (np.ndarray): Position of the first edge of each group of edges
+            with the same level and destination node.
+        group_offsets (np.ndarray): Position of the first group of each level (plus the number of groups).
+    """
+
+    levels: np.ndarray
+    sources: np.ndarray
+    targets: np.ndarray
+    weights: np.ndarray
+    offsets: np.ndarray
+    groups: np.ndarray
+    group_offsets: np.ndarray
+
+    @classmethod
+    def from_edges(
+        cls,
+        ods: np.ndarray,
+        weights: np.ndarray,
+        n_nodes: Optional[int] = None,
+        levels: Optional[np.ndarray] = None,
+    ) -> DAG:
+        """Construct the graph from its edge arrays.
+
+        Args:
+            ods (np.ndarray): Origin and destination node of each edge.
+            weights (np.ndarray): Weight of each edge.
+            n_nodes (Optional[int], optional): Number of nodes.
+                Defaults to None (the maximum node id plus one).
+            levels (Optional[np.ndarray], optional): Level of each node, if already known.
+                Every edge should go to a higher level. Defaults to None (see `get_levels`).
+
+        Raises:
+            ValueError: If an edge does not go to a higher level.
+
+        Returns:
+            DAG: The graph.
+        """
+        if n_nodes is None:
+            n_nodes = int(ods.max()) + 1 if len(ods) > 0 else 0
+        if levels is None:
+            levels = get_levels(ods, n_nodes)
+        elif (levels[ods[:, 0]] >= levels[ods[:, 1]]).any():
+            raise ValueError("All edges should go from a lower to a higher level.")
+        order = np.lexsort((ods[:, 1], levels[ods[:, 0]]))
+        sources = ods[order, 0]
+        targets = ods[order, 1]
+        edge_levels = levels[sources]
+        offsets = np.searchsorted(edge_levels, np.arange(levels.max(initial=-1) + 2))
+        groups = np.flatnonzero(np.diff(edge_levels, prepend=-1) | np.diff(targets, prepend=-1))
+        return cls(
+            levels=levels,
+            sources=sources,
+            targets=targets,
+            weights=np.asarray(weights)[order].astype(np.float64),
+            offsets=offsets,
+            groups=groups,
+            group_offsets=np.searchsorted(groups, offsets),
+        )
+
+    def reversed(self) -> DAG:
+        """Get the graph with all its edges reversed, for searches backwards from a set of destinations.
+            The topological levels are mirrored, so that the reversed edges still go to a higher level.
+
+        Returns:
+            DAG: The reversed graph.
+        """
+        return DAG.from_edges(
+            np.column_stack([self.targets, self.sources]),
+            self.weights,
+            self.n_nodes,
+            levels=self.levels.max(initial=0) - self.levels,
+        )
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.levels)
+
+    @property
+    def n_levels(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_block_size(self, n_origins: int, memory_mb: Optional[float] = None) -> int:
+        """Get the number of origins to sweep together.
+            The block distance matrix (nodes x origins), plus the candidate distances of the largest level,
+            should fit in the memory budget, or in the CPU cache (`BLOCK_CACHE_BYTES`) by default.
+            Without a budget, blocks have at least `MIN_BLOCK_SIZE` origins,
+            so that each node's distances fill a cache line.
+            An explicit budget is always respected, down to a single origin per block.
+
+        Args:
+            n_origins (int): Number of origins.
+            memory_mb (Optional[float], optional): Memory budget (MB). Defaults to None.
+
+        Raises:
+            ValueError: If the budget does not fit the distances of a single origin.
+
+        Returns:
+            int: Number of origins per block.
+        """
+        bytes_per_origin = 8 * (self.n_nodes + np.diff(self.offsets).max(initial=0))
+        if memory_mb is None:
+            block_size = max(BLOCK_CACHE_BYTES // bytes_per_origin, MIN_BLOCK_SIZE)
+        else:
+            block_size = int(memory_mb * 1e6 // bytes_per_origin)
+            if block_size < 1:
+                raise ValueError(
+                    f"The memory budget ({memory_mb}MB) is smaller than the distances"
+                    f" of a single origin ({bytes_per_origin / 1e6:.3g}MB)."
+                )
+        return max(min(int(block_size), n_origins), 1)
+
+
+def sweep(graph: DAG, dist: np.ndarray, start_level: int = 0) -> None:
+    """Relax the edges of a graph one level at a time, updating a distance matrix in place.
+        All origin nodes of a level's edges have already been settled when the level is relaxed,
+        so each level takes a single vectorised update, for all columns (origins) together.
+
+    Args:
+        graph (DAG): The graph.
+        dist (np.ndarray): Distances (nodes x origins). Should be set for the nodes below `start_level`.
+        start_level (int, optional): The first level to relax. Defaults to 0.
+    """
+    for level in range(start_level, graph.n_levels):
+        start, end = graph.offsets[level], graph.offsets[level + 1]
+        if start == end:
+            continue
+        groups = graph.groups[graph.group_offsets[level] : graph.group_offsets[level + 1]]
+        candidates = dist[graph.sources[start:end]] + graph.weights[start:end, None]
+        targets = graph.targets[groups]
+        dist[targets] = np.minimum(
+            dist[targets], np.minimum.reduceat(candidates, groups - start, axis=0)
+        )
+
+
+def sweep_bounded(
+    graph: DAG,
+    dist: np.ndarray,
+    dnodes: list[int],
+    max_dist: Optional[float] = None,
+    start_level: int = 0,
+) -> None:
+    """Relax the edges of a graph one level at a time (see `sweep`), only along the edges that can still
+        improve the distances to the destinations, and stopping as soon as none of the remaining levels can:
+        after the highest level of the destinations (all destinations are settled), or once the frontier
+        passes the bound (the maximum distance, or the largest tentative distance of the unsettled destinations).
+        An edge is relaxed if its origin node has been reached (by any origin of the block)
+        within the bound minus the edge weight. The bound is updated at most `BOUND_CHECKS` times per sweep.
+
+    Args:
+        graph (DAG): The graph.
+        dist (np.ndarray): Distances (nodes x origins). Should be set for the nodes below `start_level`.
+        dnodes (list[int]): Destination nodes.
+        max_dist (Optional[float], optional): Maximum search distance. Defaults to None.
+        start_level (int, optional): The first level to relax. Defaults to 0.
+    """
+    dnodes = np.asarray(dnodes, dtype=np.int64).reshape(-1)
+    dnodes = dnodes[np.argsort(graph.levels[dnodes], kind="stable")]
+    dnode_levels = graph.levels[dnodes]
+    end_level = dnode_levels.max(initial=-1)
+    max_dist = np.inf if max_dist is None else max_dist
+
+    # lowest distance of each node (over the origins of the block),
+    # and lowest candidate distance that the nodes of each level can pass on
+    node_min = dist.min(axis=1)
+    min_weight = np.full(graph.n_nodes, np.inf)
+    np.minimum.at(min_weight, graph.sources, graph.weights)
+    frontier = np.full(graph.n_levels, np.inf)
+    np.minimum.at(frontier, graph.levels, node_min + min_weight)
+
+    bound = np.inf
+    interval = max((end_level - start_level) // BOUND_CHECKS, 1)
+    for level in range(start_level, end_level):
+        if (level - start_level) % interval == 0:
+            unsettled = dnodes[np.searchsorted(dnode_levels, level, side="right") :]
+            bound = min(dist[unsettled].max(), np.nextafter(max_dist, np.inf))
+            if frontier[level:end_level].min() >= bound:
+                break
+        if frontier[level] >= bound:
+            continue
+
+        start, end = graph.offsets[level], graph.offsets[level + 1]
+        edges = start + np.flatnonzero(
+            node_min[graph.sources[start:end]] + graph.weights[start:end] < bound
+        )
+        if len(edges) == 0:
+            continue
+        targets = graph.targets[edges]
+        groups = np.flatnonzero(np.diff(targets, prepend=-1))
+        candidates = dist[graph.sources[edges]] + graph.weights[edges, None]
+        targets = targets[groups]
+        best = np.minimum.reduceat(candidates, groups, axis=0)
+        dist[targets] = np.minimum(dist[targets], best)
+
+        best = best.min(axis=1)
+        node_min[targets] = np.minimum(node_min[targets], best)
+        np.minimum.at(frontier, graph.levels[targets], best + min_weight[targets])
+
+
+def get_shortest_distances_block(
+    graph: DAG,
+    onodes: list[int],
+    dnodes: list[int],
+    max_dist: Optional[float] = None,
+    early_stop: bool = False,
+    return_explored: bool = False,
+) -> np.ndarray:
+    """Get shortest distances from a block of origins, with a single topological sweep
+        (starting from the lowest level of the origins).
+
+    Args:
+        graph (DAG): The graph.
+        onodes (list[int]): Source nodes.
+        dnodes (list[int]): Destination nodes.
+        max_dist (Optional[float], optional): Maximum search distance. Defaults to None.
+        early_stop (bool, optional): Stop the sweep once the destinations cannot improve
+            (see `sweep_bounded`). Defaults to False.
+        return_explored (bool, optional): Add the number of nodes explored (reached)
+            from each origin as the last column. Defaults to False.
+
+    Returns:
+        np.ndarray: Shortest distances (inf if not reachable within `max_dist`),
+            with a row for each origin. The first column is the source node.
+    """
+    onodes = np.asarray(onodes, dtype=np.int64).reshape(-1)
+    dist = np.full((graph.n_nodes, len(onodes)), np.inf)
+    dist[onodes, np.arange(len(onodes))] = 0
+    start_level = graph.levels[onodes].min(initial=graph.n_levels)
+    if early_stop:
+        sweep_bounded(graph, dist, dnodes, max_dist, start_level=start_level)
+    else:
+        sweep(graph, dist, start_level=start_level)
+
+    d = dist[dnodes].T
+    if max_dist is not None:
+        d[d > max_dist] = np.inf
+    d = np.column_stack([onodes, d])
+    if return_explored:
+        d = np.column_stack([d, np.isfinite(dist).sum(axis=0)])
+
+    return d
+
+
+def get_shortest_distances_single(
+    graph: DAG, onode: int, dnodes: list[int], max_dist: Optional[float] = None
+) -> np.ndarray:
+    """Get shortest distances from a single origin, with a topological sweep.
+
+    Args:
+        graph (DAG): The graph.
+        onode (int): Source node.
+        dnodes (list[int]): Destination nodes.
+        max_dist (Optional[float], optional): Maximum search distance. Defaults to None.
+
+    Returns:
+        np.ndarray: Shortest distances (inf if not reachable within `max_dist`).
+            The first value is the source node.
+    """
+    return get_shortest_distances_block(graph, [onode], dnodes, max_dist)[0]
+
+
+def get_shortest_distances(
+    graph: DAG,
+    onodes: list[int],
+    dnodes: list[int],
+    max_dist: Optional[float] = None,
+    block_size: Optional[int] = None,
+    memory_mb: Optional[float] = None,
+    reverse: bool = False,
+    early_stop: bool = False,
+    return_explored: bool = False,
+) -> pd.DataFrame | tuple[pd.DataFrame, pd.Series]:
+    """Get shortest distances from a set of origins to a set of destinations, with topological sweeps.
+        The origins are swept in blocks, so that each pass over the edge arrays is shared by many origins.
+        With `reverse`, the destinations are swept instead, backwards on the reversed graph
+        (which is cheaper when there are fewer destinations than origins).
+
+    Args:
+        graph (DAG): The graph.
+        onodes (list[int]): Source nodes.
+        dnodes (list[int]): Destination nodes.
+        max_dist (Optional[float], optional): Maximum search distance. Defaults to None.
+        block_size (Optional[int], optional): Number of origins per block.
+            Defaults to None (sized to the memory budget, see `DAG.get_block_size`).
+        memory_mb (Optional[float], optional): Memory budget of each block (MB).
+            Defaults to None (sized to fit in the CPU cache).
+        reverse (bool, optional): Search backwards from the destinations. Defaults to False.
+        early_stop (bool, optional): Stop each sweep once the destinations cannot improve
+            (see `sweep_bounded`). Defaults to False.
+        return_explored (bool, optional): Also return the number of nodes explored (reached)
+            by each search. Defaults to False.
+
+    Returns:
+        pd.DataFrame | tuple[pd.DataFrame, pd.Series]:
+            Shortest distances matrix.
+            The dataframe indices are the origin nodes, and the column indices are the destination nodes.
+            With `return_explored`, also the number of nodes explored from each source node
+            (the destinations, with `reverse`).
+    """
+    if reverse:
+        out = get_shortest_distances(
+            graph.reversed(),
+            dnodes,
+            onodes,
+            max_dist,
+            block_size,
+            memory_mb,
+            early_stop=early_stop,
+            return_explored=return_explored,
+        )
+        distmat = out[0] if return_explored else out
+        distmat = pd.DataFrame(
+            distmat.values.T, index=distmat.columns.astype(float), columns=dnodes
+        )
+        return (distmat, out[1]) if return_explored else distmat
+
+    if block_size is None:
+        block_size = graph.get_block_size(len(onodes), memory_mb)
+    dists = [
+        get_shortest_distances_block(
+            graph, onodes[i : i + block_size], dnodes, max_dist, early_stop, return_explored
+        )
+        for i in range(0, len(onodes), block_size)
+    ]
+    n_columns = len(dnodes) + 1 + return_explored
+    dists = np.concatenate(dists) if dists else np.empty((0, n_columns))
+    distmat = pd.DataFrame(dists[:, 1 : len(dnodes) + 1], index=dists[:, 0], columns=dnodes)
+    if return_explored:
+        return distmat, pd.Series(dists[:, -1].astype(np.int64), index=dists[:, 0], name="explored")
+    return distmat
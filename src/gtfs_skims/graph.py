@@ -1,42 +1,61 @@
+from __future__ import annotations
+
 import multiprocessing
 import os
-from functools import partial
+import tempfile
 from typing import Optional
 
 import numpy as np
 import pandas as pd
-from graph_tool import Graph
-from graph_tool.topology import shortest_distance
 
-from gtfs_skims.utils import Config, ConnectorsData, GTFSData, get_logger
+from gtfs_skims import csa, dag, minplus
+from gtfs_skims.connectors import expand_ranges
+from gtfs_skims.utils import Config, ConnectorsData, GTFSData, get_cpu_limit, get_logger, narrow
+from gtfs_skims.variables import NODE_TYPE, TIME_TYPES
+
+# adaptive chunking of the shortest distances origins
+TASK_MIN_EDGES = 2**22  # min number of edges (summed over the origins) scanned by a task
+TASKS_PER_WORKER = 4  # target number of tasks per worker, for load balancing
+
+# graph-tool is only required by the "graph_tool" shortest path engine
+try:
+    from graph_tool import Graph, GraphView, load_graph
+    from graph_tool.topology import shortest_distance
+except ImportError:
+    Graph = GraphView = load_graph = shortest_distance = None
 
 
 def get_ivt_edges(stop_times: pd.DataFrame) -> pd.DataFrame:
     """Get in-vehicle times between stops.
+        Consecutive stop times of each trip are linked, following the `stop_sequence` order
+        (if the column is included, otherwise the order of the table).
 
     Args:
         stop_times (pd.DataFrame): The stoptimes GTFS table.
 
     Returns:
-        np.ndarray: [origin id, destination id, in-vehicle time]
+        pd.DataFrame: ['onode', 'dnode', 'ivt'], where the node ids are the (positional) stop time indices.
     """
-    edges_ivt = pd.Series(range(len(stop_times)))
-    trip_id = stop_times.reset_index()["trip_id"]
-    departures = stop_times.reset_index()["departure_s"]
-
-    edges_ivt = (
-        pd.concat(
-            [
-                edges_ivt,
-                edges_ivt.groupby(trip_id).shift(-1),
-                departures.groupby(trip_id).shift(-1) - departures,
-            ],
-            axis=1,
-        )
-        .dropna()
-        .map(int)
+    trips, _ = pd.factorize(stop_times["trip_id"])
+    if "stop_sequence" in stop_times.columns:
+        idx_sorted = np.lexsort((stop_times["stop_sequence"].to_numpy(), trips))
+    else:
+        idx_sorted = np.argsort(trips, kind="stable")
+
+    # link consecutive stop times of the same trip
+    trips_sorted = trips[idx_sorted]
+    is_same_trip = trips_sorted[1:] == trips_sorted[:-1]
+    onodes = idx_sorted[:-1][is_same_trip]
+    dnodes = idx_sorted[1:][is_same_trip]
+
+    departures = stop_times["departure_s"].to_numpy(dtype=np.int64)
+    edges_ivt = pd.DataFrame(
+        {
+            "onode": narrow(onodes, [NODE_TYPE], "onode ids"),
+            "dnode": narrow(dnodes, [NODE_TYPE], "dnode ids"),
+            "ivt": narrow(departures[dnodes] - departures[onodes], TIME_TYPES, "in-vehicle times"),
+        }
     )
-    edges_ivt.columns = ["onode", "dnode", "ivt"]
 
     return edges_ivt
 
@@ -51,19 +70,22 @@ def get_all_edges(gtfs_data: GTFSData, connectors_data: ConnectorsData) -> pd.Da
     Returns:
         pd.DataFrame: ['onode', 'dnode', 'ivt', 'walk', 'wait', 'transfer']
     """
-    edges = (
-        pd.concat(
-            [
-                get_ivt_edges(gtfs_data.stop_times),
-                connectors_data.connectors_transfer.assign(transfer=1),
-                connectors_data.connectors_access,
-                connectors_data.connectors_egress,
-            ],
-            axis=0,
-        )
-        .fillna(0)
-        .map(int)
-    )
+    edges = pd.concat(
+        [
+            get_ivt_edges(gtfs_data.stop_times),
+            connectors_data.connectors_transfer.assign(transfer=1),
+            connectors_data.connectors_access,
+            connectors_data.connectors_egress,
+        ],
+        axis=0,
+    ).fillna(0)
+
+    # compact types
+    for c in ["onode", "dnode"]:
+        edges[c] = narrow(edges[c].values, [NODE_TYPE], f"{c} ids")
+    for c in ["ivt", "walk", "wait"]:
+        edges[c] = narrow(edges[c].values, TIME_TYPES, f"{c} times")
+    edges["transfer"] = narrow(edges["transfer"].values, [np.uint8], "transfers")
 
     return edges
 
@@ -79,15 +101,19 @@ def add_gc(edges: pd.DataFrame, config: Config) -> pd.DataFrame:
     Returns:
         pd.DataFrame: Edges dataframe, with the generalised time ("gc") column included.
     """
-    edges["gc"] = (
-        edges["ivt"]
-        + edges["walk"] * config.weight_walk
-        + edges["wait"] * config.weight_wait
-        + edges["transfer"] * config.penalty_interchange
+    ivt, walk, wait, transfer = (
+        edges[c].to_numpy(dtype=np.int64) for c in ["ivt", "walk", "wait", "transfer"]
     )
+    gc = (
+        ivt
+        + walk * config.weight_walk
+        + wait * config.weight_wait
+        + transfer * config.penalty_interchange
+    )
+    edges["gc"] = narrow(gc, TIME_TYPES + [np.float64], "generalised times")
 
     # adding unweighted time as well
-    edges["time"] = edges[["ivt", "walk", "wait"]].sum(1)
+    edges["time"] = narrow(ivt + walk + wait, TIME_TYPES, "times")
 
     return edges
 
@@ -107,14 +133,270 @@ def build_graph(edges: pd.DataFrame, vars=["ivt", "walk", "wait", "time", "gc"])
     return g
 
 
+def get_edge_arrays(gtfs_data: GTFSData, connectors_data: ConnectorsData) -> dict[str, np.ndarray]:
+    """Get all edges for the accessibility graph, as contiguous arrays.
+        The in-vehicle, transfer, access and egress edges are written (in this order)
+        straight into preallocated arrays, without building an intermediate edges table.
+
+    Args:
+        gtfs_data (GTFSData): GTFS data object.
+        connectors_data (ConnectorsData): Connectors data object.
+
+    Returns:
+        dict[str, np.ndarray]: Edge arrays: 'ods' (origin and destination node of each edge),
+            'ivt', 'walk', 'wait' and 'transfer'.
+    """
+    edges_ivt = get_ivt_edges(gtfs_data.stop_times)
+    connectors = {
+        "transfer": connectors_data.connectors_transfer,
+        "access": connectors_data.connectors_access,
+        "egress": connectors_data.connectors_egress,
+    }
+
+    # preallocate
+    n_edges = len(edges_ivt) + sum(map(len, connectors.values()))
+    edges = {
+        "ods": np.empty((n_edges, 2), dtype=NODE_TYPE),
+        "ivt": np.zeros(n_edges, dtype=edges_ivt["ivt"].dtype),
+        "walk": np.zeros(n_edges, dtype=np.result_type(*[x["walk"] for x in connectors.values()])),
+        "wait": np.zeros(n_edges, dtype=np.result_type(*[x["wait"] for x in connectors.values()])),
+        "transfer": np.zeros(n_edges, dtype=np.uint8),
+    }
+
+    # fill in
+    edges["ods"][: len(edges_ivt), 0] = edges_ivt["onode"].to_numpy()
+    edges["ods"][: len(edges_ivt), 1] = edges_ivt["dnode"].to_numpy()
+    edges["ivt"][: len(edges_ivt)] = edges_ivt["ivt"].to_numpy()
+    start = len(edges_ivt)
+    for name, df in connectors.items():
+        rows = slice(start, start + len(df))
+        edges["ods"][rows, 0] = narrow(df["onode"].to_numpy(), [NODE_TYPE], "onode ids")
+        edges["ods"][rows, 1] = narrow(df["dnode"].to_numpy(), [NODE_TYPE], "dnode ids")
+        edges["walk"][rows] = df["walk"].to_numpy()
+        edges["wait"][rows] = df["wait"].to_numpy()
+        if name == "transfer":
+            edges["transfer"][rows] = 1
+        start = rows.stop
+
+    return edges
+
+
+def add_gc_arrays(edges: dict[str, np.ndarray], config: Config, chunk_size: int = 2**20) -> None:
+    """Calculate the generalised time and (unweighted) time of each edge, and add them to the edge arrays.
+        The weights are calculated in chunks, writing straight into preallocated int32 arrays
+        (the type of the graph's edge properties). Fractional generalised times are truncated.
+
+    Args:
+        edges (dict[str, np.ndarray]): Edge arrays (see `get_edge_arrays`).
+        config (Config): Config object.
+        chunk_size (int, optional): Number of edges processed at a time. Defaults to 2**20.
+    """
+    n_edges = len(edges["ivt"])
+    edges["gc"] = np.empty(n_edges, dtype=np.int32)
+    edges["time"] = np.empty(n_edges, dtype=np.int32)
+
+    for start in range(0, n_edges, chunk_size):
+        rows = slice(start, start + chunk_size)
+        ivt, walk, wait, transfer = (
+            edges[c][rows].astype(np.int64) for c in ["ivt", "walk", "wait", "transfer"]
+        )
+        gc = (
+            ivt
+            + walk * config.weight_walk
+            + wait * config.weight_wait
+            + transfer * config.penalty_interchange
+        )
+        if gc.dtype.kind == "f":
+            gc = np.trunc(gc)
+        edges["gc"][rows] = narrow(gc, [np.int32], "generalised times")
+        edges["time"][rows] = narrow(ivt + walk + wait, [np.int32], "times")
+
+
+def contract_chains(
+    edges: dict[str, np.ndarray], n_stop_times: int, n_nodes: Optional[int] = None
+) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """Contract the chains of pass-through stop times, which only have an in-vehicle edge in
+        and an in-vehicle edge out (no transfer, access or egress connectors).
+        Each chain is replaced by a single edge, from the stop time before the chain to the stop time after it,
+        with the sums of the edge variables (such as 'ivt', 'gc' and 'time') along the chain.
+        The remaining nodes are renumbered in the same order, so the stop times are still numbered first.
+
+    Args:
+        edges (dict[str, np.ndarray]): Edge arrays (see `get_edge_arrays`).
+        n_stop_times (int): Number of stop times. Stop time node ids are their positional indices.
+        n_nodes (Optional[int], optional): Number of nodes. Defaults to None (the maximum node id plus one).
+
+    Returns:
+        tuple[dict[str, np.ndarray], np.ndarray]: The contracted edge arrays,
+            and the new id of each node (-1 for the contracted stop times).
+    """
+    ods = edges["ods"].astype(np.int64)
+    if n_nodes is None:
+        n_nodes = int(ods.max(initial=-1)) + 1
+    is_ivt = (ods < n_stop_times).all(axis=1) & (edges["transfer"] == 0)
+    is_contracted = (
+        (np.bincount(ods[:, 0], minlength=n_nodes) == 1)
+        & (np.bincount(ods[:, 1], minlength=n_nodes) == 1)
+        & (np.bincount(ods[is_ivt, 0], minlength=n_nodes) == 1)
+        & (np.bincount(ods[is_ivt, 1], minlength=n_nodes) == 1)
+    )
+    variables = [x for x in edges if x != "ods"]
+
+    # next node after the chain, and the sums of the edge variables up to it (pointer jumping)
+    nodes = np.flatnonzero(is_contracted)
+    out_edge = np.full(n_nodes, -1, dtype=np.int64)
+    out_edge[ods[:, 0]] = np.arange(len(ods))
+    succ = np.full(n_nodes, -1, dtype=np.int64)
+    succ[nodes] = ods[out_edge[nodes], 1]
+    sums = {x: np.zeros(n_nodes, dtype=np.int64) for x in variables}
+    for x in variables:
+        sums[x][nodes] = edges[x][out_edge[nodes]]
+    pending = nodes[is_contracted[succ[nodes]]]
+    while len(pending) > 0:
+        after = succ[pending]
+        for x in variables:
+            sums[x][pending] += sums[x][after]
+        succ[pending] = succ[after]
+        pending = pending[is_contracted[succ[pending]]]
+
+    # bypass the chains
+    is_kept = ~is_contracted[ods[:, 0]]
+    ods = ods[is_kept]
+    via = np.flatnonzero(is_contracted[ods[:, 1]])
+    contracted = {}
+    for x in variables:
+        values = edges[x][is_kept].astype(np.int64)
+        values[via] += sums[x][ods[via, 1]]
+        contracted[x] = narrow(values, [edges[x].dtype, np.int64], f"contracted {x}")
+    ods[via, 1] = succ[ods[via, 1]]
+
+    # renumber
+    node_ids = np.full(n_nodes, -1, dtype=np.int64)
+    node_ids[~is_contracted] = np.arange(n_nodes - len(nodes))
+    contracted["ods"] = narrow(node_ids[ods], [NODE_TYPE], "node ids")
+
+    return contracted, node_ids
+
+
+def get_nearest_distances(
+    ods: np.ndarray,
+    weights: np.ndarray,
+    sources: np.ndarray,
+    n_nodes: int,
+    max_dist: Optional[float] = None,
+) -> np.ndarray:
+    """Get the shortest distance of each node from the nearest of a set of source nodes,
+        with a single search from all the sources together.
+        Each pass relaxes the outgoing edges of the nodes whose distance was updated in the previous pass.
+
+    Args:
+        ods (np.ndarray): Origin and destination node of each edge.
+        weights (np.ndarray): Weight of each edge.
+        sources (np.ndarray): Source nodes.
+        n_nodes (int): Number of nodes.
+        max_dist (Optional[float], optional): Maximum distance. Defaults to None.
+
+    Returns:
+        np.ndarray: Distance of each node from the nearest source (infinite if not reached).
+    """
+    order = np.argsort(ods[:, 0], kind="stable")
+    targets = ods[order, 1]
+    weights = np.asarray(weights, dtype=np.float64)[order]
+    out_degree = np.bincount(ods[:, 0], minlength=n_nodes)
+    offsets = np.cumsum(out_degree) - out_degree
+    bound = np.inf if max_dist is None else max_dist
+
+    dist = np.full(n_nodes, np.inf)
+    frontier = np.unique(np.asarray(sources, dtype=np.int64))
+    dist[frontier] = 0
+    while len(frontier) > 0:
+        idx, edge_idx = expand_ranges(offsets[frontier], out_degree[frontier])
+        candidates = dist[frontier[idx]] + weights[edge_idx]
+        nodes = targets[edge_idx]
+        is_better = (candidates < dist[nodes]) & (candidates <= bound)
+        np.minimum.at(dist, nodes[is_better], candidates[is_better])
+        frontier = np.unique(nodes[is_better])
+
+    return dist
+
+
+def prune_unreachable(
+    edges: dict[str, np.ndarray],
+    onodes: np.ndarray,
+    dnodes: np.ndarray,
+    n_stop_times: int,
+    max_dist: Optional[float] = None,
+    n_nodes: Optional[int] = None,
+) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """Prune the edges that are not on any path from an origin to a destination within the maximum distance.
+        An edge is kept if the distance ('gc') from the nearest origin to its start, plus its weight,
+        plus the distance from its end to the nearest destination is within the maximum distance.
+        The stop times left without edges are dropped, and the remaining nodes are renumbered
+        in the same order, so the stop times are still numbered first.
+
+    Args:
+        edges (dict[str, np.ndarray]): Edge arrays, including 'gc' (see `get_edge_arrays`).
+        onodes (np.ndarray): Origin nodes.
+        dnodes (np.ndarray): Destination nodes.
+        n_stop_times (int): Number of stop times. Stop time node ids are their positional indices.
+        max_dist (Optional[float], optional): Maximum distance. Defaults to None.
+        n_nodes (Optional[int], optional): Number of nodes. Defaults to None (the maximum node id plus one).
+
+    Returns:
+        tuple[dict[str, np.ndarray], np.ndarray]: The pruned edge arrays,
+            and the new id of each node (-1 for the dropped stop times).
+    """
+    ods = edges["ods"]
+    if n_nodes is None:
+        n_nodes = int(ods.max(initial=-1)) + 1
+    dist_from = get_nearest_distances(ods, edges["gc"], onodes, n_nodes, max_dist)
+    dist_to = get_nearest_distances(ods[:, ::-1], edges["gc"], dnodes, n_nodes, max_dist)
+    lengths = dist_from[ods[:, 0]] + edges["gc"] + dist_to[ods[:, 1]]
+    is_kept = lengths <= (np.inf if max_dist is None else max_dist)
+
+    is_node = np.ones(n_nodes, dtype=bool)
+    is_node[:n_stop_times] = False
+    is_node[ods[is_kept].ravel()] = True
+    node_ids = np.full(n_nodes, -1, dtype=np.int64)
+    node_ids[is_node] = np.arange(is_node.sum())
+
+    pruned = {x: v[is_kept] for x, v in edges.items()}
+    pruned["ods"] = narrow(node_ids[pruned["ods"]], [NODE_TYPE], "node ids")
+
+    return pruned, node_ids
+
+
+def build_graph_arrays(
+    edges: dict[str, np.ndarray], vars=["ivt", "walk", "wait", "time", "gc"]
+) -> Graph:
+    """Build a network graph from the edge arrays.
+
+    Args:
+        edges (dict[str, np.ndarray]): Edge arrays (see `get_edge_arrays`).
+            Should include the 'gc' and 'time' arrays from the 'add_gc_arrays' method.
+        vars (list): list of variables to include in the graph as edge properties.
+
+    Returns:
+        Graph: Connected GTFS graph
+    """
+    g = Graph(directed=True)
+    g.add_vertex(int(edges["ods"].max()) + 1)
+    g.add_edge_list(edges["ods"])
+    for x in vars:
+        g.edge_properties[x] = g.new_edge_property("int", vals=edges[x])
+    return g
+
+
 def get_shortest_distances_single(
     graph: Graph,
     onode: int,
     dnodes: list[int],
     max_dist: Optional[float] = None,
     attribute: str = "gc",
+    return_explored: bool = False,
 ) -> np.ndarray:
     """Get shortest distances from a single origin.
+        The search stops once all destinations are settled (or beyond `max_dist`).
 
     Args:
         graph (Graph): GTFS graph.
@@ -122,6 +404,8 @@ def get_shortest_distances_single(
         dnodes (list[int]): Destination nodes.
         max_dist (Optional[float], optional): Maximum search distance. Defaults to None.
         attribute (str, optional): Edge weights attribute. Defaults to 'gc'.
+        return_explored (bool, optional): Add the number of nodes explored (reached) by the search
+            as the last value. Defaults to False.
 
     Returns:
         np.ndarray: Shortest distances. The first value is the source node.
@@ -134,20 +418,104 @@ def get_shortest_distances_single(
         dense=False,
         max_dist=max_dist,
         directed=True,
+        return_reached=return_explored,
     )
+    if return_explored:
+        d = np.concatenate([d[0], np.array([len(d[1])])])
     d = np.concatenate([np.array([onode]), d])
 
     return d
 
 
+_worker_inputs = {}
+
+
+def _init_shortest_distances_worker(
+    path_graph: Optional[str],
+    dnodes: list[int],
+    max_dist: Optional[float],
+    attribute: str,
+    reverse: bool = False,
+    return_explored: bool = False,
+) -> None:
+    """Set up a shortest distances worker.
+    The graph is loaded from disk if a path is provided (and reversed, for backward searches),
+    otherwise the worker uses the graph inherited from the parent process (forked).
+    """
+    if path_graph is not None:
+        _worker_inputs["graph"] = load_graph(path_graph)
+        if reverse:
+            _worker_inputs["graph"] = GraphView(_worker_inputs["graph"], reversed=True)
+    _worker_inputs.update(
+        dnodes=dnodes, max_dist=max_dist, attribute=attribute, return_explored=return_explored
+    )
+
+
+def _get_shortest_distances_chunk(onodes: list[int]) -> np.ndarray:
+    """Get shortest distances from a chunk of origins, using the graph of the worker process.
+
+    Args:
+        onodes (list[int]): Source nodes.
+
+    Returns:
+        np.ndarray: Shortest distances. The first column is the source node
+            (and the last column the number of nodes explored, if requested).
+    """
+    return np.array(
+        [
+            get_shortest_distances_single(
+                _worker_inputs["graph"],
+                onode,
+                dnodes=_worker_inputs["dnodes"],
+                max_dist=_worker_inputs["max_dist"],
+                attribute=_worker_inputs["attribute"],
+                return_explored=_worker_inputs["return_explored"],
+            )
+            for onode in onodes
+        ]
+    )
+
+
+def get_chunksize(n_origins: int, n_workers: int, n_edges: int) -> int:
+    """Get the number of origins per shortest distances task.
+        Each task should scan enough edges (`TASK_MIN_EDGES`) to outweigh its dispatch overhead,
+        which matters on small graphs, while still giving each worker about `TASKS_PER_WORKER` tasks
+        to balance the load on large graphs. Each worker gets at least one task.
+
+    Args:
+        n_origins (int): Number of origins.
+        n_workers (int): Number of worker processes.
+        n_edges (int): Number of graph edges.
+
+    Returns:
+        int: Number of origins per task.
+    """
+    chunksize_balanced = int(np.ceil(n_origins / (n_workers * TASKS_PER_WORKER)))
+    chunksize_min = int(np.ceil(TASK_MIN_EDGES / max(n_edges, 1)))
+    chunksize_max = int(np.ceil(n_origins / n_workers))
+    return max(min(max(chunksize_balanced, chunksize_min), chunksize_max), 1)
+
+
 def get_shortest_distances(
     graph: Graph,
     onodes: list[int],
     dnodes: list[int],
     max_dist: Optional[float] = None,
     attribute: str = "gc",
-) -> pd.DataFrame:
+    sharing: str = "fork",
+    chunksize: Optional[int] = None,
+    path_tmp: Optional[str] = None,
+    n_workers: Optional[int] = None,
+    start_method: Optional[str] = None,
+    reverse: bool = False,
+    return_explored: bool = False,
+) -> pd.DataFrame | tuple[pd.DataFrame, pd.Series]:
     """Get shortest distances from a set of origins to a set of destinations.
+        The origins are dispatched in chunks to a pool of worker processes,
+        which get the graph once (rather than with every task).
+        With a single worker, the distances are calculated in the main process.
+        With `reverse`, the searches start from the destinations instead, on a reversed view of the graph
+        (which is cheaper when there are fewer destinations than origins).
 
     Args:
         graph (Graph): GTFS graph.
@@ -155,29 +523,209 @@ def get_shortest_distances(
         dnodes (list[int]): Destination nodes.
         max_dist (Optional[float], optional): Maximum search distance. Defaults to None.
         attribute (str, optional): Edge weights attribute. Defaults to 'gc'.
+        sharing (str, optional): How the workers get the graph.
+            "fork": the workers are forked, and share the graph memory of the parent process.
+            "disk": the graph is saved to a temporary file, and loaded by each worker
+            (for platforms where processes cannot be forked). Defaults to "fork".
+        chunksize (Optional[int], optional): Number of origins per task.
+            Defaults to None (adaptive, see `get_chunksize`).
+        path_tmp (Optional[str], optional): Directory of the temporary graph file ("disk" sharing).
+            Defaults to None (the system's temporary directory).
+        n_workers (Optional[int], optional): Number of worker processes.
+            Defaults to None (the number of CPUs available to the process).
+        start_method (Optional[str], optional): Start method of the worker processes
+            ("fork", "spawn" or "forkserver"). Defaults to None
+            ("fork" with fork sharing, otherwise the platform default).
+        reverse (bool, optional): Search backwards from the destinations. Defaults to False.
+        return_explored (bool, optional): Also return the number of nodes explored (reached)
+            by each search. Defaults to False.
+
+    Raises:
+        ValueError: If fork sharing is requested with a different start method.
 
     Returns:
-        pd.DataFrame:
+        pd.DataFrame | tuple[pd.DataFrame, pd.Series]:
             Shortest distances matrix.
             The dataframe indices are the origin nodes, and the column indices are the destination nodes.
+            With `return_explored`, also the number of nodes explored from each source node
+            (the destinations, with `reverse`).
     """
-    n_cpus = multiprocessing.cpu_count() - 1
-    dist_wrapper = partial(
-        get_shortest_distances_single, graph, dnodes=dnodes, max_dist=max_dist, attribute=attribute
-    )
-    with multiprocessing.Pool(n_cpus) as pool_obj:
-        dists = pool_obj.map(dist_wrapper, onodes)
+    if sharing == "fork" and start_method not in [None, "fork"]:
+        raise ValueError(
+            f"Fork graph sharing requires the fork start method (got {start_method})."
+            " Use disk sharing instead."
+        )
+    sources, targets = (dnodes, onodes) if reverse else (onodes, dnodes)
+    if n_workers is None:
+        n_workers = get_cpu_limit()
+    if chunksize is None:
+        chunksize = get_chunksize(len(sources), n_workers, graph.num_edges())
+    chunks = [sources[i : i + chunksize] for i in range(0, len(sources), chunksize)]
+    n_workers = max(min(n_workers, len(chunks)), 1)
+
+    if n_workers == 1:
+        view = GraphView(graph, reversed=True) if reverse else graph
+        dists = [
+            np.array(
+                [
+                    get_shortest_distances_single(
+                        view, source, targets, max_dist, attribute, return_explored
+                    )
+                    for source in chunk
+                ]
+            )
+            for chunk in chunks
+        ]
+    else:
+        dists = _get_shortest_distances_pool(
+            graph,
+            chunks,
+            targets,
+            max_dist,
+            attribute,
+            sharing,
+            n_workers,
+            start_method,
+            path_tmp,
+            reverse,
+            return_explored,
+        )
 
-    dists = np.array(dists)
+    dists = np.concatenate(dists) if dists else np.empty((0, len(targets) + 1 + return_explored))
     dists = dists[dists[:, 0].argsort()]  # sort by source node
+    if return_explored:
+        explored = pd.Series(dists[:, -1].astype(np.int64), index=dists[:, 0], name="explored")
+        explored = explored.loc[sources]
+        dists = dists[:, :-1]
 
     # convert to dataframe and reindex
-    dists = pd.DataFrame(dists[:, 1:], index=dists[:, 0], columns=dnodes)
-    dists = dists.loc[onodes]
+    dists = pd.DataFrame(dists[:, 1:], index=dists[:, 0], columns=targets)
+    dists = dists.loc[sources]
+    if reverse:
+        dists = pd.DataFrame(dists.values.T, index=dists.columns.astype(float), columns=dnodes)
+
+    return (dists, explored) if return_explored else dists
+
+
+def _get_shortest_distances_pool(
+    graph: Graph,
+    chunks: list[list[int]],
+    dnodes: list[int],
+    max_dist: Optional[float],
+    attribute: str,
+    sharing: str,
+    n_workers: int,
+    start_method: Optional[str],
+    path_tmp: Optional[str],
+    reverse: bool = False,
+    return_explored: bool = False,
+) -> list[np.ndarray]:
+    """Get shortest distances from chunks of source nodes, on a pool of worker processes.
+        See `get_shortest_distances` for the arguments. With `reverse`, the sources are
+        the destination nodes, and `dnodes` the origin nodes.
+
+    Returns:
+        list[np.ndarray]: Shortest distances of each chunk, in order of completion.
+            The first column is the source node
+            (and the last column the number of nodes explored, with `return_explored`).
+    """
+    with tempfile.TemporaryDirectory(dir=path_tmp) as tmpdir:
+        if sharing == "fork":
+            _worker_inputs["graph"] = GraphView(graph, reversed=True) if reverse else graph
+            context = multiprocessing.get_context("fork")
+            path_graph = None
+        else:
+            context = multiprocessing.get_context(start_method)
+            path_graph = os.path.join(tmpdir, "graph.gt")
+            graph.save(path_graph, fmt="gt")
+
+        try:
+            with context.Pool(
+                n_workers,
+                initializer=_init_shortest_distances_worker,
+                initargs=(path_graph, dnodes, max_dist, attribute, reverse, return_explored),
+            ) as pool_obj:
+                dists = list(pool_obj.imap_unordered(_get_shortest_distances_chunk, chunks))
+        finally:
+            _worker_inputs.clear()
 
     return dists
 
 
+def get_search_direction(n_onodes: int, n_dnodes: int, direction: str = "auto") -> str:
+    """Get the direction of the shortest path searches.
+        Each search finds the distances from one node to all others, so the "auto" direction
+        searches from the smaller set: forwards from the origins, or backwards from the destinations.
+
+    Args:
+        n_onodes (int): Number of origin nodes.
+        n_dnodes (int): Number of destination nodes.
+        direction (str, optional): "forward", "backward" or "auto". Defaults to "auto".
+
+    Returns:
+        str: "forward" or "backward".
+    """
+    if direction != "auto":
+        return direction
+    return "backward" if n_dnodes < n_onodes else "forward"
+
+
+def get_shortest_distances_engine(
+    graph: Graph | dag.DAG,
+    onodes: list[int],
+    dnodes: list[int],
+    max_dist: Optional[float],
+    config: Config,
+    return_explored: bool = False,
+) -> pd.DataFrame | tuple[pd.DataFrame, pd.Series]:
+    """Get shortest distances from a set of origins to a set of destinations,
+        with the shortest path engine and search direction of the config
+        (`shortest_path_engine` and `shortest_path_direction`).
+        The "dag" and "csa" sweeps stop early if `shortest_path_early_stop` is set
+        (graph-tool's searches always stop once their destinations are settled).
+
+    Args:
+        graph (Graph | dag.DAG): GTFS graph (a DAG for the "dag" and "csa" engines).
+        onodes (list[int]): Source nodes.
+        dnodes (list[int]): Destination nodes.
+        max_dist (Optional[float]): Maximum search distance.
+        config (Config): Config object.
+        return_explored (bool, optional): Also return the number of nodes explored (reached)
+            by each search. Defaults to False.
+
+    Returns:
+        pd.DataFrame | tuple[pd.DataFrame, pd.Series]:
+            Shortest distances matrix.
+            The dataframe indices are the origin nodes, and the column indices are the destination nodes.
+            With `return_explored`, also the number of nodes explored by each search.
+    """
+    direction = get_search_direction(len(onodes), len(dnodes), config.shortest_path_direction)
+    if config.shortest_path_engine in ["dag", "csa"]:
+        return dag.get_shortest_distances(
+            graph,
+            onodes=onodes,
+            dnodes=dnodes,
+            max_dist=max_dist,
+            memory_mb=config.shortest_path_memory_mb,
+            reverse=direction == "backward",
+            early_stop=config.shortest_path_early_stop,
+            return_explored=return_explored,
+        )
+    return get_shortest_distances(
+        graph,
+        onodes=onodes,
+        dnodes=dnodes,
+        max_dist=max_dist,
+        sharing=config.graph_sharing,
+        chunksize=config.graph_chunksize,
+        path_tmp=config.path_outputs,
+        n_workers=config.graph_workers,
+        start_method=config.graph_start_method,
+        reverse=direction == "backward",
+        return_explored=return_explored,
+    )
+
+
 def main(
     config: Config,
     gtfs_data: Optional[GTFSData] = None,
@@ -188,29 +736,114 @@ def main(
 
     logger.info("Reading files...")
     if gtfs_data is None:
-        gtfs_data = GTFSData.from_parquet(path=config.path_outputs)
+        gtfs_data = GTFSData.from_parquet(path=config.path_outputs, fmt=config.intermediate_format)
     if connectors_data is None:
-        connectors_data = ConnectorsData.from_parquet(path=config.path_outputs)
+        connectors_data = ConnectorsData.from_parquet(
+            path=config.path_outputs, fmt=config.intermediate_format
+        )
     origins = pd.read_csv(config.path_origins, index_col=0)
     destinations = pd.read_csv(config.path_destinations, index_col=0)
 
     # graph
     logger.info("Building graph...")
-    edges = get_all_edges(gtfs_data, connectors_data)
-    edges = add_gc(edges=edges, config=config)
-    g = build_graph(edges=edges)
+    edges = get_edge_arrays(gtfs_data, connectors_data)
+    add_gc_arrays(edges=edges, config=config)
+    n_nodes = max(
+        int(edges["ods"].max(initial=-1)) + 1,
+        len(gtfs_data.stop_times) + len(origins) + len(destinations),
+    )
+    node_ids = np.arange(n_nodes)
+    stop_times = gtfs_data.stop_times
+    if config.graph_contract_chains:
+        n_edges = len(edges["ods"])
+        edges, node_ids = contract_chains(edges, len(stop_times), n_nodes)
+        stop_times = stop_times[node_ids[: len(stop_times)] >= 0]
+        n_nodes = int(node_ids.max(initial=-1)) + 1
+        logger.info(
+            f"Contracted {len(node_ids) - n_nodes} pass-through stop times"
+            f" ({n_edges} edges to {len(edges['ods'])})."
+        )
+    origins["idx"] = node_ids[len(gtfs_data.stop_times) + np.arange(len(origins))]
+    destinations["idx"] = node_ids[
+        len(gtfs_data.stop_times) + len(origins) + np.arange(len(destinations))
+    ]
+    maxdist = config.end_s - config.start_s
+    if config.graph_prune_unreachable:
+        n_edges, n_stop_times = len(edges["ods"]), len(stop_times)
+        edges, node_ids = prune_unreachable(
+            edges, origins["idx"], destinations["idx"], n_stop_times, maxdist, n_nodes
+        )
+        stop_times = stop_times[node_ids[:n_stop_times] >= 0]
+        origins["idx"] = node_ids[origins["idx"]]
+        destinations["idx"] = node_ids[destinations["idx"]]
+        n_nodes = int(node_ids.max(initial=-1)) + 1
+        logger.info(
+            f"Pruned {n_stop_times - len(stop_times)} of {n_stop_times} stop times"
+            f" and {n_edges - len(edges['ods'])} of {n_edges} edges"
+            " that are not on any path from an origin to a destination within the time window."
+        )
+    if config.shortest_path_engine == "dag":
+        g = dag.DAG.from_edges(edges["ods"], edges["gc"], n_nodes)
+        logger.info(f"Sorted the graph in {g.n_levels} topological levels.")
+    elif config.shortest_path_engine == "csa":
+        g = csa.get_connection_scan(edges, stop_times, n_nodes)
+        logger.info(f"Sorted the connections in {g.n_levels} scan levels.")
+    elif Graph is None:
+        raise ImportError(
+            "The graph_tool shortest path engine requires graph-tool."
+            " Install it, or use the dag or csa engine instead."
+        )
+    else:
+        g = build_graph_arrays(edges=edges)
+
+    # nodes with outgoing/incoming edges
+    is_onode = np.zeros(n_nodes, dtype=bool)
+    is_onode[edges["ods"][:, 0]] = True
+    is_dnode = np.zeros(n_nodes, dtype=bool)
+    is_dnode[edges["ods"][:, 1]] = True
 
     # shortest paths
     logger.info("Calculating shortest distances...")
-    origins["idx"] = range(len(origins))
-    origins["idx"] += len(gtfs_data.stop_times)
-    destinations["idx"] = range(len(destinations))
-    destinations["idx"] += len(gtfs_data.stop_times) + len(origins)
+    onodes_scope = origins["idx"][is_onode[origins["idx"]]].tolist()
+    dnodes_scope = destinations["idx"][is_dnode[destinations["idx"]]].tolist()
+    if config.shortest_path_mode == "stops":
+        is_access = np.isin(edges["ods"][:, 0], onodes_scope)
+        is_egress = np.isin(edges["ods"][:, 1], dnodes_scope)
+        access = (edges["ods"][is_access], edges["gc"][is_access])
+        egress = (edges["ods"][is_egress], edges["gc"][is_egress])
+        sources = np.unique(access[0][:, 1]).tolist()
+        targets = np.unique(egress[0][:, 0]).tolist()
+        description = "the stop skims core, from {} boarding to {} alighting nodes"
+    else:
+        sources, targets = onodes_scope, dnodes_scope
+        description = "shortest distances from {} origins to {} destinations"
+    del edges
+
+    direction = get_search_direction(len(sources), len(targets), config.shortest_path_direction)
+    logger.info(
+        f"Calculating {description.format(len(sources), len(targets))} ({direction} search)..."
+    )
+    distmat = get_shortest_distances_engine(
+        g, sources, targets, maxdist, config, return_explored=config.shortest_path_early_stop
+    )
+    if config.shortest_path_early_stop:
+        distmat, explored = distmat
+        logger.info(
+            f"Explored {explored.mean():.0f} nodes per search on average"
+            f" ({explored.max()} at most, out of {n_nodes})."
+        )
 
-    onodes_scope = list(origins[origins["idx"].isin(edges["onode"])]["idx"])
-    dnodes_scope = list(destinations[destinations["idx"].isin(edges["dnode"])]["idx"])
-    maxdist = config.end_s - config.start_s
-    distmat = get_shortest_distances(g, onodes=onodes_scope, dnodes=dnodes_scope, max_dist=maxdist)
+    if config.shortest_path_mode == "stops":
+        logger.info("Composing the access, stop skims and egress distances...")
+        distmat = minplus.compose(
+            access,
+            distmat,
+            egress,
+            onodes=onodes_scope,
+            dnodes=dnodes_scope,
+            max_dist=maxdist,
+            memory_mb=config.shortest_path_memory_mb,
+        )
 
     # expand to the full OD space
     distmat_full = pd.DataFrame(np.inf, index=origins["idx"], columns=destinations["idx"])
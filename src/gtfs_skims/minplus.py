@@ -0,0 +1,106 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+COMPOSE_CACHE_BYTES = 2**23  # default size of the candidate distances of a min-plus block
+
+
+def min_plus(
+    dist: np.ndarray,
+    idx: np.ndarray,
+    weights: np.ndarray,
+    keys: np.ndarray,
+    n_rows: int,
+    memory_mb: Optional[float] = None,
+) -> np.ndarray:
+    """Min-plus product of a sparse matrix (a list of weighted legs) and a dense distance matrix.
+        Each output row is the minimum, over the legs of that row, of the leg weight plus
+        the distances row at the other end of the leg.
+        The legs are processed in blocks, so that the candidate distances of a block
+        fit in the memory budget, or in the CPU cache (`COMPOSE_CACHE_BYTES`) by default.
+
+    Args:
+        dist (np.ndarray): Distances matrix, with a row for each leg end.
+        idx (np.ndarray): Row of `dist` at the far end of each leg.
+        weights (np.ndarray): Weight of each leg.
+        keys (np.ndarray): Output row of each leg.
+        n_rows (int): Number of output rows.
+        memory_mb (Optional[float], optional): Memory budget of each block (MB). Defaults to None.
+
+    Returns:
+        np.ndarray: Distances matrix (n_rows x the columns of `dist`). Rows without legs are infinite.
+    """
+    out = np.full((n_rows, dist.shape[1]), np.inf)
+    order = np.argsort(keys, kind="stable")
+    idx, weights, keys = idx[order], np.asarray(weights, dtype=np.float64)[order], keys[order]
+
+    budget = COMPOSE_CACHE_BYTES if memory_mb is None else memory_mb * 1e6
+    block_size = max(int(budget // (8 * max(dist.shape[1], 1))), 1)
+    for start in range(0, len(keys), block_size):
+        rows = slice(start, start + block_size)
+        groups = np.flatnonzero(np.diff(keys[rows], prepend=-1))
+        targets = keys[rows][groups]
+        candidates = dist[idx[rows]] + weights[rows, None]
+        out[targets] = np.minimum(out[targets], np.minimum.reduceat(candidates, groups, axis=0))
+
+    return out
+
+
+def compose(
+    access: tuple[np.ndarray, np.ndarray],
+    core: pd.DataFrame,
+    egress: tuple[np.ndarray, np.ndarray],
+    onodes: list[int],
+    dnodes: list[int],
+    max_dist: Optional[float] = None,
+    memory_mb: Optional[float] = None,
+) -> pd.DataFrame:
+    """Compose origin-destination distances from the access legs,
+        the boarding to alighting node (stop) distances, and the egress legs:
+        dist(o, d) = min over legs (o, b) and (a, d) of access(o, b) + core(b, a) + egress(a, d).
+        The two min-plus products are associated in the order with the fewest candidate distances.
+
+    Args:
+        access (tuple[np.ndarray, np.ndarray]): Origin and boarding node of each access leg, and its weight.
+        core (pd.DataFrame): Shortest distances from the boarding nodes (index)
+            to the alighting nodes (columns).
+        egress (tuple[np.ndarray, np.ndarray]): Alighting and destination node of each egress leg,
+            and its weight.
+        onodes (list[int]): Origin nodes.
+        dnodes (list[int]): Destination nodes.
+        max_dist (Optional[float], optional): Maximum distance. Defaults to None.
+        memory_mb (Optional[float], optional): Memory budget of each block (MB). Defaults to None.
+
+    Returns:
+        pd.DataFrame:
+            Shortest distances matrix.
+            The dataframe indices are the origin nodes, and the column indices are the destination nodes.
+    """
+    (access_ods, access_weights), (egress_ods, egress_weights) = access, egress
+    access_rows = pd.Index(onodes).get_indexer(access_ods[:, 0])
+    boarding = core.index.get_indexer(access_ods[:, 1])
+    is_access = (access_rows >= 0) & (boarding >= 0)
+    egress_rows = pd.Index(dnodes).get_indexer(egress_ods[:, 1])
+    alighting = core.columns.get_indexer(egress_ods[:, 0])
+    is_egress = (egress_rows >= 0) & (alighting >= 0)
+
+    args_access = (boarding[is_access], access_weights[is_access], access_rows[is_access])
+    args_egress = (alighting[is_egress], egress_weights[is_egress], egress_rows[is_egress])
+    dist = core.to_numpy(dtype=np.float64)
+    n_boarding, n_alighting = dist.shape
+    if is_egress.sum() * n_boarding + is_access.sum() * len(dnodes) <= (
+        is_access.sum() * n_alighting + is_egress.sum() * len(onodes)
+    ):
+        # egress first: (destinations x boarding nodes), then (origins x destinations)
+        to_dest = min_plus(np.ascontiguousarray(dist.T), *args_egress, len(dnodes), memory_mb)
+        d = min_plus(np.ascontiguousarray(to_dest.T), *args_access, len(onodes), memory_mb)
+    else:
+        # access first: (origins x alighting nodes), then (destinations x origins)
+        from_orig = min_plus(dist, *args_access, len(onodes), memory_mb)
+        d = min_plus(np.ascontiguousarray(from_orig.T), *args_egress, len(dnodes), memory_mb).T
+
+    if max_dist is not None:
+        d[d > max_dist] = np.inf
+
+    return pd.DataFrame(d, index=onodes, columns=dnodes)
@@ -1,31 +1,69 @@
+from __future__ import annotations
+
+import logging
 import os
+from zipfile import ZipFile
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyproj
 
-from gtfs_skims.utils import Config, GTFSData, get_logger, get_weekday, ts_to_sec
+from gtfs_skims.cache import evict, get_cache_key, load_cached, save_cached
+from gtfs_skims.utils import Config, GTFSData, get_logger, get_weekday, parse_times, read_gtfs_table
+from gtfs_skims.variables import DATA_TYPE
 
 
-def filter_day(data: GTFSData, date: int) -> None:
-    """Filter the GTFS for a specific date  in the calendar.
+def filter_calendar(
+    calendar: pd.DataFrame, calendar_dates: pd.DataFrame, date: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Filter the calendar tables for a specific date.
 
     Args:
-        data (Data): GTFS data object
+        calendar (pd.DataFrame): The calendar GTFS table.
+        calendar_dates (pd.DataFrame): The calendar_dates GTFS table.
         date (int): Date as yyyymmdd
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: The filtered calendar and calendar_dates tables.
     """
     weekday = get_weekday(date)
-    data.calendar = data.calendar[
-        (data.calendar["start_date"] <= date)
-        & (data.calendar["end_date"] >= date)
-        & (data.calendar[weekday] == 1)
+    calendar = calendar[
+        (calendar["start_date"] <= date) & (calendar["end_date"] >= date) & (calendar[weekday] == 1)
     ]
 
-    data.calendar_dates = data.calendar_dates[
-        data.calendar_dates["date"] == date
-    ]
+    calendar_dates = calendar_dates[calendar_dates["date"] == date]
 
-    service_ids = set(data.calendar["service_id"])
-    service_ids |= set(data.calendar_dates[data.calendar_dates["exception_type"]==1]["service_id"])
-    service_ids -= set(data.calendar_dates[data.calendar_dates["exception_type"]==2]["service_id"])
+    return calendar, calendar_dates
+
+
+def get_service_ids(calendar: pd.DataFrame, calendar_dates: pd.DataFrame) -> set:
+    """Get the running services from the (date-filtered) calendar tables.
+
+    Args:
+        calendar (pd.DataFrame): The calendar GTFS table.
+        calendar_dates (pd.DataFrame): The calendar_dates GTFS table.
+
+    Returns:
+        set: Service IDs.
+    """
+    service_ids = set(calendar["service_id"])
+    service_ids |= set(calendar_dates[calendar_dates["exception_type"] == 1]["service_id"])
+    service_ids -= set(calendar_dates[calendar_dates["exception_type"] == 2]["service_id"])
+
+    return service_ids
+
+
+def filter_day(data: GTFSData, date: int) -> None:
+    """Filter the GTFS for a specific date  in the calendar.
+
+    Args:
+        data (Data): GTFS data object
+        date (int): Date as yyyymmdd
+    """
+    data.calendar, data.calendar_dates = filter_calendar(data.calendar, data.calendar_dates, date)
+    service_ids = get_service_ids(data.calendar, data.calendar_dates)
 
     data.trips = data.trips[data.trips["service_id"].isin(service_ids)]
 
@@ -45,11 +83,15 @@ def filter_time(data: GTFSData, start_time: int, end_time: int) -> None:
         end_time (int): End of the time window (seconds from midnight)
     """
     # filter stop times
-    data.stop_times["departure_s"] = data.stop_times["departure_time"].apply(ts_to_sec)
-    data.stop_times["arrival_s"] = data.stop_times["arrival_time"].apply(ts_to_sec)
+    # (the arrival/departure seconds are already parsed if loaded with the pyarrow engine)
+    if "departure_s" not in data.stop_times.columns:
+        for x in ["departure", "arrival"]:
+            times = pa.array(data.stop_times[f"{x}_time"], type=pa.string(), from_pandas=True)
+            data.stop_times[f"{x}_s"] = parse_times(times)
     data.stop_times = data.stop_times[
         (data.stop_times["arrival_s"] >= start_time) & (data.stop_times["departure_s"] <= end_time)
     ]
+    data.stop_times = data.stop_times.astype({"departure_s": DATA_TYPE, "arrival_s": DATA_TYPE})
 
     # filter stops
     data.stops = data.stops[data.stops["stop_id"].isin(set(data.stop_times["stop_id"]))]
@@ -61,6 +103,54 @@ def filter_time(data: GTFSData, start_time: int, end_time: int) -> None:
     data.routes = data.routes[data.routes["route_id"].isin(set(data.trips["route_id"]))]
 
 
+def read_gtfs_filtered(
+    path_gtfs: str, date: int, start_time: int, end_time: int, block_size: int = 2**20
+) -> GTFSData:
+    """Load a GTFS file, filtering the stop_times table for a date and time window while reading it.
+        The active trips are first resolved from the calendar, calendar_dates and trips tables.
+        The stop_times table is then streamed in blocks, only keeping the stop times of the active trips
+        within the time window. This way, peak memory scales with the filtered output rather than the full feed.
+
+    Args:
+        path_gtfs (str): Path to a zipped GTFS dataset.
+        date (int): Date as yyyymmdd
+        start_time (int): Start of the time window (seconds from midnight)
+        end_time (int): End of the time window (seconds from midnight)
+        block_size (int, optional): Size of each streamed stop_times block (bytes). Defaults to 2**20.
+
+    Returns:
+        GTFSData: GTFS data object.
+    """
+    tables = {}
+    with ZipFile(path_gtfs, "r") as zf:
+        for name in GTFSData.__annotations__.keys():
+            if name != "stop_times":
+                with zf.open(f"{name}.txt") as f:
+                    tables[name] = read_gtfs_table(f, name)
+
+        service_ids = get_service_ids(
+            *filter_calendar(
+                tables["calendar"].to_pandas(), tables["calendar_dates"].to_pandas(), date
+            )
+        )
+        trips = tables["trips"]
+        is_running = pc.is_in(trips["service_id"], pa.array(list(service_ids), pa.string()))
+        trip_ids = trips.filter(is_running)["trip_id"].unique()
+
+        def row_filter(batch: pa.RecordBatch) -> np.ndarray:
+            is_active = pc.is_in(batch.column("trip_id"), trip_ids).to_numpy(zero_copy_only=False)
+            is_active &= parse_times(batch.column("arrival_time")) >= start_time
+            is_active &= parse_times(batch.column("departure_time")) <= end_time
+            return is_active
+
+        with zf.open("stop_times.txt") as f:
+            tables["stop_times"] = read_gtfs_table(
+                f, "stop_times", row_filter=row_filter, block_size=block_size
+            )
+
+    return GTFSData(**GTFSData._arrow_to_pandas(tables))
+
+
 def add_coordinates(data: GTFSData, epsg: int = 27700) -> None:
     """Add BNG coordinates to the stop and stoptime tables.
 
@@ -79,8 +169,10 @@ def add_coordinates(data: GTFSData, epsg: int = 27700) -> None:
     data.stops["x"] = data.stops["x"].round().map(int)
     data.stops["y"] = data.stops["y"].round().map(int)
 
-    data.stop_times["x"] = data.stop_times["stop_id"].map(data.stops.set_index("stop_id")["x"])
-    data.stop_times["y"] = data.stop_times["stop_id"].map(data.stops.set_index("stop_id")["y"])
+    # (reindexing keeps the integer type of the coordinates for categorical stop ids)
+    stops = data.stops.set_index("stop_id")
+    data.stop_times["x"] = stops["x"].reindex(data.stop_times["stop_id"]).values
+    data.stop_times["y"] = stops["y"].reindex(data.stop_times["stop_id"]).values
 
 
 def filter_bounding_box(data: GTFSData, xmin: int, xmax: int, ymin: int, ymax: int) -> None:
@@ -112,19 +204,26 @@ def filter_bounding_box(data: GTFSData, xmin: int, xmax: int, ymin: int, ymax: i
     data.routes = data.routes[data.routes["route_id"].isin(set(data.trips["route_id"]))]
 
 
-def main(config: Config) -> GTFSData:
-    """Run the preprocessing pipeline and save resulting tables to disk.
+def preprocess(config: Config, logger: logging.Logger) -> GTFSData:
+    """Read and filter the GTFS tables.
 
     Args:
         config (Config): Config object.
+        logger (logging.Logger): Logger.
 
     Returns:
         GTFSData: Pre-processed GTFS data object.
     """
-    logger = get_logger(os.path.join(config.path_outputs, "log_preprocessing.log"))
-
     logger.info("Reading files...")
-    data = GTFSData.from_gtfs(path_gtfs=config.path_gtfs)
+    if config.stream_stop_times:
+        data = read_gtfs_filtered(
+            path_gtfs=config.path_gtfs,
+            date=config.calendar_date,
+            start_time=config.start_s,
+            end_time=config.end_s,
+        )
+    else:
+        data = GTFSData.from_gtfs(path_gtfs=config.path_gtfs)
 
     logger.info("Time filtering..")
     filter_day(data, config.calendar_date)
@@ -135,8 +234,43 @@ def main(config: Config) -> GTFSData:
         logger.info("Cropping to bounding box..")
         filter_bounding_box(data, **config.bounding_box)
 
+    return data
+
+
+def main(config: Config) -> GTFSData:
+    """Run the preprocessing pipeline and save resulting tables to disk.
+        If a cache directory is specified in the config (`path_cache`),
+        the pre-processed tables are re-used from there when the GTFS file and preprocessing settings match.
+
+    Args:
+        config (Config): Config object.
+
+    Returns:
+        GTFSData: Pre-processed GTFS data object.
+    """
+    logger = get_logger(os.path.join(config.path_outputs, "log_preprocessing.log"))
+
+    if config.path_cache is not None:
+        key = get_cache_key(config)
+        data = load_cached(config.path_cache, key)
+        if data is not None:
+            logger.info(f"Cache hit ({key}), re-using the pre-processed tables.")
+            logger.info(f"Saving outputs at {config.path_outputs}")
+            data.save(config.path_outputs, fmt=config.intermediate_format)
+            return data
+        logger.info(f"Cache miss ({key}).")
+
+    data = preprocess(config, logger)
+
     logger.info(f"Saving outputs at {config.path_outputs}")
-    data.save(config.path_outputs)
+    data.save(config.path_outputs, fmt=config.intermediate_format)
+
+    if config.path_cache is not None:
+        logger.info(f"Saving to cache at {config.path_cache}")
+        save_cached(config.path_cache, key, data)
+        evicted = evict(config.path_cache, config.cache_max_size_mb, config.cache_max_age_days)
+        if len(evicted) > 0:
+            logger.info(f"Evicted {len(evicted)} entries from the cache.")
 
     logger.info("Preprocessing complete.")
 
@@ -6,15 +6,24 @@ from abc import ABC
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional, Union
 from zipfile import ZipFile
 
 import importlib_resources
 import jsonschema
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.feather as feather
 import yaml
 
 from gtfs_skims import config as schema_dir
+from gtfs_skims.variables import GTFS_COLUMNS
+
+# compression of the parquet storage formats
+PARQUET_COMPRESSION = {"parquet.gzip": "gzip", "parquet.zstd": "zstd", "parquet": None}
 
 
 def ts_to_sec(x: str) -> int:
@@ -30,6 +39,134 @@ def ts_to_sec(x: str) -> int:
     return 3600 * s[0] + 60 * s[1] + s[2]
 
 
+def parse_times(times: Union[pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    """Convert an array of [h]h:mm:ss timestamps to seconds from midnight.
+        The timestamps are parsed in a vectorised way, directly from the Arrow string buffers.
+        Hours can exceed 24 (for services running past midnight).
+
+    Args:
+        times (Union[pa.Array, pa.ChunkedArray]): Timestamps. Blank timestamps should be null or empty.
+
+    Raises:
+        ValueError: If a timestamp is not in the [h]h:mm:ss format.
+
+    Returns:
+        np.ndarray: Seconds from midnight (NaN where the timestamp is blank).
+    """
+    if isinstance(times, pa.ChunkedArray):
+        times = times.combine_chunks()
+    times = pc.utf8_trim_whitespace(times.cast(pa.string()))
+
+    _, offsets, data = times.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32, count=len(times) + 1, offset=times.offset * 4)
+    data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.array([], dtype=np.uint8)
+    data = np.append(data, np.uint8(0))  # a valid index for blank timestamps
+    end = offsets[1:]
+    length = end - offsets[:-1]
+    is_blank = times.is_null().to_numpy(zero_copy_only=False) | (length == 0)
+
+    def char(k: int) -> np.ndarray:
+        """The k-th character from the end of each timestamp."""
+        idx = np.where(is_blank | (length < k), len(data) - 1, end - k)
+        return data[idx]
+
+    def digit(k: int) -> np.ndarray:
+        """The k-th character from the end of each timestamp, as a digit (0 if out of bounds)."""
+        d = char(k).astype(np.int32) - ord("0")
+        return np.where(length >= k, d, 0)
+
+    digits = [digit(k) for k in [1, 2, 4, 5, 7, 8, 9]]
+    is_valid = (
+        (length >= 7)
+        & (length <= 9)
+        & (char(3) == ord(":"))
+        & (char(6) == ord(":"))
+        & np.logical_and.reduce([(d >= 0) & (d <= 9) for d in digits])
+    )
+    if not (is_valid | is_blank).all():
+        invalid = np.flatnonzero(~(is_valid | is_blank))[0]
+        raise ValueError(f"Invalid timestamp: {times[invalid]}")
+
+    s1, s10, m1, m10, h1, h10, h100 = digits
+    seconds = (3600 * (h1 + 10 * h10 + 100 * h100) + 60 * (m1 + 10 * m10) + s1 + 10 * s10).astype(
+        np.float32
+    )
+    seconds[is_blank] = np.nan
+
+    return seconds
+
+
+def narrow(values: np.ndarray, dtypes: list, name: str = "values") -> np.ndarray:
+    """Cast an array to the first (most compact) of a list of types that can represent its values exactly.
+
+    Args:
+        values (np.ndarray): Values array.
+        dtypes (list): Candidate types, in order of preference.
+        name (str, optional): Name of the values, used in the error message. Defaults to "values".
+
+    Raises:
+        ValueError: If none of the types can represent the values.
+
+    Returns:
+        np.ndarray: The cast array.
+    """
+    values = np.asarray(values)
+    for dtype in map(np.dtype, dtypes):
+        if values.dtype == dtype:
+            return values
+        if np.issubdtype(values.dtype, np.integer) and np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+                return values.astype(dtype)
+        else:
+            narrowed = values.astype(dtype)
+            equal_nan = np.issubdtype(dtype, np.floating) and np.issubdtype(
+                values.dtype, np.floating
+            )
+            if np.array_equal(narrowed, values, equal_nan=equal_nan):
+                return narrowed
+
+    raise ValueError(
+        f"The {name} cannot be represented as any of {[np.dtype(x).name for x in dtypes]}"
+        f" (range: {values.min()} to {values.max()})."
+    )
+
+
+def get_cpu_limit(path_cgroup: str = "/sys/fs/cgroup") -> int:
+    """Get the number of CPUs available to the process.
+        This is the number of CPUs in the process affinity mask,
+        capped by the CPU quota of the container (cgroup v2 `cpu.max` or cgroup v1 `cpu.cfs_quota_us`).
+
+    Args:
+        path_cgroup (str, optional): Root of the cgroup filesystem. Defaults to "/sys/fs/cgroup".
+
+    Returns:
+        int: Number of CPUs (at least one).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        n_cpus = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        with open(os.path.join(path_cgroup, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open(os.path.join(path_cgroup, "cpu", "cpu.cfs_quota_us")) as f:
+                quota = f.read().strip()
+            with open(os.path.join(path_cgroup, "cpu", "cpu.cfs_period_us")) as f:
+                period = f.read().strip()
+        except OSError:
+            quota = None
+
+    if quota is not None and quota not in ["max", "-1"]:
+        n_cpus = min(n_cpus, int(np.ceil(int(quota) / int(period))))
+
+    return max(n_cpus, 1)
+
+
 def get_weekday(date: int) -> str:
     """Get the weekday of a date
 
@@ -99,6 +236,7 @@ class Config:
         path_outputs: /mnt/efs/otp/gtfs_transfers/skims_iow
         path_origins: ./centroids.csv # path to the origin points
         path_destinations: ./centroids.csv # path to the destination points
+        path_cache: null # path to the pre-processed GTFS cache directory (optional)
 
     settings:
         calendar_date : 20190515 # yyyymmdd | Date for filtering the GTFS file.
@@ -112,6 +250,24 @@ class Config:
         max_wait : 1800  # sec | Max wait time at a stop
         bounding_box : null
         epsg_centroids: 27700 # coordinate system of the centroids file. Needs to be Cartesian and in meters.
+        stream_stop_times: false # Filter the stop_times table while reading it, to reduce peak memory.
+        cache_max_size_mb: 1000 # MB | Max size of the pre-processed GTFS cache.
+        cache_max_age_days: 30 # days | Max time since a cache entry was last used.
+        intermediate_format: parquet.gzip # Storage format of the intermediate tables (parquet.gzip, parquet.zstd, parquet or arrow).
+        connectors_engine: stop_times # Search connectors over all stop times or at stop level (stops).
+        connectors_memory_mb: null # MB | Memory budget of the transfer connectors search (tiled if set).
+        connectors_workers: 1 # Number of processes used to get the connectors.
+        graph_sharing: fork # How the shortest distances workers get the graph (fork or disk).
+        graph_workers: null # Number of shortest distances worker processes (defaults to the available CPUs).
+        graph_chunksize: null # Origins per shortest distances task (adaptive if null).
+        graph_start_method: null # Start method of the shortest distances workers (fork, spawn or forkserver).
+        shortest_path_engine: dag # Shortest distances with a topological sweep (dag), a connection scan (csa) or graph-tool (Dijkstra).
+        shortest_path_memory_mb: null # MB | Memory budget of each block of origins swept together (dag and csa engines).
+        shortest_path_mode: origins # Search from every origin (origins), or compose access + stop skims + egress (stops).
+        shortest_path_direction: auto # Search forward from the origins, backward from the destinations, or from the smaller set (auto).
+        shortest_path_early_stop: false # Stop the dag/csa sweeps once the destinations are settled, and log the nodes explored per search.
+        graph_contract_chains: false # Contract the pass-through stop times (a single in-vehicle edge in and out) before the shortest paths search.
+        graph_prune_unreachable: false # Drop the stop times and edges that are not on any origin-destination path within the time window.
 
 
     steps:
@@ -140,6 +296,25 @@ class Config:
     weight_wait: float
     penalty_interchange: float
     steps: list
+    path_cache: Optional[str] = None
+    cache_max_size_mb: Optional[float] = None
+    cache_max_age_days: Optional[float] = None
+    stream_stop_times: bool = False
+    intermediate_format: str = "parquet.gzip"
+    connectors_engine: str = "stop_times"
+    connectors_memory_mb: Optional[float] = None
+    connectors_workers: int = 1
+    graph_sharing: str = "fork"
+    graph_workers: Optional[int] = None
+    graph_chunksize: Optional[int] = None
+    graph_start_method: Optional[str] = None
+    shortest_path_engine: str = "dag"
+    shortest_path_memory_mb: Optional[float] = None
+    shortest_path_mode: str = "origins"
+    shortest_path_direction: str = "auto"
+    shortest_path_early_stop: bool = False
+    graph_contract_chains: bool = False
+    graph_prune_unreachable: bool = False
 
     @classmethod
     def from_yaml(cls, path: str) -> Config:
@@ -168,14 +343,130 @@ class Config:
         return s
 
 
+def read_gtfs_table(
+    f,
+    name: str,
+    row_filter: Optional[Callable[[pa.RecordBatch], np.ndarray]] = None,
+    block_size: int = 2**20,
+) -> pa.Table:
+    """Read the required columns of a GTFS table, using the Arrow CSV reader.
+        Column types are set from the `GTFS_COLUMNS` lookup. Id and time columns are read as strings.
+
+    Args:
+        f: File object of the GTFS table (.txt).
+        name (str): Table name, ie "stop_times".
+        row_filter (Optional[Callable[[pa.RecordBatch], np.ndarray]], optional):
+            If provided, the table is streamed in blocks and only the rows where
+            `row_filter(block)` is True are kept. Defaults to None.
+        block_size (int, optional): Size of each streamed block (bytes). Defaults to 2**20.
+
+    Returns:
+        pa.Table: GTFS table.
+    """
+    column_types = {
+        k: pa.string() if v in ["id", "time"] else pa.from_numpy_dtype(np.dtype(v))
+        for k, v in GTFS_COLUMNS[name].items()
+    }
+    convert_options = pv.ConvertOptions(
+        column_types=column_types,
+        include_columns=list(column_types),
+        include_missing_columns=True,
+        strings_can_be_null=True,
+    )
+    if row_filter is None:
+        return pv.read_csv(f, convert_options=convert_options)
+
+    reader = pv.open_csv(
+        f, read_options=pv.ReadOptions(block_size=block_size), convert_options=convert_options
+    )
+    batches = [batch.filter(pa.array(row_filter(batch))) for batch in reader]
+    return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def get_numeric_ids(values: pa.ChunkedArray) -> Optional[pa.ChunkedArray]:
+    """Convert a set of (string) ids to integers, if that does not change them.
+        GTFS ids are opaque strings, so they are only numeric if they are all set,
+        and they are all written as plain integers (ie "01" and "1" are different ids).
+
+    Args:
+        values (pa.ChunkedArray): Ids.
+
+    Returns:
+        Optional[pa.ChunkedArray]: The integer ids, or None if the ids are not numeric.
+    """
+    if values.null_count > 0:
+        return None
+    try:
+        numeric = pc.cast(values, pa.int64())
+    except pa.ArrowInvalid:
+        return None
+    if not pc.all(pc.equal(pc.cast(numeric, pa.string()), values)).as_py():
+        return None
+    return numeric
+
+
+def compact_ids(tables: dict[str, pa.Table]) -> dict[str, pd.Series]:
+    """Convert the id columns of a set of GTFS tables to compact data types.
+        Numeric ids (see `get_numeric_ids`) are converted to the smallest integer type that fits them.
+        Any other ids are converted to a categorical type.
+        Each id (ie "trip_id") gets the same data type across all tables, so that it can be compared between them.
+
+    Args:
+        tables (dict[str, pa.Table]): GTFS tables, as read by `read_gtfs_table`.
+
+    Returns:
+        dict[str, pd.Series]: The converted id columns, keyed by "{table name}.{column name}".
+    """
+    ids = {}
+    for name, table in tables.items():
+        for column, dtype in GTFS_COLUMNS[name].items():
+            if dtype == "id":
+                ids.setdefault(column, []).append(name)
+
+    converted = {}
+    for column, names in ids.items():
+        values = pa.chunked_array(
+            [chunk for name in names for chunk in tables[name][column].chunks], type=pa.string()
+        )
+        numeric = get_numeric_ids(values)
+        if numeric is not None:
+            limits = pc.min_max(numeric).as_py()
+            if limits["min"] is None:
+                dtype = np.dtype(np.int64)
+            else:
+                dtype = np.promote_types(
+                    np.min_scalar_type(limits["min"]), np.min_scalar_type(limits["max"])
+                )
+            for name in names:
+                converted[f"{name}.{column}"] = pd.Series(
+                    pc.cast(tables[name][column], pa.int64()).to_numpy().astype(dtype), name=column
+                )
+        else:
+            categories = pc.unique(values).drop_null()
+            categories = categories.take(pc.sort_indices(categories))
+            dtype = pd.CategoricalDtype(pd.Index(categories.to_numpy(zero_copy_only=False)))
+            for name in names:
+                codes = pc.fill_null(pc.index_in(tables[name][column], value_set=categories), -1)
+                converted[f"{name}.{column}"] = pd.Series(
+                    pd.Categorical.from_codes(codes.to_numpy(), dtype=dtype), name=column
+                )
+
+    return converted
+
+
 @dataclass
 class Data(ABC):
     @classmethod
-    def from_gtfs(cls, path_gtfs: str) -> Data:
+    def from_gtfs(cls, path_gtfs: str, engine: str = "pyarrow") -> Data:
         """Load GTFS tables from a standard zipped GTFS file.
 
         Args:
             path_gtfs (str): Path to a zipped GTFS dataset.
+            engine (str, optional): CSV reader to use. Defaults to "pyarrow".
+                - "pyarrow": only read the columns required by the pipeline (see `GTFS_COLUMNS`),
+                    using compact data types and parsing the arrival/departure times to seconds
+                    (in the "arrival_s" and "departure_s" columns).
+                - "pandas": read all columns with pandas' default type inference.
 
         Returns:
             GTFSData: GTFS data object.
@@ -184,35 +475,82 @@ class Data(ABC):
         with ZipFile(path_gtfs, "r") as zf:
             for name in cls.__annotations__.keys():
                 with zf.open(f"{name}.txt") as f:
-                    data[name] = pd.read_csv(f, low_memory=False)
+                    if engine == "pandas":
+                        data[name] = pd.read_csv(f, low_memory=False)
+                    else:
+                        data[name] = read_gtfs_table(f, name)
+
+        if engine != "pandas":
+            data = cls._arrow_to_pandas(data)
+
         return cls(**data)
 
+    @staticmethod
+    def _arrow_to_pandas(tables: dict[str, pa.Table]) -> dict[str, pd.DataFrame]:
+        """Convert GTFS tables read by `read_gtfs_table` to dataframes, with compact ids and parsed times.
+
+        Args:
+            tables (dict[str, pa.Table]): GTFS tables.
+
+        Returns:
+            dict[str, pd.DataFrame]: GTFS dataframes.
+        """
+        ids = compact_ids(tables)
+        data = {}
+        for name, table in tables.items():
+            df = pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+            for column, dtype in GTFS_COLUMNS[name].items():
+                if dtype == "id":
+                    df[column] = ids[f"{name}.{column}"]
+                elif dtype == "time":
+                    df[column.replace("_time", "_s")] = parse_times(table[column])
+                else:
+                    df[column] = table[column].to_numpy()
+            data[name] = df
+        return data
+
     @classmethod
-    def from_parquet(cls, path: str) -> Data:
-        """Construct class from pre-processed GTFS tables in Parquet format.
+    def from_parquet(cls, path: str, fmt: str = "parquet.gzip") -> Data:
+        """Construct class from pre-processed tables saved with the `save` method.
 
         Args:
             path (str): Path to tables.
+            fmt (str, optional): Storage format (see the `save` method). Defaults to "parquet.gzip".
+                Tables in the "arrow" format are memory-mapped, so numeric columns are read (almost) zero-copy.
 
         Returns:
             GTFSData: GTFS data object.
         """
         data = {}
         for name in cls.__annotations__.keys():
-            data[name] = pd.read_parquet(os.path.join(path, f"{name}.parquet.gzip"))
+            path_table = os.path.join(path, f"{name}.{fmt}")
+            if fmt == "arrow":
+                table = feather.read_table(path_table, memory_map=True)
+                data[name] = table.to_pandas(split_blocks=True)
+            else:
+                data[name] = pd.read_parquet(path_table)
         return cls(**data)
 
-    def save(self, path_outputs: str) -> None:
-        """Export all tables in zipped parquet format.
+    def save(self, path_outputs: str, fmt: str = "parquet.gzip") -> None:
+        """Export all tables.
 
         Args:
             path_outputs (str): Directory to save outputs.
+            fmt (str, optional): Storage format. Defaults to "parquet.gzip".
+                - "parquet.gzip": gzip-compressed parquet.
+                - "parquet.zstd": zstd-compressed parquet (faster to write and read than gzip).
+                - "parquet": uncompressed parquet.
+                - "arrow": uncompressed Arrow IPC (Feather v2) files, which can be memory-mapped.
         """
         if not os.path.exists(path_outputs):
             os.makedirs(path_outputs)
 
         for k, v in self.__dict__.items():
-            v.to_parquet(os.path.join(path_outputs, f"{k}.parquet.gzip"), compression="gzip")
+            path_table = os.path.join(path_outputs, f"{k}.{fmt}")
+            if fmt == "arrow":
+                feather.write_feather(v, path_table, compression="uncompressed")
+            else:
+                v.to_parquet(path_table, compression=PARQUET_COMPRESSION[fmt])
 
 
 @dataclass
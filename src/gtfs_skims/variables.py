@@ -1,6 +1,8 @@
 import numpy as np
 
 DATA_TYPE = np.uint32
+NODE_TYPE = np.int32  # graph node ids
+TIME_TYPES = [np.uint16, np.uint32]  # edge times (sec), using the most compact type that fits
 
 # route types lookup
 # source: https://developers.google.com/transit/gtfs/reference#routestxt
@@ -20,3 +22,32 @@ ROUTE_TYPES = {
     401: "undergound",  # Metro Service
     402: "underground",  # Underground Service
 }
+
+# GTFS columns to read when loading a feed, and their data types.
+# "id" columns are converted to compact integer or categorical types,
+# and "time" columns are parsed to seconds from midnight.
+GTFS_COLUMNS = {
+    "calendar": {
+        "service_id": "id",
+        "monday": "uint8",
+        "tuesday": "uint8",
+        "wednesday": "uint8",
+        "thursday": "uint8",
+        "friday": "uint8",
+        "saturday": "uint8",
+        "sunday": "uint8",
+        "start_date": "uint32",
+        "end_date": "uint32",
+    },
+    "calendar_dates": {"service_id": "id", "date": "uint32", "exception_type": "uint8"},
+    "routes": {"route_id": "id", "route_type": "uint16"},
+    "stops": {"stop_id": "id", "stop_lon": "float64", "stop_lat": "float64"},
+    "stop_times": {
+        "trip_id": "id",
+        "arrival_time": "time",
+        "departure_time": "time",
+        "stop_id": "id",
+        "stop_sequence": "uint32",
+    },
+    "trips": {"route_id": "id", "service_id": "id", "trip_id": "id"},
+}
@@ -0,0 +1,629 @@
+"""Performance benchmarks, comparing optimised routines against their reference implementation.
+
+These are not run by default. To run them, use: `pytest -m benchmark -s -n0 --no-cov`.
+"""
+
+import multiprocessing
+import os
+import resource
+import time
+import tracemalloc
+from pathlib import Path
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from gtfs_skims import connectors, csa, dag, minplus, preprocessing, utils
+
+TEST_DATA_DIR = os.path.join(Path(__file__).parent, "test_data")
+N_REPLICATES = 200  # number of copies of the test GTFS timetable in the synthetic large feed
+N_REPLICATES_DENSE = 50  # number of time-shifted copies of each trip in the synthetic dense network
+
+
+def _measure_child(conn, func, args, kwargs) -> None:
+    with open("/proc/self/statm") as f:
+        rss_start = int(f.read().split()[1]) * resource.getpagesize()
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    seconds = time.perf_counter() - t0
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    conn.send((seconds, (rss_peak - rss_start) / 1e6))
+
+
+def measure(func, *args, **kwargs) -> tuple:
+    """Run a function in a forked process and measure its runtime and peak memory.
+
+    Returns:
+        tuple: (seconds, peak memory increase in MB)
+    """
+    ctx = multiprocessing.get_context("fork")
+    conn_parent, conn_child = ctx.Pipe()
+    process = ctx.Process(target=_measure_child, args=(conn_child, func, args, kwargs))
+    process.start()
+    out = conn_parent.recv()
+    process.join()
+    return out
+
+
+@pytest.fixture(scope="module")
+def path_gtfs_large(tmp_path_factory) -> str:
+    """A large synthetic feed, replicating the test timetable under different trip ids."""
+    path = os.path.join(tmp_path_factory.mktemp("gtfs"), "large-gtfs.zip")
+    with ZipFile(os.path.join(TEST_DATA_DIR, "iow-bus-gtfs.zip")) as zf_in:
+        with ZipFile(path, "w") as zf_out:
+            for name in zf_in.namelist():
+                df = pd.read_csv(zf_in.open(name), dtype=str)
+                if name in ["trips.txt", "stop_times.txt"]:
+                    df = pd.concat(
+                        [df.assign(trip_id=df["trip_id"] + f"{i:04d}") for i in range(N_REPLICATES)]
+                    )
+                zf_out.writestr(name, df.to_csv(index=False))
+    return path
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_benchmark_load_gtfs(path_gtfs_large, engine):
+    seconds, peak = measure(utils.GTFSData.from_gtfs, path_gtfs_large, engine=engine)
+    print(f"\nfrom_gtfs[{engine}]: {seconds:.2f}s, peak memory {peak:.0f}MB")
+
+
+def load_and_filter(path_gtfs: str, config: utils.Config, stream: bool) -> None:
+    if stream:
+        data = preprocessing.read_gtfs_filtered(
+            path_gtfs, config.calendar_date, config.start_s, config.end_s
+        )
+    else:
+        data = utils.GTFSData.from_gtfs(path_gtfs)
+    preprocessing.filter_day(data, config.calendar_date)
+    preprocessing.filter_time(data, config.start_s, config.end_s)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("stream", [False, True])
+def test_benchmark_stream_stop_times(path_gtfs_large, config, stream):
+    seconds, peak = measure(load_and_filter, path_gtfs_large, config, stream)
+    print(f"\nload and filter[stream={stream}]: {seconds:.2f}s, peak memory {peak:.0f}MB")
+
+
+@pytest.fixture(scope="module")
+def timestamps() -> pd.Series:
+    seconds = np.random.default_rng(0).integers(0, 30 * 3600, 2_000_000)
+    return pd.Series([f"{x // 3600:02d}:{x % 3600 // 60:02d}:{x % 60:02d}" for x in seconds])
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("parser", ["ts_to_sec", "parse_times"])
+def test_benchmark_parse_times(timestamps, parser):
+    if parser == "ts_to_sec":
+        seconds, peak = measure(timestamps.apply, utils.ts_to_sec)
+    else:
+        seconds, peak = measure(utils.parse_times, pa.array(timestamps))
+    print(f"\n{parser}[{len(timestamps)} timestamps]: {seconds:.2f}s, peak memory {peak:.0f}MB")
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("fmt", ["parquet.gzip", "parquet.zstd", "parquet", "arrow"])
+def test_benchmark_intermediate_format(path_gtfs_large, tmp_path, fmt):
+    data = utils.GTFSData.from_gtfs(path_gtfs_large)
+    seconds_save, _ = measure(data.save, tmp_path, fmt=fmt)
+    seconds, peak = measure(utils.GTFSData.from_parquet, tmp_path, fmt=fmt)
+    print(
+        f"\nformat[{fmt}]: save {seconds_save:.2f}s, load {seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.fixture(scope="module")
+def gtfs_data_dense() -> utils.GTFSData:
+    """A synthetic dense network: all test GTFS trips, plus time-shifted copies of each trip."""
+    data = utils.GTFSData.from_gtfs(os.path.join(TEST_DATA_DIR, "iow-bus-gtfs.zip"))
+    preprocessing.filter_time(data, 6 * 3600, 10 * 3600)
+    preprocessing.add_coordinates(data)
+
+    n_trips = int(data.trips["trip_id"].max()) + 1
+    data.trips = pd.concat(
+        [
+            data.trips.astype({"trip_id": int}).assign(trip_id=lambda x: x["trip_id"] + i * n_trips)
+            for i in range(N_REPLICATES_DENSE)
+        ]
+    )
+    data.stop_times = pd.concat(
+        [
+            data.stop_times.astype({"trip_id": int, "departure_s": int}).assign(
+                trip_id=lambda x: x["trip_id"] + i * n_trips,
+                departure_s=lambda x: x["departure_s"] + i * 120,
+            )
+            for i in range(N_REPLICATES_DENSE)
+        ],
+        ignore_index=True,
+    )
+    return data
+
+
+@pytest.fixture
+def config_benchmark() -> utils.Config:
+    return utils.Config.from_yaml(os.path.join(TEST_DATA_DIR, "config_demo.yaml"))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("engine", ["stop_times", "stops"])
+def test_benchmark_transfer_connectors(gtfs_data_dense, config_benchmark, engine):
+    config_benchmark.connectors_engine = engine
+    seconds, peak = measure(connectors.get_transfer_connectors, gtfs_data_dense, config_benchmark)
+    print(
+        f"\ntransfer connectors[{engine}, {len(gtfs_data_dense.stop_times)} stop times]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("memory_mb", [None, 50, 10])
+def test_benchmark_transfer_connectors_tiled(
+    gtfs_data_dense, config_benchmark, tmp_path, memory_mb
+):
+    config_benchmark.path_outputs = str(tmp_path)
+    config_benchmark.connectors_memory_mb = memory_mb
+    seconds, peak = measure(connectors.get_transfer_connectors, gtfs_data_dense, config_benchmark)
+    print(
+        f"\ntransfer connectors[memory budget {memory_mb}MB]: {seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+def get_connectors(data: utils.GTFSData, config: utils.Config) -> None:
+    origins = pd.read_csv(config.path_origins, index_col=0)
+    destinations = pd.read_csv(config.path_destinations, index_col=0)
+    if config.connectors_workers > 1:
+        connectors.get_connectors_parallel(data, config, origins, destinations)
+    else:
+        connectors.get_transfer_connectors(data, config)
+        connectors.get_access_connectors(data, config, origins)
+        connectors.get_egress_connectors(data, config, destinations)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_benchmark_connectors_workers(gtfs_data_dense, config_benchmark, workers):
+    config_benchmark.connectors_workers = workers
+    seconds, peak = measure(get_connectors, gtfs_data_dense, config_benchmark)
+    print(f"\nconnectors[{workers} workers]: {seconds:.2f}s, peak memory {peak:.0f}MB")
+
+
+def filter_transfer_connectors(
+    coords: np.ndarray, routes: np.ndarray, services: np.ndarray, eager: bool
+):
+    """Run the transfer connectors filters, returning the peak size of the allocated arrays (MB)."""
+    tc = connectors.TransferConnectors(coords, 2250)
+    tc.walk, tc.wait  # distances of the candidate connectors
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    filters = [
+        lambda: tc.filter_feasible_transfer(2250),
+        lambda: tc.filter_max_walk(2000),
+        lambda: tc.filter_max_wait(1500),
+        lambda: tc.filter_same_route(routes),
+        lambda: tc.filter_nearest_service(services),
+    ]
+    for f in filters:
+        f()
+        if eager:  # materialize the filtered data after each step
+            tc.ods
+    tc.ods
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("eager", [True, False])
+def test_benchmark_transfer_filters(gtfs_data_dense, config_benchmark, eager):
+    coords, routes, services, _ = connectors.get_transfer_inputs(gtfs_data_dense, config_benchmark)
+    start = time.perf_counter()
+    peak = filter_transfer_connectors(coords, routes, services, eager)
+    seconds = time.perf_counter() - start
+    print(
+        f"\ntransfer filters[{'eager' if eager else 'lazy'}]: {seconds:.2f}s, peak allocations {peak:.0f}MB"
+    )
+
+
+def nearest_service_isin(ods: np.ndarray, transfer: np.ndarray, services: np.ndarray) -> np.ndarray:
+    """The previous (encoded origin-service key, unique and isin) nearest-service filter, for comparison."""
+    services_d = services[ods[:, 1]]
+    idx_sorted = transfer.argsort()
+    order_o = int(np.floor(np.log10(services.max())) + 1)
+    comb = (ods[:, 0] + 1) * 10**order_o + services_d
+    keep = idx_sorted[np.unique(comb[idx_sorted], return_index=True)[1]]
+    return np.isin(np.arange(len(comb)), keep)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n_points", [5_000, 20_000, 50_000])
+@pytest.mark.parametrize("kernel", ["isin", "group_argmin"])
+def test_benchmark_nearest_service(n_points, kernel):
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 1000, size=(n_points, 3))
+    services = rng.integers(1, 200, size=n_points)
+    tc = connectors.TransferConnectors(coords, 50)
+    transfer = tc.walk + tc.wait
+
+    start = time.perf_counter()
+    if kernel == "isin":
+        nearest_service_isin(tc.ods, transfer, services)
+    else:
+        tc.filter_nearest_service(services)
+        tc.ods
+    seconds = time.perf_counter() - start
+    print(f"\nnearest service[{kernel}, {len(transfer)} candidates]: {seconds:.3f}s")
+
+
+@pytest.fixture(scope="module")
+def origins_dense(gtfs_data_dense) -> pd.DataFrame:
+    """A grid of origins over the extent of the dense network stops."""
+    x = np.linspace(gtfs_data_dense.stops["x"].min(), gtfs_data_dense.stops["x"].max(), 100)
+    y = np.linspace(gtfs_data_dense.stops["y"].min(), gtfs_data_dense.stops["y"].max(), 100)
+    xx, yy = np.meshgrid(x, y)
+    return pd.DataFrame({"x": xx.ravel(), "y": yy.ravel()})
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("engine", ["stop_times", "stops"])
+def test_benchmark_access_connectors(gtfs_data_dense, config_benchmark, origins_dense, engine):
+    config_benchmark.connectors_engine = engine
+    seconds, peak = measure(
+        connectors.get_access_connectors, gtfs_data_dense, config_benchmark, origins_dense
+    )
+    print(
+        f"\naccess connectors[{engine}, {len(origins_dense)} origins]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+def get_egress_edges(data: utils.GTFSData, config: utils.Config, destinations: pd.DataFrame):
+    arr = connectors.get_egress_connectors(data, config, destinations)
+    if config.connectors_engine == "stops":
+        arr = connectors.get_alight_connectors(data, arr, offset=len(data.stop_times))
+    print(f"\negress edges[{config.connectors_engine}]: {len(arr)}", end="")
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("engine", ["stop_times", "stops"])
+def test_benchmark_egress_connectors(gtfs_data_dense, config_benchmark, origins_dense, engine):
+    config_benchmark.connectors_engine = engine
+    seconds, peak = measure(get_egress_edges, gtfs_data_dense, config_benchmark, origins_dense)
+    print(
+        f"\negress connectors[{engine}, {len(origins_dense)} destinations]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.mark.benchmark
+def test_benchmark_compact_tables(gtfs_data_dense, config_benchmark, tmp_path):
+    config_benchmark.path_outputs = str(tmp_path)
+    conn = connectors.main(config_benchmark, gtfs_data_dense)
+    tables = {
+        f"connectors_{x}": (getattr(conn, f"connectors_{x}"), np.uint32)
+        for x in ["transfer", "access", "egress"]
+    }
+    try:
+        from gtfs_skims import graph
+    except ImportError:  # graph-tool is not installed
+        pass
+    else:
+        edges = graph.add_gc(graph.get_all_edges(gtfs_data_dense, conn), config_benchmark)
+        tables["edges"] = (edges, np.int64)
+
+    for name, (df, dtype_previous) in tables.items():
+        size = df.memory_usage(index=False).sum() / 1e6
+        size_previous = df.astype(dtype_previous).memory_usage(index=False).sum() / 1e6
+        print(
+            f"\n{name}[{len(df)} rows]: {size:.2f}MB ({size_previous:.2f}MB as {dtype_previous.__name__})"
+        )
+
+
+def get_ivt_edges_groupby(stop_times: pd.DataFrame) -> pd.DataFrame:
+    """The previous (groupby-shift) in-vehicle edges implementation, for comparison."""
+    edges_ivt = pd.Series(range(len(stop_times)))
+    trip_id = stop_times.reset_index()["trip_id"]
+    departures = stop_times.reset_index()["departure_s"]
+    edges_ivt = (
+        pd.concat(
+            [
+                edges_ivt,
+                edges_ivt.groupby(trip_id).shift(-1),
+                departures.groupby(trip_id).shift(-1) - departures,
+            ],
+            axis=1,
+        )
+        .dropna()
+        .map(int)
+    )
+    edges_ivt.columns = ["onode", "dnode", "ivt"]
+    return edges_ivt
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("method", ["groupby", "numpy"])
+def test_benchmark_ivt_edges(gtfs_data_dense, method):
+    graph = pytest.importorskip("gtfs_skims.graph")
+    func = get_ivt_edges_groupby if method == "groupby" else graph.get_ivt_edges
+    seconds, peak = measure(func, gtfs_data_dense.stop_times)
+    print(
+        f"\nivt edges[{method}, {len(gtfs_data_dense.stop_times)} stop times]: "
+        f"{seconds:.3f}s, peak memory {peak:.0f}MB"
+    )
+
+
+def assemble_edges_table(gtfs_data: utils.GTFSData, connectors_data: utils.ConnectorsData, config):
+    graph = pytest.importorskip("gtfs_skims.graph")
+    edges = graph.add_gc(graph.get_all_edges(gtfs_data, connectors_data), config)
+    edges[["onode", "dnode", "ivt", "walk", "wait", "time", "gc"]].values  # graph input
+
+
+def assemble_edge_arrays(gtfs_data: utils.GTFSData, connectors_data: utils.ConnectorsData, config):
+    graph = pytest.importorskip("gtfs_skims.graph")
+    graph.add_gc_arrays(graph.get_edge_arrays(gtfs_data, connectors_data), config)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("method", ["table", "arrays"])
+def test_benchmark_edges_assembly(gtfs_data_dense, config_benchmark, tmp_path, method):
+    pytest.importorskip("gtfs_skims.graph")
+    config_benchmark.path_outputs = str(tmp_path)
+    config_benchmark.connectors_engine = "stops"
+    conn = connectors.main(config_benchmark, gtfs_data_dense)
+    func = assemble_edges_table if method == "table" else assemble_edge_arrays
+    seconds, peak = measure(func, gtfs_data_dense, conn, config_benchmark)
+    print(f"\nedges assembly[{method}]: {seconds:.3f}s, peak memory {peak:.0f}MB")
+
+
+def get_edges_and_nodes(gtfs_data: utils.GTFSData, connectors_data: utils.ConnectorsData, config):
+    """Get the graph edge arrays, the origin and destination nodes with edges, and the stop times."""
+    graph = pytest.importorskip("gtfs_skims.graph")
+    edges = graph.get_edge_arrays(gtfs_data, connectors_data)
+    graph.add_gc_arrays(edges, config)
+    n = len(gtfs_data.stop_times)
+    onodes = np.unique(edges["ods"][:, 0][edges["ods"][:, 0] >= n])
+    dnodes = np.unique(edges["ods"][:, 1][edges["ods"][:, 1] >= n])
+    alight = np.intersect1d(onodes, dnodes)  # the alight nodes of the stops engine
+    onodes = onodes[~np.isin(onodes, alight)]
+    dnodes = dnodes[~np.isin(dnodes, alight)]
+    return edges, onodes.tolist(), dnodes.tolist(), gtfs_data.stop_times
+
+
+@pytest.fixture(scope="module")
+def edges_iow() -> tuple:
+    """The graph edges of the (pre-processed) test feed."""
+    return get_edges_and_nodes(
+        utils.GTFSData.from_parquet(os.path.join(TEST_DATA_DIR, "outputs")),
+        utils.ConnectorsData.from_parquet(os.path.join(TEST_DATA_DIR, "outputs")),
+        utils.Config.from_yaml(os.path.join(TEST_DATA_DIR, "config_demo.yaml")),
+    )
+
+
+def get_edges_and_nodes_grid(
+    gtfs_data: utils.GTFSData, centroids: pd.DataFrame, path_outputs: str
+) -> tuple:
+    """Get the graph edges and nodes of a feed, with grid origins and destinations."""
+    pytest.importorskip("gtfs_skims.graph")
+    config = utils.Config.from_yaml(os.path.join(TEST_DATA_DIR, "config_demo.yaml"))
+    config.path_outputs = path_outputs
+    config.connectors_engine = "stops"
+    config.path_origins = config.path_destinations = os.path.join(config.path_outputs, "grid.csv")
+    centroids.rename_axis("name").to_csv(config.path_origins)
+    conn = connectors.main(config, gtfs_data)
+    return get_edges_and_nodes(gtfs_data, conn, config)
+
+
+@pytest.fixture(scope="module")
+def edges_dense(gtfs_data_dense, origins_dense, tmp_path_factory) -> tuple:
+    """The graph edges of the synthetic dense network, with grid origins and destinations."""
+    return get_edges_and_nodes_grid(
+        gtfs_data_dense, origins_dense[::25], str(tmp_path_factory.mktemp("graph_dense"))
+    )
+
+
+@pytest.fixture(scope="module")
+def edges_dense_zones(gtfs_data_dense, origins_dense, tmp_path_factory) -> tuple:
+    """The graph edges of the synthetic dense network, with a fine grid of zones."""
+    return get_edges_and_nodes_grid(
+        gtfs_data_dense, origins_dense, str(tmp_path_factory.mktemp("graph_dense_zones"))
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("feed", ["iow", "dense"])
+@pytest.mark.parametrize("chunking", ["one", "adaptive"])
+def test_benchmark_shortest_distances_chunking(request, feed, chunking):
+    pytest.importorskip("graph_tool")
+    graph = pytest.importorskip("gtfs_skims.graph")
+    edges, onodes, dnodes, _ = request.getfixturevalue(f"edges_{feed}")
+    g = graph.build_graph_arrays(edges)
+    chunksize = 1 if chunking == "one" else None
+    seconds, peak = measure(
+        graph.get_shortest_distances, g, onodes, dnodes, max_dist=9000, chunksize=chunksize
+    )
+    print(
+        f"\nshortest distances[{feed}, {chunking}, {len(onodes)} origins, {g.num_edges()} edges, "
+        f"{utils.get_cpu_limit()} workers]: {seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+def get_shortest_distances_dag(edges: dict, onodes: list[int], dnodes: list[int]) -> None:
+    dag.get_shortest_distances(dag.DAG.from_edges(edges["ods"], edges["gc"]), onodes, dnodes, 9000)
+
+
+def get_shortest_distances_csa(
+    edges: dict, stop_times: pd.DataFrame, onodes: list[int], dnodes: list[int]
+) -> None:
+    n_nodes = int(edges["ods"].max()) + 1
+    g = csa.get_connection_scan(edges, stop_times, n_nodes)
+    dag.get_shortest_distances(g, onodes, dnodes, 9000)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("feed", ["iow", "dense"])
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_benchmark_shortest_distances_engine(request, feed, engine):
+    graph = pytest.importorskip("gtfs_skims.graph")
+    edges, onodes, dnodes, stop_times = request.getfixturevalue(f"edges_{feed}")
+    if engine == "dag":
+        seconds, peak = measure(get_shortest_distances_dag, edges, onodes, dnodes)
+    elif engine == "csa":
+        seconds, peak = measure(get_shortest_distances_csa, edges, stop_times, onodes, dnodes)
+    else:
+        pytest.importorskip("graph_tool")
+        g = graph.build_graph_arrays(edges)
+        seconds, peak = measure(graph.get_shortest_distances, g, onodes, dnodes, max_dist=9000)
+    print(
+        f"\nshortest distances[{feed}, {engine}, {len(onodes)} origins, {len(edges['ods'])} edges]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("feed", ["iow", "dense"])
+@pytest.mark.parametrize("block_size", [1, None])
+def test_benchmark_dag_blocks(request, feed, block_size):
+    edges, onodes, dnodes, _ = request.getfixturevalue(f"edges_{feed}")
+    g = dag.DAG.from_edges(edges["ods"], edges["gc"])
+    seconds, peak = measure(
+        dag.get_shortest_distances, g, onodes, dnodes, max_dist=9000, block_size=block_size
+    )
+    print(
+        f"\ndag blocks[{feed}, {block_size or g.get_block_size(len(onodes))} origins per block]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+def get_shortest_distances_stops(edges: dict, onodes: list[int], dnodes: list[int]) -> None:
+    g = dag.DAG.from_edges(edges["ods"], edges["gc"])
+    is_access = np.isin(edges["ods"][:, 0], onodes)
+    is_egress = np.isin(edges["ods"][:, 1], dnodes)
+    access = (edges["ods"][is_access], edges["gc"][is_access])
+    egress = (edges["ods"][is_egress], edges["gc"][is_egress])
+    bnodes = np.unique(access[0][:, 1]).tolist()
+    anodes = np.unique(egress[0][:, 0]).tolist()
+    core = dag.get_shortest_distances(g, bnodes, anodes, 9000, reverse=len(anodes) < len(bnodes))
+    minplus.compose(access, core, egress, onodes, dnodes, 9000)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("feed", ["dense", "dense_zones"])
+@pytest.mark.parametrize("mode", ["origins", "stops"])
+def test_benchmark_shortest_path_mode(request, feed, mode):
+    edges, onodes, dnodes, _ = request.getfixturevalue(f"edges_{feed}")
+    func = get_shortest_distances_dag if mode == "origins" else get_shortest_distances_stops
+    seconds, peak = measure(func, edges, onodes, dnodes)
+    print(
+        f"\nshortest distances[{feed}, {mode}, {len(onodes)} origins, {len(dnodes)} destinations]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("engine", ["dag", "csa"])
+@pytest.mark.parametrize("direction", ["forward", "backward"])
+def test_benchmark_search_direction(edges_dense_zones, engine, direction):
+    """Accessibility to a few destinations, from all zones."""
+    edges, onodes, dnodes, stop_times = edges_dense_zones
+    dnodes = dnodes[:: len(dnodes) // 10][:10]
+    n_nodes = int(edges["ods"].max()) + 1
+    if engine == "dag":
+        g = dag.DAG.from_edges(edges["ods"], edges["gc"], n_nodes)
+    else:
+        g = csa.get_connection_scan(edges, stop_times, n_nodes)
+    seconds, peak = measure(
+        dag.get_shortest_distances, g, onodes, dnodes, 9000, reverse=direction == "backward"
+    )
+    print(
+        f"\nshortest distances[{engine}, {direction}, {len(onodes)} origins, {len(dnodes)} destinations]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("engine", ["dag", "csa"])
+@pytest.mark.parametrize("early_stop", [False, True])
+def test_benchmark_early_stop(edges_dense_zones, engine, early_stop):
+    """Accessibility to a few destinations, from a block of zones (forward searches)."""
+    edges, onodes, dnodes, stop_times = edges_dense_zones
+    dnodes = dnodes[:: len(dnodes) // 10][:10]
+    n_nodes = int(edges["ods"].max()) + 1
+    if engine == "dag":
+        g = dag.DAG.from_edges(edges["ods"], edges["gc"], n_nodes)
+    else:
+        g = csa.get_connection_scan(edges, stop_times, n_nodes)
+    onodes = onodes[:200]
+    seconds, peak = measure(
+        dag.get_shortest_distances, g, onodes, dnodes, 9000, early_stop=early_stop
+    )
+    _, explored = dag.get_shortest_distances(
+        g, onodes, dnodes, 9000, early_stop=early_stop, return_explored=True
+    )
+    print(
+        f"\nshortest distances[{engine}, early stop {early_stop}, {len(onodes)} origins, "
+        f"{len(dnodes)} destinations]: {seconds:.2f}s, peak memory {peak:.0f}MB, "
+        f"{explored.mean():.0f} of {g.n_nodes} nodes explored per search"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("feed", ["iow", "dense_zones"])
+@pytest.mark.parametrize("engine", ["dag", "csa"])
+@pytest.mark.parametrize("contract", [False, True])
+def test_benchmark_contract_chains(request, feed, engine, contract):
+    graph = pytest.importorskip("gtfs_skims.graph")
+    edges, onodes, dnodes, stop_times = request.getfixturevalue(f"edges_{feed}")
+    n_nodes = int(edges["ods"].max()) + 1
+
+    def get_shortest_distances():
+        edges_search, node_ids, stop_times_search = edges, np.arange(n_nodes), stop_times
+        if contract:
+            edges_search, node_ids = graph.contract_chains(edges, len(stop_times), n_nodes)
+            stop_times_search = stop_times[node_ids[: len(stop_times)] >= 0]
+        n_search = int(node_ids.max()) + 1
+        if engine == "dag":
+            g = dag.DAG.from_edges(edges_search["ods"], edges_search["gc"], n_search)
+        else:
+            g = csa.get_connection_scan(edges_search, stop_times_search, n_search)
+        dag.get_shortest_distances(g, node_ids[onodes].tolist(), node_ids[dnodes].tolist(), 9000)
+
+    seconds, peak = measure(get_shortest_distances)
+    n_contracted = (graph.contract_chains(edges, len(stop_times), n_nodes)[1] < 0).sum()
+    print(
+        f"\nshortest distances[{feed}, {engine}, contract chains {contract}, "
+        f"{n_contracted} of {n_nodes} nodes contractible]: {seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("feed", ["iow", "dense", "dense_zones"])
+@pytest.mark.parametrize("engine", ["dag", "csa"])
+@pytest.mark.parametrize("prune", [False, True])
+def test_benchmark_prune_unreachable(request, feed, engine, prune):
+    graph = pytest.importorskip("gtfs_skims.graph")
+    edges, onodes, dnodes, stop_times = request.getfixturevalue(f"edges_{feed}")
+    n_nodes = int(edges["ods"].max()) + 1
+
+    def get_shortest_distances():
+        edges_search, node_ids, stop_times_search = edges, np.arange(n_nodes), stop_times
+        if prune:
+            edges_search, node_ids = graph.prune_unreachable(
+                edges, onodes, dnodes, len(stop_times), 9000, n_nodes
+            )
+            stop_times_search = stop_times[node_ids[: len(stop_times)] >= 0]
+        n_search = int(node_ids.max()) + 1
+        if engine == "dag":
+            g = dag.DAG.from_edges(edges_search["ods"], edges_search["gc"], n_search)
+        else:
+            g = csa.get_connection_scan(edges_search, stop_times_search, n_search)
+        dag.get_shortest_distances(g, node_ids[onodes].tolist(), node_ids[dnodes].tolist(), 9000)
+
+    seconds, peak = measure(get_shortest_distances)
+    node_ids = graph.prune_unreachable(edges, onodes, dnodes, len(stop_times), 9000, n_nodes)[1]
+    print(
+        f"\nshortest distances[{feed}, {engine}, prune {prune}, "
+        f"{(node_ids < 0).sum()} of {len(stop_times)} stop times unreachable]: "
+        f"{seconds:.2f}s, peak memory {peak:.0f}MB"
+    )
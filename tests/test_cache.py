@@ -0,0 +1,76 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+from gtfs_skims import cache, preprocessing
+
+
+@pytest.fixture
+def config_cached(config, tmpdir):
+    config.path_outputs = os.path.join(tmpdir, "outputs")
+    config.path_cache = os.path.join(tmpdir, "cache")
+    return config
+
+
+def test_hash_file_is_deterministic(config):
+    assert cache.hash_file(config.path_gtfs) == cache.hash_file(config.path_gtfs, chunk_size=100)
+
+
+def test_cache_key_changes_with_preprocessing_settings(config):
+    key = cache.get_cache_key(config)
+    config.end_s += 1
+    assert cache.get_cache_key(config) != key
+
+
+def test_cache_key_ignores_other_settings(config):
+    key = cache.get_cache_key(config)
+    config.weight_walk += 1
+    config.path_origins = "another_path.csv"
+    assert cache.get_cache_key(config) == key
+
+
+def test_load_missing_key(tmpdir):
+    assert cache.load_cached(tmpdir, "missing") is None
+
+
+def test_save_and_load(gtfs_data_preprocessed, tmpdir):
+    cache.save_cached(tmpdir, "key", gtfs_data_preprocessed)
+    gtfs_cached = cache.load_cached(tmpdir, "key")
+    for x in ["calendar", "routes", "stops", "stop_times", "trips"]:
+        pd.testing.assert_frame_equal(getattr(gtfs_data_preprocessed, x), getattr(gtfs_cached, x))
+
+
+def test_evict_by_age(gtfs_data_preprocessed, tmpdir):
+    for key in ["old", "new"]:
+        cache.save_cached(tmpdir, key, gtfs_data_preprocessed)
+    two_days_ago = time.time() - 2 * 86400
+    os.utime(os.path.join(tmpdir, "old"), (two_days_ago, two_days_ago))
+
+    assert cache.evict(tmpdir, max_age_days=1) == ["old"]
+    assert os.listdir(tmpdir) == ["new"]
+
+
+def test_evict_least_recently_used(gtfs_data_preprocessed, tmpdir):
+    for key in ["a", "b", "c"]:
+        cache.save_cached(tmpdir, key, gtfs_data_preprocessed)
+    for i, key in enumerate(["b", "a", "c"]):
+        os.utime(os.path.join(tmpdir, key), (i, i))
+    cache.load_cached(tmpdir, "b")  # b is now the most recently used
+
+    size_mb = cache.get_size(os.path.join(tmpdir, "a")) / 1e6
+    evicted = cache.evict(tmpdir, max_size_mb=2.5 * size_mb)
+    assert evicted == ["a"]
+    assert sorted(os.listdir(tmpdir)) == ["b", "c"]
+
+
+def test_preprocessing_uses_cache(config_cached, caplog):
+    data = preprocessing.main(config_cached)
+    assert "Cache miss" in caplog.text
+    assert len(os.listdir(config_cached.path_cache)) == 1
+
+    caplog.clear()
+    data_cached = preprocessing.main(config_cached)
+    assert "Cache hit" in caplog.text
+    pd.testing.assert_frame_equal(data.stop_times, data_cached.stop_times)
+    assert os.path.exists(os.path.join(config_cached.path_outputs, "stop_times.parquet.gzip"))
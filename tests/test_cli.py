@@ -44,3 +44,29 @@ def test_run_steps_saves_outputs(tmpdir):
         assert os.path.exists(os.path.join(tmpdir, f"connectors_{x}.parquet.gzip"))
 
     assert os.path.exists(os.path.join(tmpdir, "skims.parquet.gzip"))
+
+
+def test_run_graph_worker_overrides(mocker, tmpdir):
+    main_graph = mocker.patch.object(cli, "main_graph")
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli,
+        [
+            "run",
+            os.path.join(TEST_DATA_DIR, "config_demo.yaml"),
+            "--output_directory_override",
+            tmpdir,
+            "--graph_workers",
+            "2",
+            "--graph_chunksize",
+            "10",
+            "--graph_start_method",
+            "spawn",
+        ],
+    )
+
+    assert result.exit_code == 0
+    config = main_graph.call_args.kwargs["config"]
+    assert config.graph_workers == 2
+    assert config.graph_chunksize == 10
+    assert config.graph_start_method == "spawn"
@@ -3,6 +3,7 @@ import os
 from collections import defaultdict
 
 import numpy as np
+import pandas as pd
 import pytest
 from gtfs_skims import connectors
 
@@ -85,6 +86,37 @@ def test_filter_same_route(transfer_connectors):
     assert (transfer_connectors.ods % 2).prod(1).sum() == 0
 
 
+def apply_filters(conn, routes, services, eager):
+    filters = [
+        lambda: conn.filter_feasible_transfer(10),
+        lambda: conn.filter_max_walk(5),
+        lambda: conn.filter_max_wait(5),
+        lambda: conn.filter_same_route(routes),
+        lambda: conn.filter_nearest_service(services),
+    ]
+    for f in filters:
+        f()
+        if eager:
+            conn.ods
+
+
+def test_lazy_filters_same_as_eager(points):
+    rng = np.random.default_rng(0)
+    routes = rng.integers(0, 5, size=len(points))
+    services = rng.integers(1, 3, size=len(points))
+
+    conn_eager = connectors.TransferConnectors(points, 10)
+    apply_filters(conn_eager, routes, services, eager=True)
+    conn_lazy = connectors.TransferConnectors(points, 10)
+    apply_filters(conn_lazy, routes, services, eager=False)
+
+    assert conn_lazy._mask is not None  # not materialized yet
+    np.testing.assert_equal(conn_lazy.ods, conn_eager.ods)
+    np.testing.assert_equal(conn_lazy.walk, conn_eager.walk)
+    np.testing.assert_equal(conn_lazy.wait, conn_eager.wait)
+    assert conn_lazy._mask is None
+
+
 def get_o_service_transfers(conn, services_d):
     transfer_times = conn.wait + conn.walk
     d = defaultdict(list)
@@ -119,6 +151,18 @@ def test_filter_nearest_service(transfer_connectors):
         d_after[(o, service)][0] == min(d_before[(o, service)])
 
 
+def test_group_argmin_breaks_ties():
+    groups = np.array([3, 1, 3, 1, 3, 2])
+    values = np.array([5.0, 2.0, 1.0, 2.0, 1.0, 7.0])
+    tiebreak = np.array([0, 9, 8, 4, 6, 1])
+    np.testing.assert_equal(connectors.group_argmin(groups, values, tiebreak), [3, 4, 5])
+
+
+def test_group_argmin_empty():
+    empty = np.array([], dtype=int)
+    assert len(connectors.group_argmin(empty, empty.astype(float), empty)) == 0
+
+
 def test_get_transfer_array(gtfs_data_preprocessed, config):
     arr = connectors.get_transfer_connectors(gtfs_data_preprocessed, config)
     assert len(arr) > 0
@@ -165,6 +209,14 @@ def test_apply_crow_fly_factoring(gtfs_data_preprocessed, config):
     assert len(arr) < 2
 
 
+def test_transfer_inputs_have_compact_coordinates(gtfs_data_preprocessed, config):
+    config.crows_fly_factor = 1.3
+    coords, _, _, _ = connectors.get_transfer_inputs(gtfs_data_preprocessed, config)
+    assert coords.dtype == np.float32
+    expected = gtfs_data_preprocessed.stop_times[["x", "y"]].values * 1.3
+    np.testing.assert_allclose(coords[:, :2], expected, rtol=0, atol=0.1)  # scaled, not truncated
+
+
 def test_indices_are_offset(config, gtfs_data_preprocessed, tmpdir):
     config.path_outputs = tmpdir
     conn = connectors.main(config=config, data=gtfs_data_preprocessed)
@@ -181,3 +233,128 @@ def test_main_saves_outputs(config, gtfs_data_preprocessed, tmpdir):
     connectors.main(config=config, data=gtfs_data_preprocessed)
     for x in ["transfer", "access", "egress"]:
         assert os.path.exists(os.path.join(tmpdir, f"connectors_{x}.parquet.gzip"))
+
+
+def test_main_reads_intermediate_format(config, gtfs_data_preprocessed, tmpdir):
+    config.path_outputs = tmpdir
+    config.intermediate_format = "arrow"
+    gtfs_data_preprocessed.save(tmpdir, fmt="arrow")
+    conn = connectors.main(config=config)
+    for x in ["transfer", "access", "egress"]:
+        assert os.path.exists(os.path.join(tmpdir, f"connectors_{x}.arrow"))
+    assert len(conn.connectors_transfer) > 0
+
+
+@pytest.fixture()
+def points_at_stops():
+    rng = np.random.default_rng(0)
+    stop_coords = rng.uniform(0, 50, size=(30, 2))
+    stop_ids = rng.integers(0, 30, size=1000)
+    coords = np.column_stack([stop_coords[stop_ids], rng.uniform(0, 100, size=1000)])
+    return coords, stop_ids
+
+
+def test_expand_ranges():
+    idx, values = connectors.expand_ranges(np.array([5, 0, 10]), np.array([2, 0, 3]))
+    np.testing.assert_equal(idx, [0, 0, 2, 2, 2])
+    np.testing.assert_equal(values, [5, 6, 10, 11, 12])
+
+
+def test_query_stops_matches_query_pairs(points_at_stops):
+    coords, stop_ids = points_at_stops
+    maxdist = 10
+    tc = connectors.TransferConnectors(coords, maxdist)
+    tc_stops = connectors.TransferConnectors(coords, maxdist, stop_ids=stop_ids)
+    assert len(tc_stops.ods) < len(tc.ods)
+
+    tc.filter_feasible_transfer(maxdist)
+    tc_stops.filter_feasible_transfer(maxdist)
+    assert set(map(tuple, tc.ods)) == set(map(tuple, tc_stops.ods))
+
+
+def test_stops_engine_gives_same_transfers(gtfs_data_preprocessed, config):
+    arr = connectors.get_transfer_connectors(gtfs_data_preprocessed, config)
+    config.connectors_engine = "stops"
+    arr_stops = connectors.get_transfer_connectors(gtfs_data_preprocessed, config)
+    assert set(map(tuple, arr)) == set(map(tuple, arr_stops))
+
+
+def test_tiles_cover_all_points_once(points_at_stops):
+    coords, _ = points_at_stops
+    n_core = np.zeros(len(coords), dtype=int)
+    for idx, is_core in connectors.get_tiles(coords, buffer=10, n_tiles=8):
+        n_core[idx[is_core]] += 1
+        assert len(idx) >= is_core.sum()
+    assert (n_core == 1).all()
+
+
+@pytest.mark.parametrize("engine", ["stop_times", "stops"])
+def test_tiled_transfers_same_as_untiled(gtfs_data_preprocessed, config, tmpdir, engine):
+    config.path_outputs = tmpdir
+    config.connectors_engine = engine
+    arr = connectors.get_transfer_connectors(gtfs_data_preprocessed, config)
+    config.connectors_memory_mb = 1e-4
+    arr_tiled = connectors.get_transfer_connectors(gtfs_data_preprocessed, config)
+    assert set(map(tuple, arr)) == set(map(tuple, arr_tiled))
+    assert os.listdir(tmpdir) == []
+
+
+@pytest.mark.parametrize("memory_mb", [None, 1e-4])
+def test_parallel_connectors_same_as_serial(config, gtfs_data_preprocessed, tmpdir, memory_mb):
+    config.path_outputs = os.path.join(tmpdir, "serial")
+    conn = connectors.main(config=config, data=gtfs_data_preprocessed)
+
+    config.path_outputs = os.path.join(tmpdir, "parallel")
+    config.connectors_workers = 2
+    config.connectors_memory_mb = memory_mb
+    conn_parallel = connectors.main(config=config, data=gtfs_data_preprocessed)
+
+    for x in ["transfer", "access", "egress"]:
+        pd.testing.assert_frame_equal(
+            getattr(conn, f"connectors_{x}"), getattr(conn_parallel, f"connectors_{x}")
+        )
+
+
+def test_stops_engine_gives_same_access(gtfs_data_preprocessed, config):
+    origins = pd.read_csv(config.path_origins, index_col=0)
+    arr = connectors.get_access_connectors(gtfs_data_preprocessed, config, origins)
+    config.connectors_engine = "stops"
+    arr_stops = connectors.get_access_connectors(gtfs_data_preprocessed, config, origins)
+    assert len(arr) > 0
+    np.testing.assert_equal(connectors.sort_connectors(arr), connectors.sort_connectors(arr_stops))
+
+
+@pytest.mark.parametrize("n_unserved", [0, 3])
+def test_stops_engine_egress_through_alight_nodes(
+    config, gtfs_data_preprocessed, tmpdir, n_unserved
+):
+    # stops without stop times, at the start of the stops table
+    unserved = gtfs_data_preprocessed.stops.iloc[:n_unserved].assign(
+        stop_id=[f"unserved_{i}" for i in range(n_unserved)]
+    )
+    gtfs_data_preprocessed.stops = pd.concat(
+        [unserved, gtfs_data_preprocessed.stops], ignore_index=True
+    )
+    config.path_outputs = tmpdir
+    egress = connectors.main(config=config, data=gtfs_data_preprocessed).connectors_egress
+    config.connectors_engine = "stops"
+    egress_stops = connectors.main(config=config, data=gtfs_data_preprocessed).connectors_egress
+
+    # the same stop time - destination walk times, through the alight nodes
+    n_stop_times = len(gtfs_data_preprocessed.stop_times)
+    alight = egress_stops[egress_stops["onode"] < n_stop_times]
+    assert (alight[["walk", "wait"]] == 0).all().all()
+    composed = alight[["onode", "dnode"]].merge(
+        egress_stops, left_on="dnode", right_on="onode", suffixes=("", "_alight")
+    )
+    composed = composed[["onode", "dnode_alight", "walk", "wait"]].values
+    np.testing.assert_equal(connectors.sort_connectors(composed), egress.values)
+
+
+def test_connectors_have_compact_types(config, gtfs_data_preprocessed, tmpdir):
+    config.path_outputs = tmpdir
+    conn = connectors.main(config=config, data=gtfs_data_preprocessed)
+    for x in ["transfer", "access", "egress"]:
+        df = getattr(conn, f"connectors_{x}")
+        assert (df.dtypes[["onode", "dnode"]] == np.int32).all()
+        assert (df.dtypes[["walk", "wait"]] == np.uint16).all()
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gtfs_skims import csa, dag
+
+
+@pytest.fixture()
+def timetable() -> tuple[pd.DataFrame, dict[str, np.ndarray]]:
+    """A random timetable, with 50 trips of 10 stops, 20 origins, 20 destinations and 10 alight nodes."""
+    rng = np.random.default_rng(0)
+    stop_times = pd.DataFrame(
+        {
+            "trip_id": np.repeat(np.arange(50), 10),
+            "stop_sequence": np.tile(np.arange(10), 50),
+            "departure_s": (
+                rng.integers(0, 3600, 50)[:, None] + np.cumsum(rng.integers(0, 3, (50, 10)) * 60, 1)
+            ).ravel(),
+        }
+    ).sample(frac=1, random_state=0)
+    n = len(stop_times)
+    positions = pd.Series(range(n), index=stop_times.index)
+    departures = stop_times["departure_s"].to_numpy()
+
+    ivt = stop_times.sort_values(["trip_id", "stop_sequence"])
+    ivt = np.column_stack([positions[ivt.index[:-1]], positions[ivt.index[1:]]])[
+        np.diff(ivt["trip_id"].to_numpy()) == 0
+    ]
+    transfers = rng.integers(0, n, (2000, 2))
+    transfers = transfers[departures[transfers[:, 1]] > departures[transfers[:, 0]]]
+    access = np.column_stack([rng.integers(n, n + 20, 200), rng.integers(0, n, 200)])
+    egress = np.column_stack([rng.integers(0, n, 200), rng.integers(n + 20, n + 40, 200)])
+    alight = np.column_stack([np.arange(n), n + 40 + np.arange(n) % 10])
+    alight_egress = np.column_stack([n + 40 + np.arange(10), rng.integers(n + 20, n + 40, 10)])
+
+    ods = np.concatenate([ivt, transfers, access, egress, alight, alight_egress])
+    gc = departures[ods[:, 1] % n] - departures[ods[:, 0] % n]
+    gc = np.where((ods[:, 0] < n) & (ods[:, 1] < n), gc, rng.integers(0, 600, len(ods)))
+    return stop_times, {"ods": ods, "gc": gc}
+
+
+def test_scan_order_follows_stop_sequence():
+    stop_times = pd.DataFrame({"departure_s": [100, 100, 90, 100], "stop_sequence": [3, 1, 0, 2]})
+    np.testing.assert_equal(csa.get_scan_order(stop_times), [2, 1, 3, 0])
+
+
+def test_scan_order_without_stop_sequence():
+    stop_times = pd.DataFrame({"departure_s": [100, 100, 90, 100]})
+    np.testing.assert_equal(csa.get_scan_order(stop_times), [2, 0, 1, 3])
+
+
+def test_scan_batches(timetable):
+    stop_times, edges = timetable
+    n = len(stop_times)
+    ods = edges["ods"][(edges["ods"] < n).all(axis=1)]
+    order = csa.get_scan_order(stop_times)
+    batches = csa.get_scan_batches(order, ods)
+
+    assert (batches[ods[:, 0]] < batches[ods[:, 1]]).all()
+    assert (np.diff(batches[order]) >= 0).all()  # consecutive in scan order
+    # a batch only ends where needed
+    ends = order[np.flatnonzero(np.diff(batches[order]))]
+    first = order[np.flatnonzero(np.diff(batches[order])) + 1]
+    for end, nxt in zip(ends, first):
+        start = np.flatnonzero(batches[order] == batches[end])[0]
+        connected = ods[ods[:, 1] == nxt, 0]
+        assert np.isin(connected, order[start:]).any()
+
+
+def test_scan_batches_backwards_fails():
+    with pytest.raises(ValueError, match="forward in time"):
+        csa.get_scan_batches(np.array([0, 1, 2]), np.array([[2, 1]]))
+
+
+def test_connection_scan_matches_dag(timetable):
+    stop_times, edges = timetable
+    n_nodes = len(stop_times) + 50
+    scan = csa.get_connection_scan(edges, stop_times, n_nodes)
+    expected = dag.DAG.from_edges(edges["ods"], edges["gc"], n_nodes)
+
+    onodes = list(range(len(stop_times), len(stop_times) + 20))
+    dnodes = list(range(len(stop_times) + 20, len(stop_times) + 40))
+    distmat = dag.get_shortest_distances(scan, onodes, dnodes, max_dist=3000)
+    assert np.isfinite(distmat.values).sum() > 100
+    pd.testing.assert_frame_equal(
+        distmat, dag.get_shortest_distances(expected, onodes, dnodes, max_dist=3000)
+    )
+
+
+def test_connection_scan_levels(timetable):
+    stop_times, edges = timetable
+    n = len(stop_times)
+    scan = csa.get_connection_scan(edges, stop_times, n + 50)
+    assert (scan.levels[n : n + 20] == 0).all()  # origins
+    assert (scan.levels[:n] >= 1).all()
+    assert (scan.levels[n + 40 :] > scan.levels[:n].max()).all()  # alight nodes
+    assert (scan.levels[n + 20 : n + 40] > scan.levels[:n].max()).all()  # destinations
+    assert (scan.levels[scan.sources] < scan.levels[scan.targets]).all()
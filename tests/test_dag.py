@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gtfs_skims import dag
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+@pytest.fixture()
+def small_dag() -> dag.DAG:
+    ods = np.array([[0, 1], [0, 2], [1, 3], [2, 3]])
+    return dag.DAG.from_edges(ods, np.array([10, 20, 15, 4]))
+
+
+@pytest.fixture()
+def random_dag() -> tuple[np.ndarray, np.ndarray]:
+    """A random DAG (edges follow a random node order), with parallel edges."""
+    rng = np.random.default_rng(0)
+    rank = rng.permutation(500)
+    ods = rng.integers(0, 500, (3000, 2))
+    ods = ods[rank[ods[:, 0]] < rank[ods[:, 1]]]
+    ods = np.concatenate([ods, ods[:100]])
+    weights = rng.integers(0, 100, len(ods))
+    return ods, weights
+
+
+def test_get_levels():
+    ods = np.array([[0, 1], [1, 2], [0, 2], [3, 2]])
+    np.testing.assert_equal(dag.get_levels(ods, 5), [0, 1, 2, 0, 0])
+
+
+def test_get_levels_cycle_fails():
+    ods = np.array([[0, 1], [1, 2], [2, 1]])
+    with pytest.raises(ValueError, match="acyclic"):
+        dag.get_levels(ods, 3)
+
+
+def test_edges_sorted_by_level(random_dag):
+    g = dag.DAG.from_edges(*random_dag)
+    assert (g.levels[g.sources] < g.levels[g.targets]).all()
+    for level in range(g.n_levels):
+        assert (g.levels[g.sources[g.offsets[level] : g.offsets[level + 1]]] == level).all()
+
+
+def test_get_shortest_distance_single(small_dag):
+    dists = dag.get_shortest_distances_single(small_dag, 0, [3, 2, 1, 0])
+    assert dists[0] == 0  # the first value is the source
+    np.testing.assert_equal(dists[1:], [24, 20, 10, 0])
+
+
+def test_get_shortest_distance_single_max_dist(small_dag):
+    dists = dag.get_shortest_distances_single(small_dag, 1, [3, 2, 1, 0], max_dist=12)
+    np.testing.assert_equal(dists[1:], [np.inf, np.inf, 0, np.inf])
+
+
+def test_get_distance_matrix(small_dag):
+    distmat = dag.get_shortest_distances(small_dag, [2, 0], [1, 3])
+    assert list(distmat.index) == [2, 0]
+    assert list(distmat.columns) == [1, 3]
+    np.testing.assert_equal(distmat.values, [[np.inf, 4], [10, 24]])
+
+
+def test_distances_match_dijkstra(random_dag):
+    ods, weights = random_dag
+    g = dag.DAG.from_edges(ods, weights, n_nodes=500)
+    distmat = dag.get_shortest_distances(g, list(range(0, 500, 7)), list(range(500)))
+
+    # shortest parallel edges, with a small offset, as zero weights are dropped from sparse matrices
+    order = np.lexsort((weights, ods[:, 1], ods[:, 0]))
+    is_first = np.r_[True, (np.diff(ods[order], axis=0) != 0).any(axis=1)]
+    ods, weights = ods[order][is_first], weights[order][is_first]
+    matrix = csr_matrix((weights + 1e-6, (ods[:, 0], ods[:, 1])), shape=(500, 500))
+    expected = dijkstra(matrix, indices=list(range(0, 500, 7)))
+
+    np.testing.assert_allclose(distmat.values, expected, atol=1e-3)
+
+
+def test_edges_grouped_by_target(random_dag):
+    g = dag.DAG.from_edges(*random_dag)
+    groups = np.split(np.arange(len(g.targets)), g.groups[1:])
+    assert all(len(np.unique(g.targets[x])) == 1 for x in groups)
+    assert len(np.unique(np.column_stack([g.levels[g.sources], g.targets]), axis=0)) == len(groups)
+    has_edges = np.diff(g.offsets) > 0
+    np.testing.assert_equal(g.groups[g.group_offsets[:-1][has_edges]], g.offsets[:-1][has_edges])
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 8, 100])
+def test_blocks_match_single_origin(random_dag, block_size):
+    g = dag.DAG.from_edges(*random_dag, n_nodes=500)
+    onodes = list(range(0, 500, 7))
+    distmat = dag.get_shortest_distances(g, onodes, [1, 2, 3, 400], block_size=block_size)
+    expected = [dag.get_shortest_distances_single(g, o, [1, 2, 3, 400])[1:] for o in onodes]
+    assert list(distmat.index) == onodes
+    np.testing.assert_equal(distmat.values, expected)
+
+
+@pytest.mark.parametrize(
+    "n_origins,memory_mb,expected",
+    [
+        (5000, None, 2**23 // (8 * 1010)),  # fits in the cache
+        (5000, 0.02, 2),  # an explicit budget is respected
+        (5000, 0.009, 1),
+        (3, None, 3),
+        (1000, 1000, 1000),
+    ],
+)
+def test_get_block_size(n_origins, memory_mb, expected):
+    ods = np.column_stack([np.arange(10), np.arange(10, 20)])
+    g = dag.DAG.from_edges(ods, np.ones(10), n_nodes=1000)
+    assert g.get_block_size(n_origins, memory_mb) == expected
+
+
+def test_get_block_size_without_budget_fills_cache_lines():
+    g = dag.DAG.from_edges(np.array([[0, 1]]), np.ones(1), n_nodes=10**6)
+    assert g.get_block_size(5000) == dag.MIN_BLOCK_SIZE
+
+
+def test_get_block_size_over_budget_fails():
+    ods = np.column_stack([np.arange(10), np.arange(10, 20)])
+    g = dag.DAG.from_edges(ods, np.ones(10), n_nodes=1000)
+    with pytest.raises(ValueError, match="memory budget"):
+        g.get_block_size(5000, memory_mb=0.001)
+
+
+def test_reversed(small_dag):
+    g = small_dag.reversed()
+    np.testing.assert_equal(g.levels, [2, 1, 1, 0])
+    assert (g.levels[g.sources] < g.levels[g.targets]).all()
+    np.testing.assert_equal(dag.get_shortest_distances_single(g, 3, [0, 1, 2])[1:], [24, 15, 4])
+
+
+@pytest.mark.parametrize("block_size", [1, None])
+def test_reverse_matches_forward(random_dag, block_size):
+    g = dag.DAG.from_edges(*random_dag, n_nodes=500)
+    onodes, dnodes = list(range(0, 500, 7)), [1, 2, 3, 400, 499]
+    distmat = dag.get_shortest_distances(g, onodes, dnodes, 150, block_size, reverse=True)
+    pd.testing.assert_frame_equal(distmat, dag.get_shortest_distances(g, onodes, dnodes, 150))
+
+
+@pytest.mark.parametrize("max_dist", [None, 60])
+@pytest.mark.parametrize("dnodes", [[1, 2, 3, 400, 499], list(range(500)), [7]])
+def test_early_stop_matches_full_sweep(random_dag, max_dist, dnodes):
+    g = dag.DAG.from_edges(*random_dag, n_nodes=500)
+    onodes = list(range(0, 500, 7))
+    distmat, explored = dag.get_shortest_distances(
+        g, onodes, dnodes, max_dist, block_size=8, early_stop=True, return_explored=True
+    )
+    expected, explored_full = dag.get_shortest_distances(
+        g, onodes, dnodes, max_dist, block_size=8, return_explored=True
+    )
+    pd.testing.assert_frame_equal(distmat, expected)
+    assert (explored <= explored_full).all()
+
+
+def test_early_stop_after_destinations_settled(small_dag):
+    dists = dag.get_shortest_distances_block(
+        small_dag, [0], [1, 2], early_stop=True, return_explored=True
+    )
+    np.testing.assert_equal(dists, [[0, 10, 20, 3]])  # node 3 is not reached
+
+
+def test_early_stop_past_bound():
+    # the destination (3) is reached through the first edge, so the search does not continue
+    # past the level of the node (1) beyond its tentative distance
+    ods = np.array([[0, 3], [0, 1], [1, 2], [2, 3]])
+    g = dag.DAG.from_edges(ods, np.array([5, 10, 1, 1]))
+    dists = dag.get_shortest_distances_block(g, [0], [3], early_stop=True, return_explored=True)
+    np.testing.assert_equal(dists, [[0, 5, 3]])
+
+
+def test_get_shortest_distances_explored(small_dag):
+    distmat, explored = dag.get_shortest_distances(
+        small_dag, [0, 1], [3], return_explored=True, reverse=True
+    )
+    np.testing.assert_equal(distmat.values, [[24], [15]])
+    assert list(explored.index) == [3]
+    assert list(explored) == [4]
+
+
+def test_early_stop_keeps_max_dist(small_dag):
+    dists = dag.get_shortest_distances_block(small_dag, [0], [1, 3], max_dist=24, early_stop=True)
+    np.testing.assert_equal(dists, [[0, 10, 24]])
@@ -1,10 +1,10 @@
+import os
 from unittest.mock import Mock
 
 import numpy as np
 import pandas as pd
 import pytest
-from graph_tool import Graph
-from gtfs_skims import graph
+from gtfs_skims import dag, graph
 
 
 @pytest.fixture()
@@ -17,13 +17,15 @@ def mock_config(mocker):
 
 
 @pytest.fixture()
-def small_graph() -> Graph:
+def small_graph() -> "graph.Graph":
+    pytest.importorskip("graph_tool")
     edges = pd.DataFrame({"onode": [0, 0, 1, 2], "dnode": [1, 2, 3, 3], "gc": [10, 20, 15, 4]})
     return graph.build_graph(edges, vars=["gc"])
 
 
 @pytest.fixture()
-def small_graph_birectional() -> Graph:
+def small_graph_birectional() -> "graph.Graph":
+    pytest.importorskip("graph_tool")
     edges = pd.DataFrame(
         {
             "onode": [0, 0, 1, 2, 1, 2, 3, 3],
@@ -41,6 +43,19 @@ def test_get_ivt_times():
     np.testing.assert_equal(ivt_edges.values, expected)
 
 
+def test_get_ivt_times_follows_stop_sequence():
+    stop_times = pd.DataFrame(
+        {
+            "trip_id": [0, 1, 0, 1, 0],
+            "stop_sequence": [3, 1, 1, 2, 2],
+            "departure_s": [160, 105, 100, 150, 120],
+        }
+    )
+    ivt_edges = graph.get_ivt_edges(stop_times)
+    expected = np.array([[2, 4, 20], [4, 0, 40], [1, 3, 45]])
+    np.testing.assert_equal(ivt_edges.values, expected)
+
+
 def test_get_all_edges(gtfs_data_preprocessed, connectors_data):
     edges = graph.get_all_edges(gtfs_data_preprocessed, connectors_data)
 
@@ -64,6 +79,26 @@ def test_calculate_gc(mock_config):
     assert list(edges["gc"]) == [190, 835]
 
 
+def test_edge_arrays_match_edges_table(gtfs_data_preprocessed, connectors_data, config):
+    edges = graph.add_gc(graph.get_all_edges(gtfs_data_preprocessed, connectors_data), config)
+    arrays = graph.get_edge_arrays(gtfs_data_preprocessed, connectors_data)
+    graph.add_gc_arrays(arrays, config, chunk_size=100)
+
+    np.testing.assert_equal(arrays["ods"], edges[["onode", "dnode"]].values)
+    for x in ["ivt", "walk", "wait", "transfer", "gc", "time"]:
+        np.testing.assert_equal(arrays[x], edges[x].values)
+
+
+def test_build_graph_arrays(small_graph):
+    edges = {"ods": np.array([[0, 1], [0, 2], [1, 3], [2, 3]]), "gc": np.array([10, 20, 15, 4])}
+    g = graph.build_graph_arrays(edges, vars=["gc"])
+    assert g.num_vertices() == small_graph.num_vertices()
+    np.testing.assert_equal(
+        graph.get_shortest_distances_single(g, 0, [3, 2, 1, 0]),
+        graph.get_shortest_distances_single(small_graph, 0, [3, 2, 1, 0]),
+    )
+
+
 def test_get_shortest_distance_single(small_graph):
     dists = graph.get_shortest_distances_single(small_graph, 0, [3, 2, 1, 0])
     expected = np.array([24, 20, 10, 0])
@@ -80,7 +115,64 @@ def test_get_distance_matrix(small_graph_birectional):
     np.testing.assert_equal(distmat.values, expected)
 
 
-def test_correct_labels(config, gtfs_data_preprocessed, connectors_data, tmpdir):
+@pytest.mark.parametrize("sharing", ["fork", "disk"])
+def test_get_distance_matrix_sharing(small_graph_birectional, sharing, tmpdir):
+    distmat = graph.get_shortest_distances(
+        small_graph_birectional, [2, 0, 1], [1, 2], sharing=sharing, chunksize=1, path_tmp=tmpdir
+    )
+    expected = np.array([[19, 0], [10, 20], [0, 19]])
+    assert list(distmat.index) == [2, 0, 1]
+    np.testing.assert_equal(distmat.values, expected)
+    assert graph._worker_inputs == {}
+    assert os.listdir(tmpdir) == []
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_get_distance_matrix_workers(small_graph_birectional, n_workers):
+    distmat = graph.get_shortest_distances(
+        small_graph_birectional, [0, 1, 2], [1, 2], n_workers=n_workers, chunksize=1
+    )
+    np.testing.assert_equal(distmat.values, np.array([[10, 20], [0, 19], [19, 0]]))
+
+
+def test_get_distance_matrix_spawn_with_disk_sharing(small_graph_birectional, tmpdir):
+    distmat = graph.get_shortest_distances(
+        small_graph_birectional,
+        [0, 1, 2],
+        [1, 2],
+        sharing="disk",
+        n_workers=2,
+        start_method="spawn",
+        path_tmp=tmpdir,
+    )
+    np.testing.assert_equal(distmat.values, np.array([[10, 20], [0, 19], [19, 0]]))
+
+
+def test_fork_sharing_requires_fork_start_method(small_graph_birectional):
+    with pytest.raises(ValueError, match="start method"):
+        graph.get_shortest_distances(
+            small_graph_birectional, [0], [1], n_workers=2, start_method="spawn"
+        )
+
+
+@pytest.mark.parametrize(
+    "n_origins,n_workers,n_edges,expected",
+    [
+        (1000, 4, 10**8, 63),  # large graph: about four tasks per worker
+        (1000, 4, 2 * 10**4, 210),  # small graph: tasks sized to scan enough edges
+        (1000, 4, 10, 250),  # tiny graph: one task per worker
+        (3, 8, 10**8, 1),
+    ],
+)
+def test_get_chunksize(n_origins, n_workers, n_edges, expected):
+    assert graph.get_chunksize(n_origins, n_workers, n_edges) == expected
+
+
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_correct_labels(config, gtfs_data_preprocessed, connectors_data, tmpdir, engine):
+    if engine == "graph_tool":
+        pytest.importorskip("graph_tool")
+    config.shortest_path_engine = engine
     origins = pd.read_csv(config.path_origins, index_col=0)
     destinations = pd.read_csv(config.path_destinations, index_col=0)
     config.path_outputs = tmpdir
@@ -90,3 +182,245 @@ def test_correct_labels(config, gtfs_data_preprocessed, connectors_data, tmpdir)
 
     assert list(distmat.index) == list(origins.index)
     assert list(distmat.columns) == list(destinations.index)
+
+
+@pytest.mark.parametrize("engine", ["dag", "csa"])
+def test_engine_matches_graph_tool(config, gtfs_data_preprocessed, connectors_data, tmpdir, engine):
+    pytest.importorskip("graph_tool")
+    config.path_outputs = tmpdir
+    distmats = {}
+    for x in ["graph_tool", engine]:
+        config.shortest_path_engine = x
+        distmats[x] = graph.main(
+            config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data
+        )
+
+    pd.testing.assert_frame_equal(distmats[engine], distmats["graph_tool"], check_dtype=False)
+
+
+def test_missing_graph_tool_fails(config, gtfs_data_preprocessed, connectors_data, tmpdir, mocker):
+    mocker.patch.object(graph, "Graph", None)
+    config.path_outputs = tmpdir
+    config.shortest_path_engine = "graph_tool"
+    with pytest.raises(ImportError, match="csa engine"):
+        graph.main(config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data)
+
+
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_stops_mode_matches_origins_mode(
+    config, gtfs_data_preprocessed, connectors_data, tmpdir, engine
+):
+    if engine == "graph_tool":
+        pytest.importorskip("graph_tool")
+    config.path_outputs = tmpdir
+    config.shortest_path_engine = engine
+    distmats = {}
+    for x in ["origins", "stops"]:
+        config.shortest_path_mode = x
+        distmats[x] = graph.main(
+            config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data
+        )
+
+    assert np.isfinite(distmats["origins"].values).sum() > 0
+    pd.testing.assert_frame_equal(distmats["stops"], distmats["origins"])
+
+
+@pytest.mark.parametrize(
+    "n_onodes,n_dnodes,direction,expected",
+    [
+        (100, 10, "auto", "backward"),
+        (10, 100, "auto", "forward"),
+        (10, 10, "auto", "forward"),
+        (100, 10, "forward", "forward"),
+        (10, 100, "backward", "backward"),
+    ],
+)
+def test_get_search_direction(n_onodes, n_dnodes, direction, expected):
+    assert graph.get_search_direction(n_onodes, n_dnodes, direction) == expected
+
+
+@pytest.mark.parametrize("sharing,n_workers", [("fork", 1), ("fork", 2), ("disk", 2)])
+def test_get_distance_matrix_reverse(small_graph, sharing, n_workers, tmpdir):
+    distmat = graph.get_shortest_distances(
+        small_graph,
+        [2, 0, 1],
+        [3, 1],
+        sharing=sharing,
+        n_workers=n_workers,
+        chunksize=1,
+        path_tmp=tmpdir,
+        reverse=True,
+    )
+    pd.testing.assert_frame_equal(
+        distmat, graph.get_shortest_distances(small_graph, [2, 0, 1], [3, 1], n_workers=1)
+    )
+
+
+@pytest.mark.parametrize("mode", ["origins", "stops"])
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_backward_search_matches_forward(
+    config, gtfs_data_preprocessed, connectors_data, tmpdir, engine, mode
+):
+    if engine == "graph_tool":
+        pytest.importorskip("graph_tool")
+    config.path_outputs = tmpdir
+    config.shortest_path_engine = engine
+    config.shortest_path_mode = mode
+    distmats = {}
+    for x in ["forward", "backward"]:
+        config.shortest_path_direction = x
+        distmats[x] = graph.main(
+            config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data
+        )
+
+    assert np.isfinite(distmats["forward"].values).sum() > 0
+    pd.testing.assert_frame_equal(distmats["backward"], distmats["forward"])
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_get_distance_matrix_explored(small_graph, reverse):
+    distmat, explored = graph.get_shortest_distances(
+        small_graph, [0, 1], [3], n_workers=1, reverse=reverse, return_explored=True
+    )
+    np.testing.assert_equal(distmat.values, [[24], [15]])
+    assert list(explored.index) == ([3] if reverse else [0, 1])
+    assert list(explored) == ([4] if reverse else [4, 2])
+
+
+@pytest.mark.parametrize("mode", ["origins", "stops"])
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_early_stop_matches(
+    config, gtfs_data_preprocessed, connectors_data, tmpdir, engine, mode, caplog
+):
+    if engine == "graph_tool":
+        pytest.importorskip("graph_tool")
+    config.path_outputs = tmpdir
+    config.shortest_path_engine = engine
+    config.shortest_path_mode = mode
+    distmats = {}
+    for x in [False, True]:
+        config.shortest_path_early_stop = x
+        distmats[x] = graph.main(
+            config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data
+        )
+
+    assert "nodes per search" in caplog.text
+    pd.testing.assert_frame_equal(distmats[True], distmats[False])
+
+
+def test_contract_chains():
+    # trip 0 -> 1 -> 2 -> 3, with stop 1 and 2 passed through, and a transfer 3 -> 4
+    edges = {
+        "ods": np.array([[0, 1], [1, 2], [2, 3], [3, 4], [5, 0], [4, 6]], dtype=np.int32),
+        "ivt": np.array([10, 20, 30, 0, 0, 0], dtype=np.uint16),
+        "transfer": np.array([0, 0, 0, 1, 0, 0], dtype=np.uint8),
+        "gc": np.array([10, 20, 30, 5, 7, 9], dtype=np.int32),
+    }
+    contracted, node_ids = graph.contract_chains(edges, n_stop_times=5)
+
+    np.testing.assert_equal(node_ids, [0, -1, -1, 1, 2, 3, 4])
+    np.testing.assert_equal(contracted["ods"], [[0, 1], [1, 2], [3, 0], [2, 4]])
+    np.testing.assert_equal(contracted["ivt"], [60, 0, 0, 0])
+    np.testing.assert_equal(contracted["gc"], [60, 5, 7, 9])
+    assert contracted["ivt"].dtype == np.uint16
+    assert contracted["ods"].dtype == np.int32
+
+
+def test_contract_chains_keeps_distances():
+    rng = np.random.default_rng(0)
+    # 20 trips of 10 stops, with transfers and access/egress at random stops
+    n = 200
+    ivt = np.column_stack([np.arange(n), np.arange(n) + 1])[np.arange(n) % 10 < 9]
+    transfers = np.sort(rng.integers(0, n, (30, 2)), axis=1)
+    transfers = transfers[transfers[:, 0] < transfers[:, 1]]
+    access = np.column_stack([rng.integers(n, n + 5, 20), rng.integers(0, n, 20)])
+    egress = np.column_stack([rng.integers(0, n, 20), rng.integers(n + 5, n + 10, 20)])
+    ods = np.concatenate([ivt, transfers, access, egress])
+    edges = {
+        "ods": ods.astype(np.int32),
+        "transfer": (np.arange(len(ods)) >= len(ivt)).astype(np.uint8),
+        "gc": rng.integers(0, 100, len(ods)).astype(np.int32),
+    }
+    contracted, node_ids = graph.contract_chains(edges, n_stop_times=n)
+    assert (node_ids < 0).sum() > 50
+
+    onodes, dnodes = list(range(n, n + 5)), list(range(n + 5, n + 10))
+    expected = dag.get_shortest_distances(
+        dag.DAG.from_edges(edges["ods"], edges["gc"], n + 10), onodes, dnodes
+    )
+    distmat = dag.get_shortest_distances(
+        dag.DAG.from_edges(contracted["ods"], contracted["gc"], node_ids.max() + 1),
+        node_ids[onodes].tolist(),
+        node_ids[dnodes].tolist(),
+    )
+    np.testing.assert_equal(distmat.values, expected.values)
+
+
+@pytest.mark.parametrize("mode", ["origins", "stops"])
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_contract_chains_matches(
+    config, gtfs_data_preprocessed, connectors_data, tmpdir, engine, mode, caplog
+):
+    if engine == "graph_tool":
+        pytest.importorskip("graph_tool")
+    config.path_outputs = tmpdir
+    config.shortest_path_engine = engine
+    config.shortest_path_mode = mode
+    distmats = {}
+    for x in [False, True]:
+        config.graph_contract_chains = x
+        distmats[x] = graph.main(
+            config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data
+        )
+
+    assert "pass-through stop times" in caplog.text
+    pd.testing.assert_frame_equal(distmats[True], distmats[False])
+
+
+def test_get_nearest_distances():
+    ods = np.array([[0, 2], [1, 2], [2, 3], [3, 4], [1, 4]])
+    weights = np.array([5, 1, 2, 3, 10])
+    np.testing.assert_equal(
+        graph.get_nearest_distances(ods, weights, [0, 1], 6), [0, 0, 1, 3, 6, np.inf]
+    )
+    np.testing.assert_equal(
+        graph.get_nearest_distances(ods, weights, [0, 1], 6, max_dist=5),
+        [0, 0, 1, 3, np.inf, np.inf],
+    )
+
+
+def test_prune_unreachable():
+    # origin 5 -> 0 -> 1 -> 2 -> destination 6, with a detour 0 -> 3 -> 2 and a dead end 4
+    edges = {
+        "ods": np.array([[5, 0], [0, 1], [1, 2], [2, 6], [0, 3], [3, 2], [1, 4]], dtype=np.int32),
+        "gc": np.array([1, 1, 1, 1, 5, 5, 1], dtype=np.int32),
+    }
+    pruned, node_ids = graph.prune_unreachable(edges, [5], [6], n_stop_times=5, max_dist=6)
+
+    np.testing.assert_equal(node_ids, [0, 1, 2, -1, -1, 3, 4])
+    np.testing.assert_equal(pruned["ods"], [[3, 0], [0, 1], [1, 2], [2, 4]])
+    np.testing.assert_equal(pruned["gc"], [1, 1, 1, 1])
+    assert pruned["ods"].dtype == np.int32
+
+
+@pytest.mark.parametrize("contract", [False, True])
+@pytest.mark.parametrize("mode", ["origins", "stops"])
+@pytest.mark.parametrize("engine", ["graph_tool", "dag", "csa"])
+def test_prune_unreachable_matches(
+    config, gtfs_data_preprocessed, connectors_data, tmpdir, engine, mode, contract, caplog
+):
+    if engine == "graph_tool":
+        pytest.importorskip("graph_tool")
+    config.path_outputs = tmpdir
+    config.shortest_path_engine = engine
+    config.shortest_path_mode = mode
+    config.graph_contract_chains = contract
+    distmats = {}
+    for x in [False, True]:
+        config.graph_prune_unreachable = x
+        distmats[x] = graph.main(
+            config=config, gtfs_data=gtfs_data_preprocessed, connectors_data=connectors_data
+        )
+
+    assert "stop times and" in caplog.text
+    pd.testing.assert_frame_equal(distmats[True], distmats[False])
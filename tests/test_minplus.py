@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gtfs_skims import minplus
+
+
+@pytest.fixture()
+def legs() -> dict:
+    """Random access legs, boarding to alighting distances and egress legs."""
+    rng = np.random.default_rng(0)
+    core = rng.integers(0, 1000, (30, 20)).astype(float)
+    core[rng.random(core.shape) < 0.3] = np.inf
+    access_ods = np.column_stack([rng.integers(0, 50, 200), rng.integers(100, 130, 200)])
+    egress_ods = np.column_stack([rng.integers(200, 220, 100), rng.integers(300, 340, 100)])
+    return {
+        "access": (access_ods, rng.integers(0, 300, 200)),
+        "core": pd.DataFrame(core, index=range(100, 130), columns=range(200, 220)),
+        "egress": (egress_ods, rng.integers(0, 300, 100)),
+    }
+
+
+def get_distances_brute_force(access, core, egress, onodes, dnodes) -> np.ndarray:
+    expected = pd.DataFrame(np.inf, index=onodes, columns=dnodes)
+    for (o, b), wa in zip(*access):
+        for (a, d), we in zip(*egress):
+            if o in expected.index and d in expected.columns:
+                expected.loc[o, d] = min(expected.loc[o, d], wa + core.loc[b, a] + we)
+    return expected.values
+
+
+def test_min_plus():
+    dist = np.array([[0.0, 5], [3, np.inf], [1, 1]])
+    out = minplus.min_plus(
+        dist, np.array([0, 1, 2, 0]), np.array([10, 1, 2, 0]), np.array([1, 1, 3, 3]), 4
+    )
+    np.testing.assert_equal(out, [[np.inf, np.inf], [4, 15], [np.inf, np.inf], [0, 3]])
+
+
+@pytest.mark.parametrize("memory_mb", [None, 1e-5])
+def test_compose_matches_brute_force(legs, memory_mb):
+    onodes, dnodes = list(range(45, -1, -1)), list(range(300, 340))
+    distmat = minplus.compose(**legs, onodes=onodes, dnodes=dnodes, memory_mb=memory_mb)
+    assert list(distmat.index) == onodes
+    assert list(distmat.columns) == dnodes
+    np.testing.assert_equal(
+        distmat.values, get_distances_brute_force(**legs, onodes=onodes, dnodes=dnodes)
+    )
+
+
+@pytest.mark.parametrize("n_origins,n_destinations", [(50, 2), (2, 40)])
+def test_compose_orders_match(legs, n_origins, n_destinations):
+    """Both association orders (egress or access first) give the same distances."""
+    onodes, dnodes = list(range(n_origins)), list(range(300, 300 + n_destinations))
+    distmat = minplus.compose(**legs, onodes=onodes, dnodes=dnodes, max_dist=800)
+    expected = get_distances_brute_force(**legs, onodes=onodes, dnodes=dnodes)
+    expected[expected > 800] = np.inf
+    np.testing.assert_equal(distmat.values, expected)
@@ -68,3 +68,28 @@ def test_run_preprocessing_demo(config, tmpdir):
     preprocessing.main(config)
     for x in ["calendar", "routes", "stops", "stop_times", "trips"]:
         assert os.path.exists(os.path.join(path_outputs, f"{x}.parquet.gzip"))
+
+
+def test_read_filtered_matches_filtering(gtfs_data, config):
+    preprocessing.filter_day(gtfs_data, config.calendar_date)
+    preprocessing.filter_time(gtfs_data, config.start_s, config.end_s)
+
+    gtfs_data_streamed = preprocessing.read_gtfs_filtered(
+        config.path_gtfs, config.calendar_date, config.start_s, config.end_s, block_size=2**12
+    )
+    assert len(gtfs_data_streamed.stop_times) == len(gtfs_data.stop_times)
+    preprocessing.filter_day(gtfs_data_streamed, config.calendar_date)
+    preprocessing.filter_time(gtfs_data_streamed, config.start_s, config.end_s)
+
+    for x in ["calendar", "routes", "stops", "stop_times", "trips"]:
+        pd.testing.assert_frame_equal(
+            getattr(gtfs_data, x).reset_index(drop=True),
+            getattr(gtfs_data_streamed, x).reset_index(drop=True),
+        )
+
+
+def test_run_preprocessing_streaming(config, tmpdir):
+    config.path_outputs = os.path.join(tmpdir, "outputs")
+    config.stream_stop_times = True
+    data = preprocessing.main(config)
+    assert data.stop_times["departure_s"].max() <= config.end_s
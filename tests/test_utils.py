@@ -1,8 +1,14 @@
 import os
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pytest
 from gtfs_skims import utils
 
+TEST_DATA_DIR = os.path.join(Path(__file__).parent, "test_data")
+
 
 def test_parse_timestamp():
     assert utils.ts_to_sec("00:00:00") == 0
@@ -32,3 +38,122 @@ def test_cache_gtfs(gtfs_data, tmpdir):
     gtfs_cached = utils.GTFSData.from_parquet(tmpdir)
     for x in ["calendar", "routes", "stops", "stop_times", "trips"]:
         pd.testing.assert_frame_equal(getattr(gtfs_data, x), getattr(gtfs_cached, x))
+
+
+@pytest.mark.parametrize("fmt", ["parquet.gzip", "parquet.zstd", "parquet", "arrow"])
+def test_cache_gtfs_formats(gtfs_data, tmpdir, fmt):
+    gtfs_data.save(tmpdir, fmt=fmt)
+    assert os.path.exists(os.path.join(tmpdir, f"stop_times.{fmt}"))
+    gtfs_cached = utils.GTFSData.from_parquet(tmpdir, fmt=fmt)
+    for x in ["calendar", "routes", "stops", "stop_times", "trips"]:
+        pd.testing.assert_frame_equal(getattr(gtfs_data, x), getattr(gtfs_cached, x))
+
+
+def test_load_gtfs_prunes_columns(gtfs_data):
+    assert list(gtfs_data.stop_times.columns) == [
+        "trip_id",
+        "arrival_s",
+        "departure_s",
+        "stop_id",
+        "stop_sequence",
+    ]
+    assert "stop_name" not in gtfs_data.stops.columns
+
+
+def test_load_gtfs_parses_times(gtfs_data):
+    assert gtfs_data.stop_times["departure_s"].iloc[0] == utils.ts_to_sec("09:30:00")
+    assert gtfs_data.stop_times["arrival_s"].dtype == np.float32
+
+
+def test_load_gtfs_compacts_ids(gtfs_data):
+    # numeric ids are stored as small integers
+    assert gtfs_data.trips["trip_id"].dtype == np.uint16
+    # ... while non-numeric ids are categorical, with the same categories across tables
+    assert isinstance(gtfs_data.stops["stop_id"].dtype, pd.CategoricalDtype)
+    assert gtfs_data.stops["stop_id"].dtype == gtfs_data.stop_times["stop_id"].dtype
+
+
+@pytest.mark.parametrize(
+    "stop_ids", [["1", "01", "2"], ["1", None, "2"], ["1", "+2", "3"], ["1", " 2", "3"]]
+)
+def test_compact_ids_keeps_non_canonical_ids(stop_ids):
+    ids = utils.compact_ids({"stops": pa.table({"stop_id": stop_ids})})
+    assert isinstance(ids["stops.stop_id"].dtype, pd.CategoricalDtype)
+    assert ids["stops.stop_id"].astype(object).where(lambda x: x.notna(), None).tolist() == stop_ids
+
+
+def test_compact_ids_numeric():
+    ids = utils.compact_ids({"stops": pa.table({"stop_id": ["10", "2"]})})
+    assert ids["stops.stop_id"].dtype == np.uint8
+    assert ids["stops.stop_id"].tolist() == [10, 2]
+
+
+def test_load_gtfs_pandas_engine():
+    gtfs_data = utils.GTFSData.from_gtfs(
+        os.path.join(TEST_DATA_DIR, "iow-bus-gtfs.zip"), engine="pandas"
+    )
+    assert "departure_time" in gtfs_data.stop_times.columns
+    assert gtfs_data.stop_times["trip_id"].dtype == np.int64
+
+
+def test_parse_times_blank():
+    times = pa.chunked_array([["09:00:00", None, "25:00:01", ""]])
+    np.testing.assert_equal(utils.parse_times(times), [32400, np.nan, 90001, np.nan])
+
+
+def test_parse_times_matches_timestamp_parser():
+    np.random.seed(0)
+    seconds = np.random.randint(0, 48 * 3600, 1000)
+    timestamps = [f"{x // 3600:02d}:{x % 3600 // 60:02d}:{x % 60:02d}" for x in seconds]
+    timestamps += ["9:05:00", " 10:00:00", "100:00:00"]
+    expected = [utils.ts_to_sec(x) for x in timestamps]
+    np.testing.assert_equal(utils.parse_times(pa.array(timestamps)), expected)
+
+
+@pytest.mark.parametrize("timestamp", ["9:00", "09-00-00", "ab:cd:ef", "1234:00:00"])
+def test_parse_times_invalid(timestamp):
+    with pytest.raises(ValueError, match="Invalid timestamp"):
+        utils.parse_times(pa.array(["09:00:00", timestamp]))
+
+
+@pytest.mark.parametrize(
+    "values,dtypes,expected",
+    [
+        ([0, 65535], [np.uint16, np.uint32], np.uint16),
+        ([0, 65536], [np.uint16, np.uint32], np.uint32),
+        ([1.0, 2.0], [np.uint16], np.uint16),
+        ([1.0, 2.5], [np.uint16, np.float64], np.float64),
+        ([1.0, 2**24], [np.float32], np.float32),
+    ],
+)
+def test_narrow_to_most_compact_type(values, dtypes, expected):
+    narrowed = utils.narrow(np.array(values), dtypes)
+    assert narrowed.dtype == expected
+    np.testing.assert_equal(narrowed, values)
+
+
+def test_narrow_out_of_range_fails():
+    with pytest.raises(ValueError, match="node ids"):
+        utils.narrow(np.array([0, 2**31]), [np.int32], "node ids")
+
+
+@pytest.mark.parametrize(
+    "files,expected",
+    [
+        ({}, 4),
+        ({"cpu.max": "max 100000"}, 4),
+        ({"cpu.max": "200000 100000"}, 2),
+        ({"cpu.max": "150000 100000"}, 2),
+        ({"cpu.max": "1000000 100000"}, 4),
+        ({"cpu.max": "10000 100000"}, 1),
+        ({"cpu/cpu.cfs_quota_us": "300000", "cpu/cpu.cfs_period_us": "100000"}, 3),
+        ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"}, 4),
+    ],
+)
+def test_get_cpu_limit(mocker, tmp_path, files, expected):
+    mocker.patch("os.sched_getaffinity", return_value={0, 1, 2, 3}, create=True)
+    for name, content in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(content + "\n")
+    assert utils.get_cpu_limit(str(tmp_path)) == expected